@@ -0,0 +1,148 @@
+import re
+from functools import lru_cache
+from typing import Dict
+from ipnd import record
+
+STATES = ("ACT", "NSW", "NT", "QLD", "SA", "TAS", "VIC", "WA")
+
+# Street types as written in full, and the abbreviations they are stored as
+STREET_TYPES = {
+    "ALLEY": "ALLY",
+    "AVENUE": "AV",
+    "BOULEVARD": "BVD",
+    "CIRCUIT": "CCT",
+    "CLOSE": "CL",
+    "COURT": "CT",
+    "CRESCENT": "CR",
+    "DRIVE": "DR",
+    "ESPLANADE": "ESP",
+    "GROVE": "GR",
+    "HIGHWAY": "HWY",
+    "LANE": "LANE",
+    "PARADE": "PDE",
+    "PLACE": "PL",
+    "ROAD": "RD",
+    "SQUARE": "SQ",
+    "STREET": "ST",
+    "TERRACE": "TCE",
+    "WAY": "WAY",
+}
+
+
+def _codes(enum: Dict[str, str]) -> Dict[str, str]:
+    """
+    Map both the codes of an enum and its descriptions, as they'd be written
+    in an address, to the codes
+    """
+    codes = {code: code for code in enum}
+
+    for code, description in enum.items():
+        if "/" not in description:
+            codes.setdefault(description.upper(), code)
+
+    return codes
+
+
+BUILDING_TYPES = _codes(record.BuildingType.ENUM)
+FLOOR_TYPES = _codes(record.BuildingFloorType.ENUM)
+STREET_SUFFIXES = _codes(record.StreetSuffix.ENUM)
+STREET_TYPE_CODES = dict(STREET_TYPES, **{v: v for v in STREET_TYPES.values()})
+
+
+def _choice(words) -> str:
+    # Longest first, so "NORTH EAST" is tried before "NORTH"
+    return "|".join(re.escape(w) for w in sorted(words, key=len, reverse=True))
+
+
+ADDRESS = re.compile(
+    r"""
+    ^(?:(?P<building_type>{building})\ (?P<building_num>\d+[A-Z]?)\ ?,?\ )?
+    (?:(?P<floor_type>{floor})\ (?P<floor>\d+[A-Z]?)\ ?,?\ )?
+    (?:(?P<unit>\d+[A-Z]?)\ ?/\ ?)?
+    (?:(?P<house>\d+[A-Z]{{0,3}})(?:\ ?-\ ?(?P<house_2>\d+[A-Z]?))?\ )?
+    (?P<street_name>[A-Z0-9'\ \-]+?)\ (?P<street_type>{street_type})
+    (?:\ (?P<street_suffix>{suffix}))?
+    (?:\ ?,?\ (?P<locality>[A-Z][A-Z'\ .\-]*?))?
+    (?:\ ?,?\ (?P<state>{state}))?
+    (?:\ ?,?\ (?P<postcode>\d{{4}}))?$
+    """.format(
+        building=_choice(BUILDING_TYPES),
+        floor=_choice(FLOOR_TYPES),
+        street_type=_choice(STREET_TYPE_CODES),
+        suffix=_choice(STREET_SUFFIXES),
+        state=_choice(STATES),
+    ),
+    re.VERBOSE,
+)
+
+
+def normalise_address(text: str) -> str:
+    text = re.sub(r"\s*,\s*", ", ", text.strip().upper())
+    return re.sub(r"\s+", " ", text).strip(" ,.")
+
+
+@lru_cache(maxsize=65536)
+def _parse(text: str) -> record.Address:
+    match = ADDRESS.match(text)
+
+    if match is None:
+        raise record.ValidationError("Can't parse address: {}".format(text))
+
+    parts = match.groupdict()
+    address: record.Address
+
+    if parts["building_type"] or parts["floor_type"] or parts["unit"]:
+        address = record.BuildingAddress()
+
+        # A floor alone, such as "Level 2, 45 Smith St", has no subunit
+        if parts["building_type"] or parts["unit"]:
+            building_type = parts["building_type"] or "UNIT"
+            address.building_subunit = record.BuildingSubUnit(
+                building_type=BUILDING_TYPES[building_type],
+                street_no=parts["building_num"] or parts["unit"],
+            )
+
+        if parts["floor_type"]:
+            address.building_floor = record.BuildingFloor(
+                floor=parts["floor"], floor_type=FLOOR_TYPES[parts["floor_type"]]
+            )
+    else:
+        address = record.HouseAddress()
+
+    if parts["house"]:
+        address.house_number_subunit = record.HouseNumberSubunit(
+            house_no=parts["house"], house_no_secondary=parts["house_2"]
+        )
+
+    address.set_street_name(
+        parts["street_name"],
+        STREET_TYPE_CODES[parts["street_type"]],
+        STREET_SUFFIXES[parts["street_suffix"]] if parts["street_suffix"] else "",
+    )
+
+    if parts["locality"] or parts["postcode"]:
+        address.set_locality(
+            parts["postcode"] or "", parts["locality"] or "", parts["state"]
+        )
+
+    # Instances are shared between every caller parsing the same address
+    return address.freeze()
+
+
+def parse_address(text: str) -> record.Address:
+    """
+    Parse a free text address such as "Unit 3, Level 2, 45A Smith Street
+    North, Canberra ACT 2600" or "3/45 Smith St, Canberra ACT 2600" into a
+    frozen `HouseAddress` or `BuildingAddress`. Commas are optional but
+    separate a street suffix from a locality starting with the same word.
+
+    Results are cached by the normalised text, so repeated addresses are
+    parsed once; call `clear_cache()` after changing
+    `record.Address.gazetteer`.
+    :param text:
+    """
+    return _parse(normalise_address(text))
+
+
+def clear_cache():
+    _parse.cache_clear()
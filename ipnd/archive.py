@@ -0,0 +1,219 @@
+import gzip
+import json
+from typing import Iterator, List, NamedTuple, Optional
+from .blocks import BlockFile
+from .layout import ROW_SIZE
+from .writer import ENCODING
+
+
+class Block(NamedTuple):
+    offset: int
+    first_row: int
+    rows: int
+    low: str
+    high: str
+
+
+class ArchiveWriter:
+    """
+    Write rows to an archive of independently compressed blocks (see
+    `blocks.BlockFile`) of `block_rows` rows. A JSON sidecar index (`path` +
+    ".idx") records each block's position, first row and PublicNumber range,
+    along with the header and footer of the archived file.
+    """
+
+    def __init__(self, path: str, block_rows: int = 1000, level: int = 6):
+        self.path = path
+        self.block_rows = block_rows
+
+        self.header: Optional[str] = None
+        self.footer: Optional[str] = None
+        self.blocks: List[Block] = []
+
+        self._blocks = BlockFile(path, "w", level=level)
+        self._rows: List[str] = []
+        self._count = 0
+
+    def write_row(self, row: str):
+        self._rows.append(row)
+
+        if len(self._rows) >= self.block_rows:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+
+        offset = self._blocks.append("".join(self._rows).encode(ENCODING, "replace"))
+        keys = [row[0:20].rstrip() for row in self._rows]
+
+        self.blocks.append(
+            Block(
+                offset=offset,
+                first_row=self._count,
+                rows=len(self._rows),
+                low=min(keys),
+                high=max(keys),
+            )
+        )
+
+        self._count += len(self._rows)
+        self._rows = []
+
+    def close(self):
+        self._flush()
+        self._blocks.close()
+
+        with open(self.path + ".idx", "w") as fp:
+            json.dump(
+                {
+                    "header": self.header,
+                    "footer": self.footer,
+                    "rows": self._count,
+                    "blocks": [b._asdict() for b in self.blocks],
+                },
+                fp,
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _read_records(path: str) -> Iterator[str]:
+    """
+    Records of a plain or gzipped IPND file, read sequentially
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+
+    with opener(path, "rb") as fp:
+        buffer = fp.read(ROW_SIZE + 2)
+
+        if buffer[ROW_SIZE:] == b"\r\n":
+            stride = ROW_SIZE + 2
+        elif buffer[ROW_SIZE : ROW_SIZE + 1] == b"\n":
+            stride = ROW_SIZE + 1
+        else:
+            stride = ROW_SIZE
+
+        while True:
+            offset = 0
+            while len(buffer) - offset >= ROW_SIZE:
+                yield buffer[offset : offset + ROW_SIZE].decode(ENCODING)
+                offset += stride
+            buffer = buffer[offset:]
+
+            data = fp.read(stride * 1024)
+            if not data:
+                return
+            buffer += data
+
+
+def archive_file(path: str, archive_path: str, block_rows: int = 1000):
+    """
+    Archive an IPND file, which may be gzipped
+    :param path: IPND file
+    :param archive_path:
+    :param block_rows: rows per compressed block
+    """
+    with ArchiveWriter(archive_path, block_rows) as archive:
+        previous = None
+
+        for record in _read_records(path):
+            if archive.header is None:
+                archive.header = record
+                continue
+
+            if previous is not None:
+                archive.write_row(previous)
+            previous = record
+
+        archive.footer = previous
+
+
+class ArchiveReader:
+    """
+    Random access to an archive: reading a row or looking up a number only
+    decompresses the blocks that can hold it (a single block when the archived
+    file was sorted by number). Recently used blocks are cached.
+    """
+
+    def __init__(self, path: str, cache_size: int = 8):
+        with open(path + ".idx") as fp:
+            index = json.load(fp)
+
+        self.header: Optional[str] = index["header"]
+        self.footer: Optional[str] = index["footer"]
+        self.rows: int = index["rows"]
+        self.blocks = [Block(**b) for b in index["blocks"]]
+
+        self._blocks = BlockFile(path, "r", cache_size=cache_size)
+
+    def _read_block(self, n: int) -> bytes:
+        return self._blocks.read(self.blocks[n].offset)
+
+    def _find_block(self, row: int) -> int:
+        left, right = 0, len(self.blocks) - 1
+
+        while left < right:
+            middle = (left + right + 1) // 2
+            if self.blocks[middle].first_row <= row:
+                left = middle
+            else:
+                right = middle - 1
+
+        return left
+
+    def row(self, n: int) -> str:
+        """
+        Row `n`, counting from 0 after the header
+        :param n:
+        """
+        if n < 0 or n >= self.rows:
+            raise IndexError("Row {} out of range".format(n))
+
+        b = self._find_block(n)
+        data = self._read_block(b)
+        offset = (n - self.blocks[b].first_row) * ROW_SIZE
+
+        return data[offset : offset + ROW_SIZE].decode(ENCODING)
+
+    def lookup(self, public_number: str) -> List[str]:
+        """
+        Every row for a number
+        :param public_number:
+        """
+        key = public_number.encode(ENCODING, "replace")
+        results = []
+
+        for n, block in enumerate(self.blocks):
+            if block.low <= public_number <= block.high:
+                data = self._read_block(n)
+
+                for offset in range(0, len(data), ROW_SIZE):
+                    if data[offset : offset + 20].rstrip() == key:
+                        results.append(
+                            data[offset : offset + ROW_SIZE].decode(ENCODING)
+                        )
+
+        return results
+
+    def iter_rows(self) -> Iterator[str]:
+        for n in range(len(self.blocks)):
+            data = self._read_block(n).decode(ENCODING)
+            for offset in range(0, len(data), ROW_SIZE):
+                yield data[offset : offset + ROW_SIZE]
+
+    def close(self):
+        self._blocks.close()
+
+    def __len__(self):
+        return self.rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
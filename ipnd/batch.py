@@ -0,0 +1,202 @@
+import time
+from datetime import datetime
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+from ipnd import record
+from .checkpoint import Checkpoint
+from .gazetteer import Gazetteer
+from .holdings import Holdings
+from .inventory import build_transaction
+from .memory import MemoryProfiler
+from .engines import Engine, Tally, merge, take
+from .writer import FileWriter, render
+
+
+class Stats(NamedTuple):
+    rows: int
+    rejected: List[Tuple[int, str]]
+    files: List[str]
+    seconds: float
+
+    @property
+    def rate(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def render_item(
+    item: Dict[str, str],
+    csp: str,
+    dp: str,
+    date: datetime,
+    gazetteer: Gazetteer = None,
+    holdings: Holdings = None,
+    engine: Union[str, Engine] = None,
+    built: Callable[[record.Transaction], None] = None,
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Render one inventory item, returning (row, None) or (None, error)
+    :param built: called with the transaction before it is rendered
+    """
+    try:
+        t = build_transaction(
+            item, csp=csp, dp=dp, date=date, gazetteer=gazetteer, holdings=holdings
+        )
+        if built is not None:
+            built(t)
+        return render(t, engine), None
+    except Exception as e:
+        return None, str(e)
+
+
+def _snapshot_once(profiler: MemoryProfiler) -> Callable[[record.Transaction], None]:
+    taken: List[bool] = []
+
+    def built(transaction):
+        if not taken:
+            profiler.snapshot("building")
+            taken.append(True)
+
+    return built
+
+
+def _chunks(items: Iterable, size: int) -> Iterator[List]:
+    items = iter(items)
+    chunk = list(islice(items, size))
+
+    while chunk:
+        yield chunk
+        chunk = list(islice(items, size))
+
+
+def _render_chunk(
+    render_one: Callable[[Dict[str, str]], Tuple[Optional[str], Optional[str]]],
+    engine: Union[str, Engine, None],
+    items: List[Dict[str, str]],
+) -> Tuple[List[Tuple[Optional[str], Optional[str]]], Optional[Tally]]:
+    """
+    Render a chunk of items in a worker, with what `engine` checked while
+    doing so if it is an `EquivalenceChecker`
+    """
+    return [render_one(item) for item in items], take(engine)
+
+
+def generate(
+    items: Iterable[Dict[str, str]],
+    writer: FileWriter,
+    csp: str,
+    dp: str,
+    processes: int = 1,
+    chunksize: int = 1000,
+    checkpoint: Checkpoint = None,
+    every: int = 10000,
+    gazetteer: Gazetteer = None,
+    holdings: Holdings = None,
+    profiler: MemoryProfiler = None,
+    engine: Union[str, Engine] = None,
+) -> Stats:
+    """
+    Render inventory items into `writer`, across `processes` worker processes.
+    Rows are written in inventory order; items that fail to build are skipped
+    and reported in the returned stats.
+    :param items:
+    :param writer:
+    :param csp: default CSPCode
+    :param dp: default DPCode
+    :param processes: worker processes, 1 renders in this process
+    :param chunksize: items sent to a worker at a time
+    :param checkpoint: resume from and save progress to this checkpoint
+    :param every: items between checkpoints
+    :param gazetteer: validate localities against this, in every worker
+    :param holdings: reject numbers we don't hold, in every worker
+    :param profiler: record memory used while rendering and closing; in
+        this process, records are counted while the first item is built
+    :param engine: rendering engine or its name, see `ipnd.engines`; with
+        several processes it is sent to each, so must be picklable. An
+        `EquivalenceChecker` gets the counts of checks made in every worker
+    """
+    start = time.monotonic()
+    offset, rows, rejected = 0, 0, []
+
+    state = checkpoint.load() if checkpoint is not None else None
+
+    if state is not None:
+        # The writer's date is restored too, so resumed output is identical
+        writer.restore(state["writer"])
+        offset, rows = state["offset"], state["rows"]
+        rejected = [tuple(r) for r in state["rejected"]]
+        items = islice(items, offset, None)
+
+    render_one = partial(
+        render_item,
+        csp=csp,
+        dp=dp,
+        date=writer.date,
+        gazetteer=gazetteer,
+        holdings=holdings,
+        engine=engine,
+    )
+
+    def write(results):
+        nonlocal rows
+
+        for n, (row, error) in enumerate(results, offset):
+            if row is None:
+                rejected.append((n, error))
+            else:
+                writer.write_row(row)
+                rows += 1
+
+            if checkpoint is not None and (n + 1) % every == 0:
+                checkpoint.save(
+                    {
+                        "offset": n + 1,
+                        "rows": rows,
+                        "rejected": rejected,
+                        "writer": writer.get_state(),
+                    }
+                )
+
+    profiler = profiler if profiler is not None else MemoryProfiler(enabled=False)
+
+    with profiler.stage("render"):
+        if processes == 1:
+            if profiler.enabled:
+                # Records only live while their item is rendered
+                render_one = partial(render_one, built=_snapshot_once(profiler))
+            write(map(render_one, items))
+        else:
+            render_chunk = partial(_render_chunk, render_one, engine)
+
+            def results(pool):
+                chunks = _chunks(items, chunksize)
+                for chunk, tally in pool.imap(render_chunk, chunks):
+                    merge(engine, tally)
+                    yield from chunk
+
+            with Pool(processes) as pool:
+                write(results(pool))
+
+    with profiler.stage("close"):
+        writer.close()
+
+    if checkpoint is not None:
+        checkpoint.clear()
+
+    return Stats(
+        rows=rows,
+        rejected=rejected,
+        files=list(writer.files),
+        seconds=time.monotonic() - start,
+    )
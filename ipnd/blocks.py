@@ -0,0 +1,78 @@
+import os
+import struct
+import zlib
+from collections import OrderedDict
+
+BLOCK_HEADER = struct.Struct(">I")
+
+_MODES = {"r": "rb", "a": "a+b", "w": "w+b"}
+
+
+class BlockFile:
+    """
+    A file of independently zlib compressed blocks, each prefixed with its
+    compressed length. Blocks are appended, and read back by the offset
+    `append` returned; the `cache_size` most recently read blocks are kept
+    decompressed.
+    """
+
+    def __init__(
+        self, path: str, mode: str = "a", cache_size: int = 16, level: int = 6
+    ):
+        """
+        :param path:
+        :param mode: "r" to read, "a" to read and append, or "w" to start empty
+        :param cache_size: decompressed blocks to keep
+        :param level: zlib compression level
+        """
+        if mode not in _MODES:
+            raise ValueError("mode must be one of {}".format(", ".join(_MODES)))
+
+        self.path = path
+        self.cache_size = cache_size
+        self.level = level
+
+        self._fp = open(path, _MODES[mode])
+        self._cache: OrderedDict = OrderedDict()
+
+    def append(self, data: bytes) -> int:
+        """
+        Compress and write a block, returning its offset
+        :param data:
+        """
+        compressed = zlib.compress(data, self.level)
+
+        offset = self._fp.seek(0, os.SEEK_END)
+        self._fp.write(BLOCK_HEADER.pack(len(compressed)))
+        self._fp.write(compressed)
+        self._fp.flush()
+
+        return offset
+
+    def read(self, offset: int) -> bytes:
+        """
+        The decompressed block at `offset`
+        :param offset:
+        """
+        if offset in self._cache:
+            self._cache.move_to_end(offset)
+            return self._cache[offset]
+
+        self._fp.seek(offset)
+        (length,) = BLOCK_HEADER.unpack(self._fp.read(BLOCK_HEADER.size))
+        block = zlib.decompress(self._fp.read(length))
+
+        self._cache[offset] = block
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+        return block
+
+    def close(self):
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,34 @@
+import json
+import os
+from typing import Dict, Optional
+
+
+class Checkpoint:
+    """
+    Progress of a long run, saved as JSON. Saves replace the file atomically
+    so a crash leaves either the previous or the new checkpoint.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Optional[Dict]:
+        if not os.path.exists(self.path):
+            return None
+
+        with open(self.path) as fp:
+            return json.load(fp)
+
+    def save(self, state: Dict):
+        tmp = self.path + ".tmp"
+
+        with open(tmp, "w") as fp:
+            json.dump(state, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,451 @@
+import argparse
+import sys
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
+from .batch import generate
+from .checkpoint import Checkpoint
+from .columns import count_files
+from .daemon import Daemon, MicroBatcher
+from .diff import ADDED, REMOVED, diff_files
+from .engines import ENGINES
+from .export import get_fields, write_csv, write_jsonl
+from .fanout import FanOutWriter
+from .gazetteer import Gazetteer
+from .holdings import Holdings
+from .inventory import read_inventory
+from .memory import MemoryProfiler
+from .reader import IPNDFile
+from .scheduler import Scheduler
+from .shard import generate_shard, merge_segments
+from .verify import verify_many
+from .writer import MAX_ROWS, FileWriter, SequenceAllocator, Writer
+
+
+def verify_command(args) -> int:
+    results = verify_many(args.files, processes=args.processes)
+    status = 0
+
+    for path, errors in results.items():
+        if not errors:
+            print("{}: OK".format(path))
+            continue
+
+        status = 1
+        for error in errors:
+            print("{}:{}: {}".format(error.path, error.record, error.message))
+
+    return status
+
+
+def _parse_routes(
+    values: List[str], default_seq: Optional[int]
+) -> Tuple[Dict[str, str], Dict[str, Union[int, SequenceAllocator]]]:
+    """
+    Source for each CSPCode, and first sequence number of each source, from
+    CSP=SOURCE:SEQ values where SEQ defaults to `default_seq`
+    """
+    routes: Dict[str, str] = {}
+    seqs: Dict[str, Union[int, SequenceAllocator]] = {}
+
+    for value in values:
+        csp, _, target = value.partition("=")
+        source, _, seq = target.partition(":")
+
+        if not csp or not source:
+            raise ValueError("Invalid route {}, expected CSP=SOURCE:SEQ".format(value))
+
+        if seq:
+            first = int(seq)
+        elif default_seq is not None:
+            first = default_seq
+        else:
+            raise ValueError("No sequence number for source {}".format(source))
+
+        if seqs.get(source, first) != first:
+            raise ValueError("Conflicting sequence numbers for {}".format(source))
+
+        routes[csp] = source
+        seqs[source] = first
+
+    return routes, seqs
+
+
+def generate_command(args) -> int:
+    date = datetime.strptime(args.date, "%Y%m%d%H%M%S") if args.date else None
+
+    writer: FileWriter
+
+    if args.route:
+        try:
+            routes, seq = _parse_routes(args.route, args.seq)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+
+        writer = FanOutWriter(
+            routes,
+            seq=seq,
+            directory=args.directory,
+            date=date,
+            max_rows=args.max_rows,
+            engine=args.engine,
+        )
+    elif args.source and args.seq is None:
+        print("--seq is required with --source", file=sys.stderr)
+        return 2
+    elif args.source:
+        writer = Writer(
+            source=args.source,
+            seq=args.seq,
+            directory=args.directory,
+            date=date,
+            max_rows=args.max_rows,
+            engine=args.engine,
+        )
+    else:
+        print("Either --source or --route is required", file=sys.stderr)
+        return 2
+
+    # Enabled by the IPND_PROFILE_MEMORY environment variable
+    profiler = MemoryProfiler()
+
+    with profiler:
+        stats = generate(
+            read_inventory(args.inventory),
+            writer,
+            csp=args.csp,
+            dp=args.dp,
+            processes=args.processes,
+            chunksize=args.chunksize,
+            checkpoint=Checkpoint(args.checkpoint) if args.checkpoint else None,
+            every=args.checkpoint_every,
+            gazetteer=Gazetteer(args.gazetteer) if args.gazetteer else None,
+            holdings=Holdings.load(args.holdings) if args.holdings else None,
+            profiler=profiler,
+            engine=args.engine,
+        )
+
+    if profiler.enabled:
+        print(profiler.report(), file=sys.stderr)
+
+    for n, reason in stats.rejected:
+        print("{}:{}: {}".format(args.inventory, n + 1, reason), file=sys.stderr)
+
+    status = 1 if stats.rejected else 0
+
+    for path, errors in verify_many(stats.files, processes=args.processes).items():
+        print(path)
+        for error in errors:
+            status = 1
+            print("{}:{}: {}".format(error.path, error.record, error.message))
+
+    print(
+        "{} rows, {} rejected, {} files in {:.2f}s ({:.0f} rows/s)".format(
+            stats.rows, len(stats.rejected), len(stats.files), stats.seconds, stats.rate
+        )
+    )
+
+    return status
+
+
+def shard_command(args) -> int:
+    date = datetime.strptime(args.date, "%Y%m%d%H%M%S")
+
+    stats = generate_shard(
+        read_inventory(args.inventory),
+        shard=args.shard,
+        shards=args.shards,
+        path=args.output,
+        csp=args.csp,
+        dp=args.dp,
+        date=date,
+    )
+
+    for n, error in stats.rejected:
+        print("{}:{}: {}".format(args.inventory, n + 1, error), file=sys.stderr)
+
+    print("{}: {} rows in {:.2f}s".format(args.output, stats.rows, stats.seconds))
+
+    return 1 if stats.rejected else 0
+
+
+def merge_command(args) -> int:
+    writer = Writer(
+        source=args.source,
+        seq=SequenceAllocator(args.seq, path=args.seq_file),
+        directory=args.directory,
+        max_rows=args.max_rows,
+    )
+
+    try:
+        merge_segments(args.segments, writer)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    for path in writer.files:
+        print(path)
+
+    return 0
+
+
+def _print_bulk_error(row: str, error: Exception):
+    print("{}: {}".format(row[0:20].rstrip(), error), file=sys.stderr)
+
+
+def serve_command(args) -> int:
+    allocator = SequenceAllocator(args.seq, path=args.seq_file)
+
+    if args.priority:
+        if args.spool:
+            print("--spool can not be used with --priority", file=sys.stderr)
+            return 2
+
+        batcher = Scheduler.create(
+            source=args.source,
+            allocator=allocator,
+            directory=args.directory,
+            urgent_age=args.urgent_age,
+            bulk_age=args.max_age,
+            bulk_rows=args.max_rows,
+            max_bytes=args.max_bytes,
+            on_flush=print,
+            on_error=_print_bulk_error,
+            engine=args.engine,
+        )
+    else:
+        batcher = MicroBatcher(
+            source=args.source,
+            allocator=allocator,
+            directory=args.directory,
+            max_rows=args.max_rows,
+            max_bytes=args.max_bytes,
+            max_age=args.max_age,
+            urgent_age=args.urgent_age,
+            on_flush=print,
+            spool=args.spool,
+            engine=args.engine,
+        )
+
+    daemon = Daemon(batcher, args.socket, csp=args.csp, dp=args.dp)
+
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+def diff_command(args) -> int:
+    if args.files and (args.old or args.new):
+        print("Give either OLD NEW or --old and --new", file=sys.stderr)
+        return 2
+
+    old, new = (args.files[0:1], args.files[1:]) if args.files else (args.old, args.new)
+
+    if len(old) < 1 or len(new) < 1 or (args.files and len(args.files) != 2):
+        print("Both an old and a new file are required", file=sys.stderr)
+        return 2
+
+    status = 0
+
+    for change in diff_files(old, new, ignore=args.ignore):
+        status = 1
+
+        if change.kind == ADDED:
+            print("+ {}".format(change.public_number))
+        elif change.kind == REMOVED:
+            print("- {}".format(change.public_number))
+        else:
+            print("~ {}".format(change.public_number))
+            for name, old, new in change.fields:
+                print("    {}: {!r} -> {!r}".format(name, old, new))
+
+    return status
+
+
+def count_command(args) -> int:
+    counts = count_files(args.files, args.fields, processes=args.processes)
+
+    for key, total in sorted(counts.items(), key=lambda item: -item[1]):
+        print("{}\t{}".format(total, "\t".join(key)))
+
+    return 0
+
+
+def export_command(args) -> int:
+    fields = get_fields(args.fields or None)
+    write = write_csv if args.output.endswith(".csv") else write_jsonl
+
+    def rows():
+        for path in args.files:
+            with IPNDFile(path) as f:
+                yield from f.rows()
+
+    print("{} rows".format(write(rows(), args.output, fields)))
+
+    return 0
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="ipnd", description="Australian IPND Client")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    verify = commands.add_parser("verify", help="check IPND files are well formed")
+    verify.add_argument("files", nargs="+")
+    verify.add_argument(
+        "-p", "--processes", type=int, default=None, help="worker processes"
+    )
+    verify.set_defaults(func=verify_command)
+
+    generate = commands.add_parser(
+        "generate", help="generate IPND files from a CSV or JSON lines inventory"
+    )
+    generate.add_argument("inventory")
+    generate.add_argument("--source", help="source code")
+    generate.add_argument(
+        "--route",
+        action="append",
+        default=[],
+        metavar="CSP=SOURCE:SEQ",
+        help="write rows with this CSPCode to files for this source, starting "
+        "at sequence SEQ (--seq by default)",
+    )
+    generate.add_argument("--seq", type=int, help="first sequence")
+    generate.add_argument("--csp", required=True, help="default CSPCode")
+    generate.add_argument("--dp", required=True, help="default DPCode")
+    generate.add_argument("-d", "--directory", default=".")
+    generate.add_argument("--date", help="file date as YYYYMMDDHHMMSS")
+    generate.add_argument("--max-rows", type=int, default=MAX_ROWS)
+    generate.add_argument("-p", "--processes", type=int, default=1)
+    generate.add_argument("--chunksize", type=int, default=1000)
+    generate.add_argument(
+        "--checkpoint", help="save progress here and resume from it when restarted"
+    )
+    generate.add_argument("--checkpoint-every", type=int, default=10000)
+    generate.add_argument(
+        "--gazetteer", help="validate localities against this compiled gazetteer"
+    )
+    generate.add_argument(
+        "--holdings", help="reject numbers outside the ranges in this file"
+    )
+    generate.add_argument(
+        "--engine", choices=sorted(ENGINES), default=None, help="rendering engine"
+    )
+    generate.set_defaults(func=generate_command)
+
+    diff = commands.add_parser("diff", help="show rows that changed between files")
+    diff.add_argument("files", nargs="*", metavar="OLD NEW")
+    diff.add_argument(
+        "--old", action="append", default=[], help="old file, repeat for several"
+    )
+    diff.add_argument(
+        "--new", action="append", default=[], help="new file, repeat for several"
+    )
+    diff.add_argument(
+        "--ignore",
+        action="append",
+        default=[],
+        metavar="FIELD",
+        help="field to leave out of the comparison, such as TransactionDate",
+    )
+    diff.set_defaults(func=diff_command)
+
+    export = commands.add_parser(
+        "export", help="export field values to CSV or JSON lines"
+    )
+    export.add_argument("files", nargs="+")
+    export.add_argument(
+        "-o", "--output", required=True, help="a .csv file, otherwise JSON lines"
+    )
+    export.add_argument(
+        "-f",
+        "--field",
+        dest="fields",
+        action="append",
+        default=[],
+        metavar="FIELD",
+        help="field to export, every top level field by default",
+    )
+    export.set_defaults(func=export_command)
+
+    shard = commands.add_parser(
+        "shard", help="render one host's share of an inventory to a sorted segment"
+    )
+    shard.add_argument("inventory")
+    shard.add_argument("--shard", required=True, type=int, help="this host, from 0")
+    shard.add_argument("--shards", required=True, type=int, help="number of hosts")
+    shard.add_argument("-o", "--output", required=True, help="segment to write")
+    shard.add_argument("--csp", required=True, help="default CSPCode")
+    shard.add_argument("--dp", required=True, help="default DPCode")
+    shard.add_argument(
+        "--date",
+        required=True,
+        help="transaction date as YYYYMMDDHHMMSS, the same on every host",
+    )
+    shard.set_defaults(func=shard_command)
+
+    merge = commands.add_parser("merge", help="merge sorted segments into IPND files")
+    merge.add_argument("segments", nargs="+")
+    merge.add_argument("--source", required=True, help="source code")
+    merge.add_argument("--seq", type=int, default=1, help="first sequence")
+    merge.add_argument("--seq-file", help="save the next sequence number here")
+    merge.add_argument("-d", "--directory", default=".")
+    merge.add_argument("--max-rows", type=int, default=MAX_ROWS)
+    merge.set_defaults(func=merge_command)
+
+    count = commands.add_parser("count", help="count rows by field values")
+    count.add_argument("files", nargs="+")
+    count.add_argument(
+        "-f",
+        "--field",
+        dest="fields",
+        action="append",
+        required=True,
+        metavar="FIELD",
+        help="field to group by, such as ListCode or ServiceAddress.State",
+    )
+    count.add_argument(
+        "-p", "--processes", type=int, default=1, help="worker processes"
+    )
+    count.set_defaults(func=count_command)
+
+    serve = commands.add_parser(
+        "serve", help="accept JSON lines on a socket and write files in batches"
+    )
+    serve.add_argument("--socket", required=True, help="unix socket path")
+    serve.add_argument("--source", required=True, help="source code")
+    serve.add_argument("--seq", type=int, default=1, help="first sequence")
+    serve.add_argument("--seq-file", help="save the next sequence number here")
+    serve.add_argument("--csp", required=True, help="default CSPCode")
+    serve.add_argument("--dp", required=True, help="default DPCode")
+    serve.add_argument("-d", "--directory", default=".")
+    serve.add_argument("--max-rows", type=int, default=MAX_ROWS)
+    serve.add_argument("--max-bytes", type=int, default=None)
+    serve.add_argument("--max-age", type=float, default=300.0, help="seconds")
+    serve.add_argument("--urgent-age", type=float, default=1.0, help="seconds")
+    serve.add_argument(
+        "--spool", help="keep accepted rows here until they are written to a file"
+    )
+    serve.add_argument(
+        "--engine", choices=sorted(ENGINES), default=None, help="rendering engine"
+    )
+    serve.add_argument(
+        "--priority",
+        action="store_true",
+        help="write urgent items and ports in their own small files",
+    )
+    serve.set_defaults(func=serve_command)
+
+    return parser
+
+
+def main(argv: List[str] = None) -> int:
+    args = get_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
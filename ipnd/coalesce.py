@@ -0,0 +1,71 @@
+from typing import Callable, Dict, List, Optional
+from ipnd import record
+
+Merge = Callable[[record.Transaction, record.Transaction], Optional[record.Transaction]]
+
+
+def get_number(transaction: record.Transaction) -> str:
+    entry = transaction.get_entry(record.PublicNumber)
+
+    if entry is None:
+        raise Exception("Required Transaction record PublicNumber not set")
+
+    return entry.value
+
+
+def get_status(transaction: record.Transaction) -> str:
+    entry = transaction.get_entry(record.ServiceStatusCode)
+    return entry.value if entry is not None else ""
+
+
+def last_write_wins(
+    previous: record.Transaction, current: record.Transaction
+) -> Optional[record.Transaction]:
+    return current
+
+
+def cancel_connect(
+    previous: record.Transaction, current: record.Transaction
+) -> Optional[record.Transaction]:
+    """
+    A disconnection of a number connected earlier in the same batch cancels
+    both, otherwise the last write wins
+    """
+    if get_status(previous) == "C" and get_status(current) == "D":
+        return None
+
+    return current
+
+
+class Coalescer:
+    """
+    Reduce a stream of transactions to one per PublicNumber. When a number is
+    seen again `merge` is given the transaction kept so far and the new one,
+    and returns the transaction to keep, or None to drop the number entirely.
+    Numbers keep the position they were first seen in.
+    """
+
+    def __init__(self, merge: Merge = last_write_wins):
+        self.merge = merge
+        self._transactions: Dict[str, record.Transaction] = {}
+
+    def add_transaction(self, transaction: record.Transaction):
+        number = get_number(transaction)
+        previous = self._transactions.get(number)
+
+        if previous is None:
+            self._transactions[number] = transaction
+            return
+
+        merged = self.merge(previous, transaction)
+
+        if merged is None:
+            del self._transactions[number]
+        else:
+            self._transactions[number] = merged
+
+    def transactions(self) -> List[record.Transaction]:
+        return list(self._transactions.values())
+
+    def __len__(self):
+        return len(self._transactions)
@@ -0,0 +1,161 @@
+import multiprocessing
+from collections import Counter
+from typing import Dict, Iterable, List, Sequence, Tuple, Union
+from .layout import Field, get_field
+from .reader import IPNDFile
+from .writer import ENCODING
+
+# numpy is optional
+try:
+    import numpy  # type: ignore
+except ImportError:
+    numpy = None
+
+Names = Union[str, Sequence[str]]
+
+
+def _fields(names: Names) -> List[Field]:
+    if isinstance(names, str):
+        names = [names]
+
+    return [get_field(name) for name in names]
+
+
+def _span(f: IPNDFile, first: int, last: int = None) -> Tuple[int, int]:
+    last = len(f) if last is None else min(last, len(f))
+    return max(first, 0), max(last, first)
+
+
+def _matrix(f: IPNDFile, first: int, last: int):
+    """
+    Rows `first` to `last` as a (rows, stride) array of bytes viewing the map.
+    The footer always follows the last row, so every stride is in the file.
+    """
+    return numpy.frombuffer(
+        f.mm,
+        dtype=numpy.uint8,
+        count=(last - first) * f.stride,
+        offset=(first + 1) * f.stride,
+    ).reshape(-1, f.stride)
+
+
+def _column(f: IPNDFile, field: Field, first: int, last: int):
+    if numpy is not None:
+        columns = _matrix(f, first, last)[:, field.offset : field.offset + field.size]
+        return numpy.ascontiguousarray(columns).view("S{}".format(field.size)).ravel()
+
+    start = (first + 1) * f.stride + field.offset
+    end = (last + 1) * f.stride
+
+    return [f.mm[o : o + field.size] for o in range(start, end, f.stride)]
+
+
+def project(f: IPNDFile, names: Names, first: int = 0, last: int = None) -> Dict:
+    """
+    Extract fields from rows `first` to `last` without parsing whole rows.
+    Each field is a NumPy array of fixed width byte strings when NumPy is
+    installed, otherwise a list of bytes; values keep their padding.
+    :param f:
+    :param names: field names, see `layout.FIELDS`
+    :param first:
+    :param last:
+    """
+    first, last = _span(f, first, last)
+
+    return {field.name: _column(f, field, first, last) for field in _fields(names)}
+
+
+def _decode(value: bytes) -> str:
+    return value.decode(ENCODING).strip()
+
+
+def group_count(f: IPNDFile, names: Names, first: int = 0, last: int = None) -> Counter:
+    """
+    Count rows by the values of one field, or by tuples of values when
+    `names` is a list
+    :param f:
+    :param names:
+    :param first:
+    :param last:
+    """
+    fields = _fields(names)
+    first, last = _span(f, first, last)
+    counts: Counter = Counter()
+
+    if first == last:
+        return counts
+
+    if numpy is not None:
+        # One key per row made of every field's bytes, so a single unique()
+        # groups on all of them
+        matrix = _matrix(f, first, last)
+        keys = numpy.ascontiguousarray(
+            numpy.hstack([matrix[:, x.offset : x.offset + x.size] for x in fields])
+        )
+        del matrix
+
+        width = sum(x.size for x in fields)
+        values, totals = numpy.unique(
+            keys.view("S{}".format(width)).ravel(), return_counts=True
+        )
+
+        for value, total in zip(values.tolist(), totals.tolist()):
+            counts[value.ljust(width, b"\0")] += total
+    else:
+        columns = [_column(f, x, first, last) for x in fields]
+        counts.update(b"".join(key) for key in zip(*columns))
+
+    result: Counter = Counter()
+    for key, total in counts.items():
+        values, offset = [], 0
+
+        for x in fields:
+            values.append(_decode(key[offset : offset + x.size].replace(b"\0", b" ")))
+            offset += x.size
+
+        result[values[0] if isinstance(names, str) else tuple(values)] += total
+
+    return result
+
+
+def _count_range(args: Tuple[str, Names, int, int]) -> Counter:
+    path, names, first, last = args
+
+    with IPNDFile(path) as f:
+        return group_count(f, names, first, last)
+
+
+def count_files(
+    paths: Iterable[str],
+    names: Names,
+    processes: int = 1,
+    chunk_rows: int = 25000,
+) -> Counter:
+    """
+    Group counts across many files, optionally counting ranges of
+    `chunk_rows` rows in parallel
+    :param paths:
+    :param names:
+    :param processes: worker processes, None for one per CPU
+    :param chunk_rows:
+    """
+    tasks = []
+
+    for path in paths:
+        with IPNDFile(path) as f:
+            rows = len(f)
+
+        for first in range(0, rows, chunk_rows):
+            tasks.append((path, names, first, min(first + chunk_rows, rows)))
+
+    total: Counter = Counter()
+
+    if processes == 1:
+        for task in tasks:
+            total.update(_count_range(task))
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            for counts in pool.imap_unordered(_count_range, tasks):
+                total.update(counts)
+
+    return total
@@ -0,0 +1,256 @@
+import json
+import os
+import socketserver
+import threading
+import time
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple, Union
+from ipnd import record
+from .engines import Engine
+from .flyweight import Registry
+from .inventory import build_transaction
+from .layout import ROW_SIZE
+from .writer import ENCODING, MAX_ROWS, SequenceAllocator, Writer, render
+
+
+class MicroBatcher:
+    """
+    Collect transactions as they arrive and write them to a new IPND file once
+    `max_rows` rows or `max_bytes` bytes are waiting, or the oldest has waited
+    `max_age` seconds. Urgent transactions are flushed within `urgent_age`
+    seconds. Entities and addresses are shared through a flyweight registry
+    that is cleared on every flush, so it only holds what is waiting.
+
+    Waiting rows are only in memory, and are lost if the process dies, unless
+    a `spool` file is given: each row is then appended to it and synced to
+    disk before `submit` returns, the spool is emptied once the rows are in
+    an IPND file, and a batcher reopening a spool writes what it holds on
+    its first flush. The sync makes each submit slower. A crash part way
+    through a flush can write a row twice, but never loses it.
+
+    Call `poll()` regularly, or `start()` a thread that does.
+    """
+
+    def __init__(
+        self,
+        source: str,
+        allocator: SequenceAllocator,
+        directory: str = ".",
+        max_rows: int = MAX_ROWS,
+        max_bytes: int = None,
+        max_age: float = 300.0,
+        urgent_age: float = 1.0,
+        on_flush: Callable[[str], None] = None,
+        spool: str = None,
+        engine: Union[str, Engine] = None,
+    ):
+        self.source = source
+        self.allocator = allocator
+        self.directory = directory
+        self.max_rows = min(max_rows, MAX_ROWS)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.urgent_age = urgent_age
+        self.on_flush = on_flush
+        self.engine = engine
+
+        self.registry = Registry()
+        self.files: List[str] = []
+
+        self._rows: List[str] = []
+        self._deadline: Optional[float] = None
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.spool = spool
+        self._spool: Optional[BinaryIO] = None
+        if spool is not None:
+            self._recover(spool)
+
+    def _recover(self, path: str):
+        if os.path.exists(path):
+            with open(path, "rb") as fp:
+                data = fp.read()
+
+            # A partial row at the end was never acknowledged
+            for start in range(0, len(data) - ROW_SIZE + 1, ROW_SIZE):
+                self._rows.append(data[start : start + ROW_SIZE].decode(ENCODING))
+
+            if self._rows:
+                self._deadline = time.monotonic()
+
+        self._spool = open(path, "ab")
+        self._spool.truncate(len(self._rows) * ROW_SIZE)
+
+    def submit(self, transaction: record.Transaction, urgent: bool = None):
+        row = render(self.registry.transaction(transaction), self.engine)
+        self.submit_row(row, urgent)
+
+    def submit_row(self, row: str, urgent: bool = None):
+        """
+        Add an already rendered row
+        :param row:
+        :param urgent:
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            if self._spool is not None:
+                self._spool.write(row.encode(ENCODING, "replace"))
+                self._spool.flush()
+                os.fsync(self._spool.fileno())
+
+            self._rows.append(row)
+
+            deadline = now + (self.urgent_age if urgent else self.max_age)
+            if self._deadline is None or deadline < self._deadline:
+                self._deadline = deadline
+
+            full = len(self._rows) >= self.max_rows
+            if self.max_bytes is not None:
+                full = full or (len(self._rows) + 2) * ROW_SIZE >= self.max_bytes
+
+            if full:
+                self.flush()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def poll(self):
+        with self._lock:
+            if self._deadline is not None and time.monotonic() >= self._deadline:
+                self.flush()
+
+    def flush(self) -> Optional[str]:
+        """
+        Write waiting rows to a new file, returning its path
+        """
+        with self._lock:
+            if not self._rows:
+                return None
+
+            rows, self._rows, self._deadline = self._rows, [], None
+            self.registry = Registry()
+
+            with Writer(
+                source=self.source,
+                seq=self.allocator,
+                directory=self.directory,
+                max_rows=self.max_rows,
+            ) as writer:
+                for row in rows:
+                    writer.write_row(row)
+
+            if self._spool is not None:
+                self._spool.truncate(0)
+                os.fsync(self._spool.fileno())
+
+            self.files += writer.files
+
+        for path in writer.files:
+            if self.on_flush is not None:
+                self.on_flush(path)
+
+        return writer.files[0]
+
+    def start(self, interval: float = 0.1):
+        def run():
+            while not self._stop.wait(interval):
+                self.poll()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop polling and flush anything still waiting
+        """
+        self._stop.set()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        self.flush()
+
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+
+class _Server:
+    # Set by `Daemon`, and called by `_Handler` for every line
+    submit: Callable[[Dict[str, str], Optional[bool]], None]
+
+
+class _UnixServer(_Server, socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(_Server, socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                item = json.loads(line.decode("utf-8"))
+                urgent = item.pop("urgent", None)
+                item = {k: "" if v is None else str(v) for k, v in item.items()}
+
+                self.server.submit(item, urgent)
+                self.wfile.write(b"OK\n")
+            except Exception as e:
+                self.wfile.write("ERROR {}\n".format(e).encode("utf-8"))
+
+
+class Daemon:
+    """
+    Accept inventory items (see `ipnd.inventory`) as JSON lines over a local
+    socket and pass them to a `MicroBatcher` (or `scheduler.Scheduler`). Items
+    with `"urgent": true` are flushed quickly. Each line is answered with OK
+    or ERROR and a message. OK means the item was valid and accepted, not
+    that it is in an IPND file yet: give the batcher a spool to keep accepted
+    items across a crash.
+    """
+
+    def __init__(
+        self,
+        batcher,
+        address: Union[str, Tuple[str, int]],
+        csp: str,
+        dp: str,
+    ):
+        self.batcher = batcher
+        self.csp = csp
+        self.dp = dp
+
+        self.server: Union[_UnixServer, _TCPServer]
+
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.remove(address)
+            self.server = _UnixServer(address, _Handler)
+        else:
+            self.server = _TCPServer(address, _Handler)
+
+        self.server.submit = self.submit
+        self.address = self.server.server_address
+
+    def submit(self, item, urgent: bool = None):
+        transaction = build_transaction(item, csp=self.csp, dp=self.dp)
+        self.batcher.submit(transaction, urgent=urgent)
+
+    def serve_forever(self):
+        self.batcher.start()
+
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.batcher.stop()
+
+    def shutdown(self):
+        self.server.shutdown()
@@ -0,0 +1,244 @@
+import heapq
+import struct
+import tempfile
+from contextlib import ExitStack
+from typing import IO, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+from .layout import ROW_SIZE, TRANSACTION_FIELDS, Field
+from .reader import IPNDFile
+
+ADDED = "added"
+REMOVED = "removed"
+CHANGED = "changed"
+
+Files = Union[IPNDFile, Iterable[IPNDFile]]
+
+
+class Change(NamedTuple):
+    kind: str
+    public_number: str
+    old: Optional[str]
+    new: Optional[str]
+    fields: List[Tuple[str, str, str]]
+
+
+def _is_sorted(f: IPNDFile) -> bool:
+    previous = b""
+
+    for _, key in f.keys():
+        if key < previous:
+            return False
+        previous = key
+
+    return True
+
+
+# Key, file and row number of a row among several files
+Located = Tuple[bytes, int, int]
+
+# Located keys as spilled to disk
+LOCATED = struct.Struct(">20sII")
+
+# Roughly what a Located tuple costs in a list, including its key
+LOCATED_BYTES = 180
+
+
+def _located(i: int, f: IPNDFile) -> Iterator[Located]:
+    for n, key in f.keys():
+        yield key, i, n
+
+
+def _spill(located: List[Located], directory: Optional[str]) -> IO[bytes]:
+    located.sort()
+
+    run = tempfile.TemporaryFile(dir=directory)
+    for start in range(0, len(located), 4096):
+        chunk = located[start : start + 4096]
+        run.write(b"".join(LOCATED.pack(*entry) for entry in chunk))
+    run.seek(0)
+
+    return run
+
+
+def _read_run(run: IO[bytes]) -> Iterator[Located]:
+    while True:
+        data = run.read(LOCATED.size * 4096)
+        if not data:
+            return
+        yield from LOCATED.iter_unpack(data)
+
+
+def _sorted_keys(
+    files: List[IPNDFile], memory: int, directory: Optional[str]
+) -> Iterator[Located]:
+    """
+    Every row of unsorted files in key order. Keys are sorted in runs of
+    about `memory` bytes, spilled to temporary files and merged, as
+    `writer.SortedWriter` does with rows.
+    """
+    limit = max(1, memory // LOCATED_BYTES)
+    runs: List[IO[bytes]] = []
+    located: List[Located] = []
+
+    try:
+        for i, f in enumerate(files):
+            for entry in _located(i, f):
+                located.append(entry)
+                if len(located) >= limit:
+                    runs.append(_spill(located, directory))
+                    located = []
+
+        if not runs:
+            located.sort()
+            yield from located
+            return
+
+        if located:
+            runs.append(_spill(located, directory))
+            located = []
+
+        yield from heapq.merge(*[_read_run(r) for r in runs])
+    finally:
+        for run in runs:
+            run.close()
+
+
+def _last_per_key(located: Iterable[Located]) -> Iterator[Located]:
+    """
+    Sorted keys with only the last row (in the last file) of repeated keys
+    """
+    previous: Optional[Located] = None
+
+    for current in located:
+        if previous is not None and current[0] != previous[0]:
+            yield previous
+        previous = current
+
+    if previous is not None:
+        yield previous
+
+
+class Differ:
+    """
+    Compare rows by PublicNumber. `ignore` names fields (such as
+    TransactionDate) whose changes alone don't make a row changed. Each side
+    may be several files, such as every file of a submission; when a number
+    appears more than once on a side its last row, in the last file, is used.
+    """
+
+    def __init__(
+        self,
+        fields: List[Field] = None,
+        ignore: Iterable[str] = (),
+        memory: int = 64 * 1024 * 1024,
+        directory: str = None,
+    ):
+        """
+        :param fields:
+        :param ignore:
+        :param memory: bytes of keys to sort in memory before spilling to disk,
+            for unsorted files
+        :param directory: where to spill, the system temporary directory by
+            default
+        """
+        fields = fields if fields is not None else TRANSACTION_FIELDS
+        ignore = set(ignore)
+
+        self.fields = [f for f in fields if f.name not in ignore]
+        self.memory = memory
+        self.directory = directory
+
+    def compare(self, old: str, new: str) -> List[Tuple[str, str, str]]:
+        changes = []
+
+        for f in self.fields:
+            before = old[f.offset : f.offset + f.size]
+            after = new[f.offset : f.offset + f.size]
+
+            if before != after:
+                changes.append((f.name, before.rstrip(), after.rstrip()))
+
+        return changes
+
+    def _change(self, old: IPNDFile, n: int, new: IPNDFile, m: int):
+        # Comparing the raw rows first skips decoding unchanged rows
+        a, b = (n + 1) * old.stride, (m + 1) * new.stride
+
+        if old.mm[a : a + ROW_SIZE] == new.mm[b : b + ROW_SIZE]:
+            return None
+
+        old_row, new_row = old.row(n), new.row(m)
+        fields = self.compare(old_row, new_row)
+
+        if not fields:
+            return None
+
+        return Change(CHANGED, new_row[0:20].rstrip(), old_row, new_row, fields)
+
+    def diff(self, old: Files, new: Files) -> Iterator[Change]:
+        """
+        Added, removed and changed rows, in PublicNumber order. Sorted files
+        are merged in a single pass; the keys of unsorted ones are sorted on
+        disk first, so memory stays bounded either way.
+        :param old: a file or list of files
+        :param new: a file or list of files
+        """
+        old_files = [old] if isinstance(old, IPNDFile) else list(old)
+        new_files = [new] if isinstance(new, IPNDFile) else list(new)
+
+        old_keys = _last_per_key(self._keys(old_files))
+        new_keys = _last_per_key(self._keys(new_files))
+
+        yield from self._merge(old_files, old_keys, new_files, new_keys)
+
+    def _keys(self, files: List[IPNDFile]) -> Iterator[Located]:
+        if all(_is_sorted(f) for f in files):
+            return heapq.merge(*[_located(i, f) for i, f in enumerate(files)])
+
+        return _sorted_keys(files, self.memory, self.directory)
+
+    def _merge(
+        self,
+        old: List[IPNDFile],
+        old_keys: Iterator[Located],
+        new: List[IPNDFile],
+        new_keys: Iterator[Located],
+    ) -> Iterator[Change]:
+        a, b = next(old_keys, None), next(new_keys, None)
+
+        while a is not None or b is not None:
+            if a is not None and (b is None or a[0] < b[0]):
+                row = old[a[1]].row(a[2])
+                yield Change(REMOVED, row[0:20].rstrip(), row, None, [])
+                a = next(old_keys, None)
+            elif b is not None and (a is None or b[0] < a[0]):
+                row = new[b[1]].row(b[2])
+                yield Change(ADDED, row[0:20].rstrip(), None, row, [])
+                b = next(new_keys, None)
+            elif a is not None and b is not None:
+                change = self._change(old[a[1]], a[2], new[b[1]], b[2])
+                if change is not None:
+                    yield change
+                a, b = next(old_keys, None), next(new_keys, None)
+
+
+def diff_files(
+    old_paths: Union[str, List[str]],
+    new_paths: Union[str, List[str]],
+    ignore: Iterable[str] = (),
+    memory: int = 64 * 1024 * 1024,
+) -> Iterator[Change]:
+    """
+    Changes between two IPND files, or two lists of files
+    :param old_paths: a path or list of paths
+    :param new_paths: a path or list of paths
+    :param ignore: field names to leave out of the comparison
+    :param memory: bytes of keys to sort in memory, see `Differ`
+    """
+    old_paths = [old_paths] if isinstance(old_paths, str) else old_paths
+    new_paths = [new_paths] if isinstance(new_paths, str) else new_paths
+
+    with ExitStack() as stack:
+        old = [stack.enter_context(IPNDFile(path)) for path in old_paths]
+        new = [stack.enter_context(IPNDFile(path)) for path in new_paths]
+
+        yield from Differ(ignore=ignore, memory=memory).diff(old, new)
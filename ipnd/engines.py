@@ -0,0 +1,285 @@
+import random
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional, Union
+from ipnd import record
+from .layout import ENCODING, TRANSACTION_FIELDS
+from .packed import render_leaves
+
+Engine = Callable[[record.Transaction], str]
+
+
+def reference(transaction: record.Transaction) -> str:
+    """
+    Render every record from the object graph, without any caching
+    """
+    return "".join(record.BaseRecord.generate(transaction))
+
+
+def memoized(transaction: record.Transaction) -> str:
+    return transaction.render()
+
+
+ENGINES: Dict[str, Engine] = {
+    "reference": reference,
+    "memoized": memoized,
+    "packed": render_leaves,
+}
+
+DEFAULT_ENGINE = "memoized"
+
+
+def register_engine(name: str, engine: Engine):
+    """
+    Make a rendering engine available by name to `IPND`, `writer.Writer`,
+    `batch.generate` and everything else that renders
+    :param name:
+    :param engine: renders a transaction to its fixed width row
+    """
+    ENGINES[name] = engine
+
+
+def get_engine(engine: Union[str, Engine, None]) -> Engine:
+    if engine is None:
+        engine = DEFAULT_ENGINE
+
+    if callable(engine):
+        return engine
+
+    try:
+        return ENGINES[engine]
+    except KeyError:
+        raise KeyError("Unknown rendering engine {}".format(engine))
+
+
+class Mismatch(NamedTuple):
+    public_number: str
+    offset: int
+    field: Optional[str]
+    expected: str
+    actual: str
+
+
+def _field_at(offset: int) -> Optional[str]:
+    for f in TRANSACTION_FIELDS:
+        if f.offset <= offset < f.offset + f.size:
+            return f.name
+
+    return None
+
+
+class Tally(NamedTuple):
+    rendered: int
+    checked: int
+    failed: int
+    mismatches: List[Mismatch]
+
+
+class EquivalenceChecker:
+    """
+    An engine that renders with `engine`, and renders a random `fraction` of
+    transactions through `reference` too, recording any byte mismatch. Use
+    it in place of an engine to roll a new one out under real load; the
+    output is always `engine`'s.
+
+    A pickled checker arrives in a worker process with no counts, no
+    `on_mismatch` and its own sample; the worker returns its `take()` and the
+    parent `merge`s it, which is how `batch.generate`, `run_inventory` and `render_to_file`
+    report checks made in other processes.
+    """
+
+    def __init__(
+        self,
+        engine: Union[str, Engine],
+        reference: Union[str, Engine] = "reference",
+        fraction: float = 0.01,
+        seed: int = None,
+        on_mismatch: Callable[[Mismatch], None] = None,
+        max_mismatches: int = 100,
+    ):
+        """
+        :param engine: engine being checked
+        :param reference: engine trusted to be correct
+        :param fraction: share of transactions to check, from 0 to 1
+        :param seed: for a repeatable sample
+        :param on_mismatch: called with every mismatch found
+        :param max_mismatches: mismatches to keep in `mismatches`
+        """
+        self.engine = get_engine(engine)
+        self.reference = get_engine(reference)
+        self.fraction = fraction
+        self.seed = seed
+        self.on_mismatch = on_mismatch
+        self.max_mismatches = max_mismatches
+
+        self.rendered = 0
+        self.checked = 0
+        self.failed = 0
+        self.mismatches: List[Mismatch] = []
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _state(self, key: Optional[int]) -> dict:
+        with self._lock:
+            if self.seed is None:
+                sample = random.Random()
+            elif key is None:
+                sample = random.Random(self._random.random())
+            else:
+                sample = random.Random("{}:{}".format(self.seed, key))
+
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state.update(
+            on_mismatch=None,
+            rendered=0,
+            checked=0,
+            failed=0,
+            mismatches=[],
+            _random=sample,
+        )
+        return state
+
+    def __getstate__(self):
+        return self._state(None)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __call__(self, transaction: record.Transaction) -> str:
+        row = self.engine(transaction)
+
+        with self._lock:
+            self.rendered += 1
+            check = self._random.random() < self.fraction
+
+        if check:
+            self.compare(transaction, row)
+
+        return row
+
+    def compare(self, transaction: record.Transaction, row: str) -> Optional[Mismatch]:
+        """
+        Compare `row` with the reference rendering of `transaction`
+        :param transaction:
+        :param row:
+        """
+        expected = self.reference(transaction).encode(ENCODING, "replace")
+        actual = row.encode(ENCODING, "replace")
+        mismatch = None
+
+        if actual != expected:
+            offset = next(
+                (n for n, (a, b) in enumerate(zip(actual, expected)) if a != b),
+                min(len(actual), len(expected)),
+            )
+            mismatch = Mismatch(
+                public_number=expected[0:20].decode(ENCODING).rstrip(),
+                offset=offset,
+                field=_field_at(offset),
+                expected=expected.decode(ENCODING),
+                actual=row,
+            )
+
+        with self._lock:
+            self.checked += 1
+
+            if mismatch is not None:
+                self.failed += 1
+                if len(self.mismatches) < self.max_mismatches:
+                    self.mismatches.append(mismatch)
+
+        if mismatch is not None and self.on_mismatch is not None:
+            self.on_mismatch(mismatch)
+
+        return mismatch
+
+    def copy(self, key: int = None) -> "EquivalenceChecker":
+        """
+        This checker as a worker process receives it: without counts or
+        `on_mismatch`, and sampling independently of it
+        :param key: seeded checkers sample repeatably for the same key
+        """
+        checker = EquivalenceChecker.__new__(EquivalenceChecker)
+        checker.__setstate__(self._state(key))
+        return checker
+
+    def take(self) -> Tally:
+        """
+        The counts and mismatches so far, starting again from zero
+        """
+        with self._lock:
+            tally = Tally(self.rendered, self.checked, self.failed, self.mismatches)
+            self.rendered, self.checked, self.failed = 0, 0, 0
+            self.mismatches = []
+
+        return tally
+
+    def merge(self, tally: Tally):
+        """
+        Add counts and mismatches taken from a checker in another process,
+        calling `on_mismatch` for each mismatch
+        :param tally:
+        """
+        with self._lock:
+            self.rendered += tally.rendered
+            self.checked += tally.checked
+            self.failed += tally.failed
+            room = max(0, self.max_mismatches - len(self.mismatches))
+            self.mismatches.extend(tally.mismatches[:room])
+
+        if self.on_mismatch is not None:
+            for mismatch in tally.mismatches:
+                self.on_mismatch(mismatch)
+
+    def report(self) -> str:
+        lines = [
+            "{} rendered, {} checked, {} mismatched".format(
+                self.rendered, self.checked, self.failed
+            )
+        ]
+
+        for m in self.mismatches:
+            lines.append(
+                "{}: first difference at byte {} ({})".format(
+                    m.public_number, m.offset, m.field or "past the row"
+                )
+            )
+
+        return "\n".join(lines)
+
+
+def for_worker(engine: Union[str, Engine, None], key: int) -> Union[str, Engine, None]:
+    """
+    `engine` for a forked worker to render part `key` of a file with, so an
+    `EquivalenceChecker` starts without the parent's counts
+    :param engine:
+    :param key:
+    """
+    if isinstance(engine, EquivalenceChecker):
+        return engine.copy(key)
+
+    return engine
+
+
+def take(engine: Union[str, Engine, None]) -> Optional[Tally]:
+    """
+    In a worker process, what `engine` has checked since it was last taken,
+    if it is an `EquivalenceChecker`
+    :param engine:
+    """
+    if isinstance(engine, EquivalenceChecker):
+        return engine.take()
+
+    return None
+
+
+def merge(engine: Union[str, Engine, None], tally: Optional[Tally]):
+    """
+    In the parent, add a worker's `take()` to `engine`
+    :param engine:
+    :param tally:
+    """
+    if tally is not None and isinstance(engine, EquivalenceChecker):
+        engine.merge(tally)
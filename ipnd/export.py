@@ -0,0 +1,108 @@
+import csv
+import json
+from collections import namedtuple
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple, Union
+from ipnd import record
+from .layout import TRANSACTION_FIELDS, Field, get_field
+from .writer import render
+
+Rows = Iterable[Union[str, record.Transaction]]
+
+
+def get_fields(names: Sequence[str] = None) -> List[Field]:
+    """
+    Fields to export, the top level transaction fields by default
+    :param names: field names, see `layout.FIELDS`
+    """
+    if names is None:
+        return list(TRANSACTION_FIELDS)
+
+    return [get_field(name) for name in names]
+
+
+@lru_cache(maxsize=None)
+def _row_type(names: Tuple[str, ...]):
+    # One class per set of fields, shared by every exported row
+    return namedtuple("Row", [name.replace(".", "_") for name in names])
+
+
+def _rows(rows: Rows) -> Iterator[str]:
+    for row in rows:
+        yield row if isinstance(row, str) else render(row)
+
+
+def iter_tuples(rows: Rows, fields: List[Field] = None) -> Iterator[Tuple]:
+    """
+    Stream the stripped field values of rendered rows or transactions as
+    named tuples. Dotted field names become underscores, such as
+    `ServiceAddress_State`. Unlike `generate_as_dict` the name, type and size
+    of each field are held once, in `fields`.
+    :param rows: rendered rows (such as `IPNDFile.rows()`) or transactions
+    :param fields: see `get_fields`
+    """
+    fields = fields if fields is not None else get_fields()
+    row_type = _row_type(tuple(f.name for f in fields))
+    slices = [(f.offset, f.offset + f.size) for f in fields]
+
+    for row in _rows(rows):
+        yield row_type._make(row[start:end].strip() for start, end in slices)
+
+
+def to_columns(rows: Rows, fields: List[Field] = None) -> Dict[str, List[str]]:
+    """
+    Field values as one list per field
+    :param rows:
+    :param fields:
+    """
+    fields = fields if fields is not None else get_fields()
+    columns: List[List[str]] = [[] for _ in fields]
+
+    for values in iter_tuples(rows, fields):
+        for column, value in zip(columns, values):
+            column.append(value)
+
+    return {f.name: column for f, column in zip(fields, columns)}
+
+
+def write_csv(rows: Rows, path: str, fields: List[Field] = None) -> int:
+    """
+    Write field values to a CSV file with a header row, returning the rows
+    written
+    :param rows:
+    :param path:
+    :param fields:
+    """
+    fields = fields if fields is not None else get_fields()
+    count = 0
+
+    with open(path, "w", newline="") as fp:
+        writer = csv.writer(fp)
+        writer.writerow([f.name for f in fields])
+
+        for values in iter_tuples(rows, fields):
+            writer.writerow(values)
+            count += 1
+
+    return count
+
+
+def write_jsonl(rows: Rows, path: str, fields: List[Field] = None) -> int:
+    """
+    Write field values as JSON lines keyed by field name, returning the rows
+    written
+    :param rows:
+    :param path:
+    :param fields:
+    """
+    fields = fields if fields is not None else get_fields()
+    names = [f.name for f in fields]
+    count = 0
+
+    with open(path, "w") as fp:
+        for values in iter_tuples(rows, fields):
+            fp.write(json.dumps(dict(zip(names, values))))
+            fp.write("\n")
+            count += 1
+
+    return count
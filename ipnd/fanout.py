@@ -0,0 +1,122 @@
+from datetime import datetime
+from typing import Dict, List, Union
+from ipnd import record
+from .engines import Engine
+from .flyweight import Registry
+from .layout import get_field
+from .writer import MAX_ROWS, STATE_DATE, SequenceAllocator, Writer, render
+
+CSP_CODE = get_field("CSPCode")
+
+
+class FanOutWriter:
+    """
+    Write one pass over an inventory to files for several sources at once.
+    Each row goes to the `Writer` of the source its CSPCode is routed to, so
+    every source gets its own headers, footers, sequence numbers and
+    rollover, and each row is rendered once however many sources there are.
+    Transactions given to `add_transaction` also share entities and
+    addresses through one flyweight registry; rows rendered elsewhere, as
+    `batch.generate` does, are routed as they are.
+
+    Like `Writer` it can be passed to `batch.generate`.
+    """
+
+    def __init__(
+        self,
+        routes: Dict[str, str],
+        seq: Dict[str, Union[int, SequenceAllocator]] = None,
+        directory: str = ".",
+        date: datetime = None,
+        max_rows: int = MAX_ROWS,
+        engine: Union[str, Engine] = None,
+    ):
+        """
+        :param routes: source for each CSPCode
+        :param seq: first sequence number or allocator of each source,
+            defaulting to 1
+        :param directory:
+        :param date:
+        :param max_rows:
+        :param engine: rendering engine or its name, see `ipnd.engines`
+        """
+        self.routes = routes
+        self.seq = seq if seq is not None else {}
+        self.directory = directory
+        self.date = date if date else datetime.now()
+        self.max_rows = max_rows
+        self.engine = engine
+
+        self.registry = Registry()
+        self.writers: Dict[str, Writer] = {}
+
+    def get_writer(self, source: str) -> Writer:
+        writer = self.writers.get(source)
+
+        if writer is None:
+            writer = self.writers[source] = Writer(
+                source=source,
+                seq=self.seq.get(source, 1),
+                directory=self.directory,
+                date=self.date,
+                max_rows=self.max_rows,
+            )
+
+        return writer
+
+    def add_transaction(self, transaction: record.Transaction):
+        self.write_row(render(self.registry.transaction(transaction), self.engine))
+
+    def write_row(self, row: str):
+        csp = row[CSP_CODE.offset : CSP_CODE.offset + CSP_CODE.size].rstrip()
+
+        try:
+            source = self.routes[csp]
+        except KeyError:
+            raise record.ValidationError("No source for CSPCode {}".format(csp))
+
+        self.get_writer(source).write_row(row)
+
+    @property
+    def files(self) -> List[str]:
+        return [path for writer in self.writers.values() for path in writer.files]
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+    def abort(self):
+        """
+        Abort every source's writer, see `Writer.abort`
+        """
+        for writer in self.writers.values():
+            writer.abort()
+
+    def get_state(self) -> Dict:
+        """
+        The state of every source's writer, for `restore` to carry on from
+        """
+        return {
+            "date": self.date.strftime(STATE_DATE),
+            "writers": {s: w.get_state() for s, w in self.writers.items()},
+        }
+
+    def restore(self, state: Dict):
+        """
+        Carry on from a `get_state`, see `Writer.restore`
+        :param state:
+        """
+        self.date = datetime.strptime(state["date"], STATE_DATE)
+
+        self.writers = {source: self.get_writer(source) for source in state["writers"]}
+        for source, writer_state in state["writers"].items():
+            self.writers[source].restore(writer_state)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,78 @@
+import sys
+from typing import Dict, Hashable, cast
+from ipnd import record
+
+
+class Registry:
+    """
+    Canonicalise equal entities and addresses to one shared, frozen instance.
+    Address components (street and locality) are shared between addresses
+    and their string values are interned.
+    """
+
+    def __init__(self):
+        self._entities: Dict[Hashable, record.Entity] = {}
+        self._addresses: Dict[Hashable, record.Address] = {}
+        self._components: Dict[Hashable, record.MultipleRecord] = {}
+
+    def entity(self, entity: record.Entity) -> record.Entity:
+        key = entity.content_key()
+        canonical = self._entities.get(key)
+
+        if canonical is None:
+            if not entity.frozen:
+                for name, value in list(vars(entity).items()):
+                    if isinstance(value, str):
+                        setattr(entity, name, sys.intern(value))
+
+            canonical = self._entities[key] = entity.freeze()
+
+        return canonical
+
+    def component(self, component: record.MultipleRecord) -> record.MultipleRecord:
+        records = record.BaseRecord.flatten(component.get_records())
+        key = (component.__class__,) + tuple((r.__class__, r.value) for r in records)
+        canonical = self._components.get(key)
+
+        if canonical is None:
+            for r in records:
+                if isinstance(r.value, str):
+                    r.value = sys.intern(r.value)
+
+            canonical = self._components[key] = component
+
+        return canonical
+
+    def address(self, address: record.Address) -> record.Address:
+        key = address.content_key()
+        canonical = self._addresses.get(key)
+
+        if canonical is None:
+            if not address.frozen:
+                address.street_address = self.component(address.street_address)
+                address.service_locality = self.component(address.service_locality)
+
+            canonical = self._addresses[key] = address.freeze()
+
+        return canonical
+
+    def transaction(self, transaction: record.Transaction) -> record.Transaction:
+        """
+        Replace the entities and addresses a transaction refers to with their
+        canonical instances
+        :param transaction:
+        """
+        for entry in transaction.t.values():
+            if isinstance(entry, record.CustomerName):
+                # CustomerName keeps its entity in `value`, typed str on BaseRecord
+                entity = cast(record.Entity, entry.value)
+                setattr(entry, "value", self.entity(entity))
+            elif isinstance(entry, (record.FindingName, record.CustomerContact)):
+                entry.entity = self.entity(entry.entity)
+            elif isinstance(entry, record.BaseAddress):
+                entry.address = self.address(entry.address)
+
+        return transaction
+
+    def __len__(self):
+        return len(self._entities) + len(self._addresses) + len(self._components)
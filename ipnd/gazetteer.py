@@ -0,0 +1,192 @@
+import csv
+import mmap
+import re
+import struct
+from typing import Iterable, List, Optional, Tuple
+from ipnd import record
+
+MAGIC = b"IPNDGAZ1"
+
+POSTCODE_SIZE = record.Postcode.SIZE
+LOCALITY_SIZE = record.Locality.SIZE
+STATE_SIZE = record.State.SIZE
+ENTRY_SIZE = POSTCODE_SIZE + LOCALITY_SIZE + STATE_SIZE
+
+# Index of the first entry for every postcode 0000 - 9999, plus an end marker
+DIRECTORY = struct.Struct(">10001I")
+
+STATES = ("ACT", "NSW", "NT", "QLD", "SA", "TAS", "VIC", "WA")
+
+
+def normalise_postcode(postcode) -> str:
+    postcode = str(postcode).strip().zfill(POSTCODE_SIZE)
+
+    if len(postcode) != POSTCODE_SIZE or not postcode.isdigit():
+        raise record.ValidationError("Invalid Postcode: {}".format(postcode))
+
+    return postcode
+
+
+def normalise_locality(locality: str) -> str:
+    return re.sub(r"\s+", " ", locality.strip().upper())[0:LOCALITY_SIZE]
+
+
+def compile_gazetteer(csv_path: str, path: str):
+    """
+    Compile a CSV with postcode, locality and state columns into the index
+    file read by `Gazetteer`
+    :param csv_path:
+    :param path: index file to write
+    """
+    entries = set()
+
+    with open(csv_path, newline="") as fp:
+        for row in csv.DictReader(fp):
+            row = {k.strip().lower(): v for k, v in row.items() if k}
+            state = row["state"].strip().upper()
+
+            if state not in STATES:
+                raise record.ValidationError("Invalid State: {}".format(state))
+
+            entries.add(
+                "{}{}{}".format(
+                    normalise_postcode(row["postcode"]),
+                    normalise_locality(row["locality"]).ljust(LOCALITY_SIZE),
+                    state.ljust(STATE_SIZE),
+                )
+            )
+
+    ordered = sorted(entries)
+
+    counts = [0] * 10000
+    for entry in ordered:
+        counts[int(entry[0:POSTCODE_SIZE])] += 1
+
+    directory = [0]
+    for count in counts:
+        directory.append(directory[-1] + count)
+
+    with open(path, "wb") as fp:
+        fp.write(MAGIC)
+        fp.write(DIRECTORY.pack(*directory))
+        fp.write("".join(ordered).encode("ascii", "replace"))
+
+
+class Gazetteer:
+    """
+    Validate postcode, locality and state combinations against a compiled
+    gazetteer. The index is memory mapped; a postcode directory finds the
+    handful of localities for a postcode in constant time.
+
+    Pass an instance to `inventory.build_transaction` (or `batch.generate`)
+    to validate inventory addresses; it pickles as its path, so it can be
+    sent to worker processes. Assigning one to `record.Address.gazetteer`
+    validates every `set_locality` call in this process only.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        with open(path, "rb") as fp:
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.mm[0 : len(MAGIC)] != MAGIC:
+            raise ValueError("{} is not a compiled gazetteer".format(path))
+
+        self.directory = DIRECTORY.unpack_from(self.mm, len(MAGIC))
+        self.offset = len(MAGIC) + DIRECTORY.size
+
+    def localities(self, postcode) -> List[Tuple[str, str]]:
+        """
+        Every (locality, state) for a postcode
+        :param postcode:
+        """
+        n = int(normalise_postcode(postcode))
+        start, end = self.directory[n], self.directory[n + 1]
+
+        data = self.mm[
+            self.offset + start * ENTRY_SIZE : self.offset + end * ENTRY_SIZE
+        ].decode("ascii")
+
+        return [
+            (
+                data[i + POSTCODE_SIZE : i + POSTCODE_SIZE + LOCALITY_SIZE].rstrip(),
+                data[i + POSTCODE_SIZE + LOCALITY_SIZE : i + ENTRY_SIZE].rstrip(),
+            )
+            for i in range(0, len(data), ENTRY_SIZE)
+        ]
+
+    def normalise(
+        self, postcode, locality: str, state: Optional[str] = None
+    ) -> Tuple[str, str, str]:
+        """
+        Return the normalised (postcode, locality, state), filling in the
+        state when the locality only exists in one
+        :param postcode:
+        :param locality:
+        :param state:
+        """
+        postcode = normalise_postcode(postcode)
+        locality = normalise_locality(locality)
+        state = state.strip().upper() if state else None
+
+        states = [s for name, s in self.localities(postcode) if name == locality]
+
+        if not states:
+            raise record.ValidationError(
+                "Unknown locality {} for postcode {}".format(locality, postcode)
+            )
+
+        if state is None:
+            if len(states) > 1:
+                raise record.ValidationError(
+                    "Locality {} {} is in more than one state".format(
+                        locality, postcode
+                    )
+                )
+            state = states[0]
+        elif state not in states:
+            raise record.ValidationError(
+                "Locality {} {} is not in {}".format(locality, postcode, state)
+            )
+
+        return postcode, locality, state
+
+    def validate(
+        self, transactions: Iterable[record.Transaction]
+    ) -> List[Tuple[int, record.ValidationError]]:
+        """
+        Check the service and directory address of every transaction,
+        returning the position and error of each one that fails
+        :param transactions:
+        """
+        errors = []
+
+        for n, transaction in enumerate(transactions):
+            for record_class in (record.ServiceAddress, record.DirectoryAddress):
+                entry = transaction.get_entry(record_class)
+                if entry is None:
+                    continue
+
+                locality = entry.address.service_locality
+
+                try:
+                    self.normalise(
+                        locality.postcode.value,
+                        locality.locality.value,
+                        locality.state.value,
+                    )
+                except record.ValidationError as e:
+                    errors.append((n, e))
+                    break
+
+        return errors
+
+    def close(self):
+        self.mm.close()
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
@@ -0,0 +1,371 @@
+import heapq
+import json
+import mmap
+import os
+import struct
+from bisect import bisect_left
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple
+from .blocks import BlockFile
+from .layout import ROW_SIZE
+from .writer import ENCODING
+
+# PublicNumber is the first 20 characters of every row
+KEY_SIZE = 20
+
+# date (14) + source (5) + seq (7) + row
+ENTRY_SIZE = 14 + 5 + 7 + ROW_SIZE
+
+# public number, block offset, slot within block
+INDEX_ENTRY = struct.Struct(">{}sQH".format(KEY_SIZE))
+
+IndexEntry = Tuple[bytes, int, int]
+
+
+class HistoryEntry(NamedTuple):
+    public_number: str
+    source: str
+    seq: int
+    date: datetime
+    row: str
+
+
+def make_key(public_number: str) -> bytes:
+    return public_number[0:KEY_SIZE].ljust(KEY_SIZE, " ").encode(ENCODING, "replace")
+
+
+def _chunks(entries: Iterable[IndexEntry], size: int) -> Iterator[List[IndexEntry]]:
+    chunk = []
+
+    for entry in entries:
+        chunk.append(entry)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+class HistoryStore:
+    """
+    Append-only store of every row submitted, kept in compressed blocks (see
+    `blocks.BlockFile`) of `block_size` rows. Rows are indexed by their
+    PublicNumber. Rows added recently are kept in a sorted append log that is
+    loaded on open; once it holds `compact_after` entries it is written out
+    as a sorted index segment. Whenever `merge_factor` segments are about the
+    same size they are merged into one, so each entry is rewritten once per
+    size tier rather than every time the log fills. Lookups binary search
+    every segment in place.
+
+    A manifest names the live segments and log, and is replaced atomically,
+    so a crash part way through writing a segment loses nothing.
+
+    Only one process may append to a store at a time.
+    """
+
+    DATA_FILE = "blocks"
+    INDEX_FILE = "index"
+    LOG_FILE = "index.log"
+    MANIFEST_FILE = "manifest"
+
+    def __init__(
+        self,
+        path: str,
+        block_size: int = 4096,
+        cache_size: int = 16,
+        compact_after: int = 100000,
+        merge_factor: int = 4,
+    ):
+        if block_size < 1 or block_size > 0xFFFF:
+            raise ValueError("block_size must be between 1 and 65535")
+        if merge_factor < 2:
+            raise ValueError("merge_factor must be at least 2")
+
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.block_size = block_size
+        self.cache_size = cache_size
+        self.compact_after = compact_after
+        self.merge_factor = merge_factor
+
+        self._pending: List[Tuple[bytes, bytes]] = []
+        self._blocks = BlockFile(self._file(self.DATA_FILE), cache_size=cache_size)
+        self._manifest = self._load_manifest()
+        self._log: List[IndexEntry] = sorted(
+            self._read_entries(self._file(self._manifest["log"]))
+        )
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _load_manifest(self) -> Dict:
+        path = self._file(self.MANIFEST_FILE)
+
+        if os.path.exists(path):
+            with open(path) as fp:
+                return json.load(fp)
+
+        # Stores written before index segments have one index and one log
+        index = self._file(self.INDEX_FILE)
+
+        return {
+            "segments": [self.INDEX_FILE] if os.path.exists(index) else [],
+            "log": self.LOG_FILE,
+            "next": 0,
+        }
+
+    def _name(self, prefix: str) -> str:
+        # Numbers only need to be unique among live files, so a number used by
+        # a file that was never committed is safe to reuse after a crash
+        n = self._manifest["next"]
+        self._manifest["next"] += 1
+
+        return "{}.{:06d}".format(prefix, n)
+
+    def _commit(self, segments: List[str], log: str):
+        """
+        Replace the manifest, then remove files it no longer names
+        """
+        old = set(self._manifest["segments"]) | {self._manifest["log"]}
+        self._manifest = dict(self._manifest, segments=segments, log=log)
+
+        tmp = self._file(self.MANIFEST_FILE + ".tmp")
+        with open(tmp, "w") as fp:
+            json.dump(self._manifest, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp, self._file(self.MANIFEST_FILE))
+
+        for name in old - set(segments) - {log}:
+            if os.path.exists(self._file(name)):
+                os.remove(self._file(name))
+
+    def append(self, row: str, source: str, seq: int, date: datetime = None):
+        """
+        Record a rendered row
+        :param row: fixed width transaction row
+        :param source: file source code
+        :param seq: file sequence number
+        :param date: file date, defaults to now
+        """
+        if len(row) != ROW_SIZE:
+            raise ValueError("Expected a {} character row".format(ROW_SIZE))
+
+        date = date if date else datetime.now()
+        entry = "{}{}{:07d}{}".format(
+            date.strftime("%Y%m%d%H%M%S"), source[0:5].ljust(5, " "), seq, row
+        )
+
+        self._pending.append((make_key(row), entry.encode(ENCODING, "replace")))
+
+        if len(self._pending) >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+
+        offset = self._blocks.append(b"".join(entry for _, entry in self._pending))
+
+        entries = sorted(
+            (key, offset, slot) for slot, (key, _) in enumerate(self._pending)
+        )
+
+        with open(self._file(self._manifest["log"]), "ab") as fp:
+            fp.write(b"".join(INDEX_ENTRY.pack(*e) for e in entries))
+
+        # Both are sorted, so merging is linear rather than a full sort
+        self._log = list(heapq.merge(self._log, entries))
+        self._pending = []
+
+        if len(self._log) >= self.compact_after:
+            self._write_log()
+            self._merge_tiers()
+
+    def close(self):
+        self.flush()
+        self._blocks.close()
+
+    def compact(self):
+        """
+        Merge the append log and every index segment into a single segment
+        """
+        self.flush()
+
+        segments = self._manifest["segments"]
+        if not self._log and len(segments) < 2:
+            return
+
+        merged = self._name(self.INDEX_FILE)
+        self._write_segment(
+            merged,
+            heapq.merge(
+                *[self._read_entries(self._file(n)) for n in segments], self._log
+            ),
+        )
+
+        self._new_log([merged])
+
+    def _write_log(self):
+        """
+        Write the append log out as a new segment
+        """
+        segment = self._name(self.INDEX_FILE)
+        self._write_segment(segment, self._log)
+
+        self._new_log(self._manifest["segments"] + [segment])
+
+    def _new_log(self, segments: List[str]):
+        log = self._name(self.LOG_FILE)
+        open(self._file(log), "wb").close()
+
+        self._commit(segments, log)
+        self._log = []
+
+    def _tier(self, segment: str) -> int:
+        entries = os.path.getsize(self._file(segment)) // INDEX_ENTRY.size
+        tier, size = 0, self.compact_after * self.merge_factor
+
+        while entries >= size:
+            tier += 1
+            size *= self.merge_factor
+
+        return tier
+
+    def _merge_tiers(self):
+        """
+        Merge `merge_factor` segments of the same size tier into one, until
+        no tier has that many
+        """
+        while True:
+            tiers: Dict[int, List[str]] = {}
+            for segment in self._manifest["segments"]:
+                tiers.setdefault(self._tier(segment), []).append(segment)
+
+            full = [s for _, s in sorted(tiers.items()) if len(s) >= self.merge_factor]
+            if not full:
+                return
+
+            merging = full[0][: self.merge_factor]
+            merged = self._name(self.INDEX_FILE)
+            self._write_segment(
+                merged,
+                heapq.merge(*[self._read_entries(self._file(n)) for n in merging]),
+            )
+
+            segments = [s for s in self._manifest["segments"] if s not in merging]
+            self._commit(segments + [merged], self._manifest["log"])
+
+    def _write_segment(self, name: str, entries: Iterable[IndexEntry]):
+        tmp = self._file(name + ".tmp")
+
+        with open(tmp, "wb") as fp:
+            for chunk in _chunks(entries, 4096):
+                fp.write(b"".join(INDEX_ENTRY.pack(*e) for e in chunk))
+            fp.flush()
+            os.fsync(fp.fileno())
+
+        os.replace(tmp, self._file(name))
+
+    def lookup(self, public_number: str) -> List[HistoryEntry]:
+        """
+        Every row submitted for a number, oldest first
+        :param public_number:
+        """
+        return self.scan(public_number, public_number)
+
+    def scan(self, first: str, last: str) -> List[HistoryEntry]:
+        """
+        Every row submitted for numbers between `first` and `last` inclusive,
+        ordered by number and then submission
+        :param first:
+        :param last:
+        """
+        lo, hi = make_key(first), make_key(last)
+
+        locations: List[IndexEntry] = []
+        for segment in self._manifest["segments"]:
+            locations += self._scan_segment(self._file(segment), lo, hi)
+
+        for n in range(bisect_left(self._log, (lo,)), len(self._log)):
+            if self._log[n][0] > hi:
+                break
+            locations.append(self._log[n])
+
+        locations.sort()
+
+        results = [self._read_entry(offset, slot) for _, offset, slot in locations]
+        pending = sorted(
+            (key, slot)
+            for slot, (key, _) in enumerate(self._pending)
+            if lo <= key <= hi
+        )
+        results += [self._decode(self._pending[slot][1]) for _, slot in pending]
+
+        return sorted(results, key=lambda e: e.public_number)
+
+    @staticmethod
+    def _scan_segment(path: str, lo: bytes, hi: bytes) -> List[IndexEntry]:
+        if not os.path.getsize(path):
+            return []
+
+        size = INDEX_ENTRY.size
+        results = []
+
+        with open(path, "rb") as fp, mmap.mmap(
+            fp.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mm:
+            # Binary search for the first key >= lo
+            left, right = 0, len(mm) // size
+            while left < right:
+                middle = (left + right) // 2
+                if mm[middle * size : middle * size + KEY_SIZE] < lo:
+                    left = middle + 1
+                else:
+                    right = middle
+
+            for pos in range(left * size, len(mm), size):
+                entry = INDEX_ENTRY.unpack_from(mm, pos)
+                if entry[0] > hi:
+                    break
+                results.append(entry)
+
+        return results
+
+    def _read_entries(self, path: str) -> Iterator[IndexEntry]:
+        if not os.path.exists(path):
+            return
+
+        size = INDEX_ENTRY.size * 4096
+
+        with open(path, "rb") as fp:
+            while True:
+                data = fp.read(size)
+                if not data:
+                    return
+                yield from INDEX_ENTRY.iter_unpack(data)
+
+    def _read_entry(self, offset: int, slot: int) -> HistoryEntry:
+        block = self._blocks.read(offset)
+        return self._decode(block[slot * ENTRY_SIZE : (slot + 1) * ENTRY_SIZE])
+
+    @staticmethod
+    def _decode(data: bytes) -> HistoryEntry:
+        entry = data.decode(ENCODING)
+        row = entry[26:]
+
+        return HistoryEntry(
+            public_number=row[0:KEY_SIZE].rstrip(),
+            source=entry[14:19].rstrip(),
+            seq=int(entry[19:26]),
+            date=datetime.strptime(entry[0:14], "%Y%m%d%H%M%S"),
+            row=row,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
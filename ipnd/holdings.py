@@ -0,0 +1,144 @@
+import re
+from bisect import bisect_right
+from typing import Iterable, List, Tuple
+from ipnd import record
+
+NUMBER_SIZE = record.PublicNumber.SIZE
+
+# Numbers of different lengths never share a range: the length is folded
+# into each key above every possible 20 digit number
+LENGTH_BASE = 10**NUMBER_SIZE
+
+
+def normalise_number(number) -> str:
+    """
+    National form of an Australian number given in national or E.164 form,
+    such as "+61 7 4970 0000" for "0749700000" or "+611300000000" for
+    "1300000000"
+    :param number:
+    """
+    number = re.sub(r"[\s\-().]", "", str(number))
+
+    if number.startswith("+61"):
+        number = number[3:]
+    elif number.startswith("61") and len(number) == 11:
+        number = number[2:]
+    else:
+        return _check(number)
+
+    # Geographic and mobile numbers gain a trunk prefix, 13/1300/1800 don't
+    return _check(number if number.startswith("1") else "0" + number)
+
+
+def _check(number: str) -> str:
+    if not number.isdigit() or len(number) > NUMBER_SIZE:
+        raise record.ValidationError("Invalid PublicNumber: {}".format(number))
+
+    return number
+
+
+def _key(number: str) -> int:
+    return len(number) * LENGTH_BASE + int(number)
+
+
+class Holdings:
+    """
+    The blocks of numbers we hold, as sorted and merged ranges, so checking a
+    number is a binary search however many ranges there are.
+
+    Pass an instance to `inventory.build_transaction` (or `batch.generate`)
+    to normalise inventory numbers and reject numbers we don't hold; it is
+    sent to worker processes with each item. Assigning one to
+    `record.PublicNumber.holdings` checks every PublicNumber in this process
+    only.
+    """
+
+    def __init__(self, ranges: Iterable[Tuple[str, str]] = ()):
+        keys = []
+
+        for first, last in ranges:
+            first, last = normalise_number(first), normalise_number(last)
+
+            if len(first) != len(last) or first > last:
+                raise ValueError("Invalid number range {}-{}".format(first, last))
+
+            keys.append((_key(first), _key(last)))
+
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+
+        for start, end in sorted(keys):
+            if self.ends and start <= self.ends[-1] + 1:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    @classmethod
+    def load(cls, path: str) -> "Holdings":
+        """
+        Read ranges from a text file, one "first-last" range or single number
+        per line, in national or E.164 form without dashes. Blank lines and #
+        comments are ignored.
+        :param path:
+        """
+        ranges = []
+
+        with open(path) as fp:
+            for line in fp:
+                line = line.split("#", 1)[0].strip()
+                if not line:
+                    continue
+
+                first, _, last = line.partition("-")
+                ranges.append((first, last if last else first))
+
+        return cls(ranges)
+
+    def _held(self, number: str) -> bool:
+        key = _key(number)
+        n = bisect_right(self.starts, key) - 1
+
+        return n >= 0 and key <= self.ends[n]
+
+    def __contains__(self, number) -> bool:
+        try:
+            return self._held(normalise_number(number))
+        except record.ValidationError:
+            return False
+
+    def check(self, number) -> str:
+        """
+        Return the normalised number, raising a ValidationError if we don't
+        hold it
+        :param number:
+        """
+        normalised = normalise_number(number)
+
+        if not self._held(normalised):
+            raise record.ValidationError("Number not held: {}".format(normalised))
+
+        return normalised
+
+    def validate(
+        self, transactions: Iterable[record.Transaction]
+    ) -> List[Tuple[int, record.ValidationError]]:
+        """
+        Check the PublicNumber of every transaction, returning the position
+        and error of each one that fails
+        :param transactions:
+        """
+        errors = []
+
+        for n, transaction in enumerate(transactions):
+            entry = transaction.get_entry(record.PublicNumber)
+
+            try:
+                self.check(entry.value if entry is not None else "")
+            except record.ValidationError as e:
+                errors.append((n, e))
+
+        return errors
+
+    def __len__(self):
+        return len(self.starts)
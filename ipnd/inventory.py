@@ -0,0 +1,169 @@
+import csv
+import json
+from datetime import datetime
+from typing import Dict, Iterator
+from ipnd import record
+from .address import parse_address
+from .gazetteer import Gazetteer
+from .holdings import Holdings
+
+# Inventory files are CSV (with a header row) or JSON lines using these keys:
+#
+#   number (required), status (C or D, default C), entity (person, business,
+#   govt or charity, default person), name, title, contact, street_number,
+#   street_name, street_type, street_suffix, postcode, locality, state,
+#   list_code (default UL), type_of_service, prior_number, csp, dp
+#
+# Instead of the street and locality keys, address may hold the whole
+# address as free text (see `address.parse_address`).
+ENTITIES = {
+    "person": record.Person,
+    "business": record.Business,
+    "govt": record.Govt,
+    "charity": record.Charity,
+}
+
+
+def read_inventory(path: str) -> Iterator[Dict[str, str]]:
+    if path.endswith(".csv"):
+        with open(path, newline="") as fp:
+            yield from csv.DictReader(fp)
+        return
+
+    with open(path) as fp:
+        for line in fp:
+            if line.strip():
+                item = json.loads(line)
+                yield {k: "" if v is None else str(v) for k, v in item.items()}
+
+
+def build_entity(item: Dict[str, str]) -> record.Entity:
+    kind = (item.get("entity") or "person").lower()
+
+    try:
+        entity = ENTITIES[kind]()
+    except KeyError:
+        raise record.ValidationError("Invalid entity: {}".format(kind))
+
+    if item.get("name"):
+        entity.set_name(item["name"], item.get("title") or "")
+    if item.get("contact"):
+        entity.set_contactnum(item["contact"])
+
+    return entity
+
+
+def _normalised(address: record.Address, gazetteer: Gazetteer) -> record.Address:
+    """
+    A parsed address with its locality validated and normalised against
+    `gazetteer`. Parsed addresses are frozen and shared, so this is a new
+    address with the same street
+    """
+    locality = address.service_locality
+
+    if not (locality.postcode.value or locality.locality.value):
+        return address
+
+    normalised = address.__class__()
+    normalised.building_subunit = address.building_subunit
+    normalised.building_floor = address.building_floor
+    normalised.building_property = address.building_property
+    normalised.building_location = address.building_location
+    normalised.house_number_subunit = address.house_number_subunit
+    normalised.street_address = address.street_address
+    normalised.set_locality(
+        *gazetteer.normalise(
+            locality.postcode.value,
+            locality.locality.value,
+            locality.state.value or None,
+        )
+    )
+
+    return normalised
+
+
+def build_address(item: Dict[str, str], gazetteer: Gazetteer = None) -> record.Address:
+    """
+    :param item:
+    :param gazetteer: validate and normalise the locality against this
+    """
+    if item.get("address"):
+        address = parse_address(item["address"])
+        return address if gazetteer is None else _normalised(address, gazetteer)
+
+    address = record.HouseAddress()
+
+    if item.get("street_number"):
+        address.set_street_number(item["street_number"])
+    if item.get("street_name"):
+        address.set_street_name(
+            item["street_name"],
+            item.get("street_type") or "",
+            item.get("street_suffix") or "",
+        )
+    if item.get("postcode") or item.get("locality"):
+        locality = (
+            item.get("postcode") or "",
+            item.get("locality") or "",
+            item.get("state") or None,
+        )
+        if gazetteer is not None:
+            locality = gazetteer.normalise(*locality)
+
+        address.set_locality(*locality)
+
+    return address
+
+
+def build_transaction(
+    item: Dict[str, str],
+    csp: str,
+    dp: str,
+    date: datetime = None,
+    gazetteer: Gazetteer = None,
+    holdings: Holdings = None,
+) -> record.Transaction:
+    """
+    Build a transaction from one inventory item
+    :param item:
+    :param csp: CSPCode, unless the item has its own
+    :param dp: DPCode, unless the item has its own
+    :param date: transaction and service status date, defaults to now
+    :param gazetteer: validate and normalise localities against this
+    :param holdings: normalise numbers and reject any we don't hold
+    """
+    if not item.get("number"):
+        raise record.ValidationError("Inventory item has no number")
+
+    number = item["number"]
+    if holdings is not None:
+        number = holdings.check(number)
+
+    entity = build_entity(item)
+    address = build_address(item, gazetteer)
+
+    t = record.Transaction()
+
+    t.add_entry(record.CSPCode(item.get("csp") or csp))
+    t.add_entry(record.DPCode(item.get("dp") or dp))
+
+    t.add_entry(record.PublicNumber(number))
+    t.add_entry(record.UsageCode(entity.get_code()))
+    t.add_entry(record.ServiceStatusCode(item.get("status") or "C"))
+    t.add_entry(record.PendingFlag("N"))
+    t.add_entry(record.CancelPendingFlag("N"))
+    t.add_entry(record.CustomerName(entity))
+    t.add_entry(record.FindingName(entity))
+    t.add_entry(record.ServiceAddress(address))
+    t.add_entry(record.DirectoryAddress(address))
+
+    t.add_entry(record.ListCode(item.get("list_code") or "UL"))
+    t.add_entry(record.TypeOfService(item.get("type_of_service") or ""))
+    t.add_entry(record.CustomerContact(entity))
+    t.add_entry(record.TransactionDate(date))
+    t.add_entry(record.ServiceStatusDate(date))
+
+    if item.get("prior_number"):
+        t.add_entry(record.PriorPublicNumber(item["prior_number"]))
+
+    return t
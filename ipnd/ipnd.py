@@ -1,20 +1,46 @@
 from ipnd import record
-from typing import List
+from typing import List, Union
 from datetime import datetime
+from .engines import Engine, get_engine
+from .memory import MemoryProfiler
 
 
 class IPND:
-    def __init__(self, source: str, seq: int, count: int = None, date: datetime = None):
+    def __init__(
+        self,
+        source: str,
+        seq: int,
+        count: int = None,
+        date: datetime = None,
+        engine: Union[str, Engine] = None,
+        profiler: MemoryProfiler = None,
+    ):
+        """
+        :param source:
+        :param seq:
+        :param count:
+        :param date:
+        :param engine: name of a registered rendering engine (see
+            `ipnd.engines`), or an engine such as an `EquivalenceChecker`
+        :param profiler: count the records held before rendering, and track
+            memory while rendering the file
+        """
         self.source = source
         self.seq = seq
         self.count = count
         self.date = date
+        self.engine = engine
+        self.profiler = profiler
         self.transactions: List[record.Transaction] = []
 
     def add_transaction(self, transaction: record.Transaction):
         self.transactions.append(transaction)
 
     def generate(self):
+        """
+        The header, each transaction and the footer, each as its list of
+        field strings. The engine is not used; see `render`
+        """
         return (
             [record.Header(source=self.source, seq=self.seq, date=self.date).generate()]
             + [t.generate() for t in self.transactions]
@@ -28,5 +54,57 @@ class IPND:
             ]
         )
 
+    def render(self) -> List[str]:
+        """
+        Every row of the file, transactions rendered by the engine
+        """
+        render = get_engine(self.engine)
+        header, footer = self._header_footer()
+
+        return [header] + [render(t) for t in self.transactions] + [footer]
+
     def generate_to_string(self):
-        return "".join(["".join(x) for x in self.generate()])
+        profiler = self._profiler()
+
+        with profiler.stage("render"):
+            return "".join(self.render())
+
+    def _profiler(self) -> MemoryProfiler:
+        if self.profiler is None:
+            return MemoryProfiler(enabled=False)
+
+        # Every transaction is held until the file is rendered
+        self.profiler.snapshot("built")
+        return self.profiler
+
+    def _header_footer(self):
+        header = record.Header(source=self.source, seq=self.seq, date=self.date)
+        footer = record.Footer(
+            source=self.source,
+            seq=self.seq,
+            count=len(self.transactions),
+            date=self.date,
+        )
+
+        return "".join(header.generate()), "".join(footer.generate())
+
+    def generate_to_file(self, path: str, processes: int = None) -> str:
+        """
+        Write the file to `path`, rendering rows in parallel
+        :param path:
+        :param processes: worker processes, None for one per CPU
+        """
+        from .parallel import render_to_file
+
+        profiler = self._profiler()
+
+        with profiler.stage("render"):
+            return render_to_file(
+                self.transactions,
+                path,
+                source=self.source,
+                seq=self.seq,
+                date=self.date,
+                processes=processes,
+                engine=self.engine,
+            )
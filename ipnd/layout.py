@@ -0,0 +1,122 @@
+from typing import Dict, List, NamedTuple
+from ipnd import record
+
+
+class Field(NamedTuple):
+    name: str
+    type: str
+    offset: int
+    size: int
+
+
+def _reference_transaction() -> record.Transaction:
+    entity = record.Person()
+    address = record.HouseAddress()
+
+    t = record.Transaction()
+
+    t.add_entry(record.CSPCode(""))
+    t.add_entry(record.DPCode(""))
+    t.add_entry(record.ServiceStatusCode("C"))
+    t.add_entry(record.UsageCode())
+    t.add_entry(record.CustomerName(entity))
+    t.add_entry(record.FindingName(entity))
+    t.add_entry(record.ServiceAddress(address))
+    t.add_entry(record.DirectoryAddress(address))
+    t.add_entry(record.CustomerContact(entity))
+
+    return t
+
+
+def _fields(records: List, prefix: str = "", offset: int = 0) -> List[Field]:
+    fields = []
+    seen: Dict[str, int] = {}
+
+    for item in records:
+        name = item.__class__.__name__
+
+        # Sub records such as StreetName appear twice, the second gets a suffix
+        seen[name] = seen.get(name, 0) + 1
+        if seen[name] > 1:
+            name = "{}_{}".format(name, seen[name])
+
+        fields.append(Field(prefix + name, item.TYPE, offset, item.SIZE))
+        offset += item.SIZE
+
+    return fields
+
+
+def _build():
+    transaction, leaves = [], []
+    offset = 0
+
+    for item in _reference_transaction().get_records():
+        children = record.BaseRecord.flatten(item.get_records())
+        size = sum(child.SIZE for child in children)
+        kind = getattr(item, "TYPE", "X")
+
+        transaction.append(Field(item.__class__.__name__, kind, offset, size))
+
+        # Names differ between people and businesses, so only fields that have
+        # the same sub layout for every entity are broken down further
+        if not isinstance(item, (record.CustomerName, record.FindingName)):
+            if len(children) > 1:
+                prefix = item.__class__.__name__ + "."
+                leaves += _fields(children, prefix=prefix, offset=offset)
+
+        offset += size
+
+    return transaction, leaves
+
+
+TRANSACTION_FIELDS, LEAF_FIELDS = _build()
+
+HEADER_FIELDS = _fields(record.Header(source="", seq=1).get_records())
+FOOTER_FIELDS = _fields(record.Footer(source="", seq=1, count=1).get_records())
+
+ROW_SIZE = sum(f.size for f in TRANSACTION_FIELDS)
+
+# Files are written one byte per character so that offsets can be computed
+# from the row number
+ENCODING = "latin-1"
+
+FIELDS = {f.name: f for f in TRANSACTION_FIELDS + LEAF_FIELDS}
+
+
+def get_field(name: str) -> Field:
+    try:
+        return FIELDS[name]
+    except KeyError:
+        raise KeyError("Unknown IPND field {}".format(name))
+
+
+def parse_row(row: str, fields: List[Field] = None) -> Dict[str, str]:
+    """
+    Split a fixed width row into its (stripped) field values
+    :param row:
+    :param fields: defaults to the top level transaction fields
+    """
+    fields = fields if fields is not None else TRANSACTION_FIELDS
+
+    return {f.name: row[f.offset : f.offset + f.size].strip() for f in fields}
+
+
+def set_field(row: str, name: str, value) -> str:
+    """
+    Return a copy of `row` with one field replaced, padded as the record would be
+    :param row:
+    :param name:
+    :param value:
+    """
+    field = get_field(name)
+
+    if field.type == "N":
+        value = str(value).rjust(field.size, "0")
+        if len(value) > field.size:
+            raise record.ValidationError(
+                "{} is larger than {} characters".format(name, field.size)
+            )
+    else:
+        value = str(value)[0 : field.size].ljust(field.size, " ")
+
+    return row[0 : field.offset] + value + row[field.offset + field.size :]
@@ -0,0 +1,194 @@
+import gc
+import os
+import sys
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Dict, List, NamedTuple, TypeVar, cast
+from ipnd import record
+
+F = TypeVar("F", bound=Callable)
+
+
+class ClassUsage(NamedTuple):
+    instances: int
+    bytes: int
+
+
+class StageUsage(NamedTuple):
+    # For `stage`, memory still held when the stage finished and its peak,
+    # both relative to when it started. For `track`, the total every call
+    # left allocated and the most any one call did.
+    retained: int
+    peak: int
+
+
+def record_classes(module=record) -> List[type]:
+    return [
+        c
+        for c in vars(module).values()
+        if isinstance(c, type) and c.__module__ == module.__name__
+    ]
+
+
+def count_instances(classes: List[type] = None) -> Dict[str, ClassUsage]:
+    """
+    Live instances and their approximate size (the object and its attribute
+    dict, not what it refers to) for every class in `ipnd.record`. Walks
+    every object tracked by the garbage collector, so call it sparingly.
+    :param classes: defaults to every class in `ipnd.record`
+    """
+    wanted = set(classes if classes is not None else record_classes())
+    usage: Dict[str, List[int]] = {}
+
+    for obj in gc.get_objects():
+        cls = type(obj)
+
+        if cls in wanted:
+            size = sys.getsizeof(obj)
+            if hasattr(obj, "__dict__"):
+                size += sys.getsizeof(obj.__dict__)
+
+            totals = usage.setdefault(cls.__name__, [0, 0])
+            totals[0] += 1
+            totals[1] += size
+
+    return {name: ClassUsage(*totals) for name, totals in usage.items()}
+
+
+class MemoryProfiler:
+    """
+    Opt in memory instrumentation for a build. Wrap each stage in
+    `with profiler.stage(name)` to record its peak usage through tracemalloc,
+    and call `snapshot(name)` while the records are alive to count instances
+    per record class. Stages that run item by item, such as pipeline stages,
+    can `track` a function instead. When disabled, which is the default
+    unless the IPND_PROFILE_MEMORY environment variable is set, stages cost a
+    flag check and nothing is traced.
+
+    `IPND`, `batch.generate`, `pipeline.Pipeline` and
+    `pipeline.run_inventory` take a profiler, and `ipnd generate` prints a
+    report when the environment variable is set.
+    """
+
+    def __init__(self, enabled: bool = None):
+        if enabled is None:
+            enabled = bool(os.environ.get("IPND_PROFILE_MEMORY"))
+
+        self.enabled = enabled
+        self.stages: Dict[str, StageUsage] = {}
+        self.snapshots: Dict[str, Dict[str, ClassUsage]] = {}
+        self.classes: Dict[str, ClassUsage] = {}
+        self.peak = 0
+
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started = True
+
+    def stop(self):
+        if self._started:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            self._started = False
+
+    @contextmanager
+    def stage(self, name: str):
+        if not self.enabled:
+            yield
+            return
+
+        self.start()
+
+        # Without reset_peak (Python < 3.9) a stage's peak includes earlier ones
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            self.stages[name] = StageUsage(current - before, peak - before)
+            self.peak = max(self.peak, peak)
+
+    def track(self, name: str, func: F) -> F:
+        """
+        Wrap `func` so the memory each call leaves allocated, usually the
+        value it hands to the next stage, is added to stage `name`. Frees
+        made later, downstream, aren't subtracted, so the total is what the
+        stage allocated for its output over the run, not what it held at
+        once; the peak is the most any one call left allocated. Other threads
+        allocating during a call are counted too, so figures for concurrent
+        stages are approximate. Returns `func` itself when disabled.
+        :param name:
+        :param func:
+        """
+        if not self.enabled:
+            return func
+
+        self.start()
+
+        def tracked(*args, **kwargs):
+            before = tracemalloc.get_traced_memory()[0]
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._add(name, tracemalloc.get_traced_memory()[0] - before)
+
+        return cast(F, tracked)
+
+    def _add(self, name: str, retained: int):
+        with self._lock:
+            usage = self.stages.get(name, StageUsage(0, 0))
+            self.stages[name] = StageUsage(
+                usage.retained + retained, max(usage.peak, retained)
+            )
+
+    def snapshot(self, name: str = "snapshot") -> Dict[str, ClassUsage]:
+        """
+        Count live record instances, keeping the counts under `name` for
+        `report`
+        :param name: where in the build the snapshot was taken
+        """
+        if self.enabled:
+            self.classes = self.snapshots[name] = count_instances()
+
+        return self.classes
+
+    def report(self) -> str:
+        lines = []
+
+        for snapshot, classes in self.snapshots.items():
+            lines.append(
+                "{:<32}{:>12}{:>14}".format(
+                    "Class ({})".format(snapshot), "Instances", "Bytes"
+                )
+            )
+
+            for name, cls in sorted(classes.items(), key=lambda i: -i[1].bytes):
+                lines.append(
+                    "{:<32}{:>12}{:>14}".format(name, cls.instances, cls.bytes)
+                )
+
+            lines.append("")
+
+        lines.append("{:<32}{:>12}{:>14}".format("Stage", "Retained", "Peak"))
+
+        for name, stage in self.stages.items():
+            lines.append("{:<32}{:>12}{:>14}".format(name, stage.retained, stage.peak))
+
+        lines.append("")
+        lines.append("Peak traced memory: {} bytes".format(self.peak))
+
+        return "\n".join(lines)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
@@ -0,0 +1,194 @@
+import struct
+from typing import Iterator, List, Sequence, Tuple, cast
+from ipnd import record
+from .layout import ENCODING
+
+try:
+    from multiprocessing import shared_memory
+
+    HAS_SHARED_MEMORY = True
+except ImportError:  # Python < 3.8
+    HAS_SHARED_MEMORY = False
+
+_HEADER = struct.Struct("<II")
+
+
+def _layout(count: int, leaves: int):
+    """
+    Offsets of the tables in a batch: the first leaf of each transaction and
+    the start of each value (uint32), each leaf's size (uint16) and whether
+    it's numeric (uint8), then the values
+    """
+    starts = _HEADER.size
+    values = starts + (count + 1) * 4
+    sizes = values + (leaves + 1) * 4
+    numeric = sizes + leaves * 2
+    data = numeric + leaves
+
+    return starts, values, sizes, numeric, data
+
+
+def _leaves(transaction: record.Transaction) -> Iterator[Tuple[bytes, int, bool]]:
+    """
+    The encoded value, size and whether it's numeric of every leaf record
+    """
+    for leaf in record.BaseRecord.flatten(transaction.get_records()):
+        yield str(leaf.value).encode(ENCODING, "replace"), leaf.SIZE, leaf.TYPE == "N"
+
+
+def _format(value: bytes, size: int, numeric: bool) -> bytes:
+    if numeric:
+        if len(value) > size:
+            raise Exception(
+                "Col is larger than size - {} > {} for {}".format(
+                    len(value), size, value.decode(ENCODING)
+                )
+            )
+        return value.rjust(size, b"0")
+
+    return value[0:size].ljust(size, b" ")
+
+
+def render_leaves(transaction: record.Transaction) -> str:
+    """
+    Render a transaction the way a `PackedBatch` renders its rows, from the
+    flattened leaf values. Registered as the "packed" engine, so it can be
+    checked against the reference renderer like any other engine.
+    :param transaction:
+    """
+    row = b"".join(_format(*leaf) for leaf in _leaves(transaction))
+    return row.decode(ENCODING)
+
+
+class PackedBatch:
+    """
+    The leaf values of a list of transactions packed into one shared memory
+    buffer with offset tables, so worker processes can attach to it by name
+    and render rows without the transactions being pickled.
+
+    Packing walks every transaction's records in the calling process, which
+    costs about half as much as rendering them, so it only pays off when
+    pickling transactions to workers would cost more still.
+    """
+
+    def __init__(self, shm):
+        self.shm = shm
+        self.name: str = shm.name
+        self.count, self.leaves = _HEADER.unpack_from(shm.buf)
+
+        buf = shm.buf
+        starts, values, sizes, numeric, data = _layout(self.count, self.leaves)
+
+        self._starts = buf[starts:values].cast("I")
+        self._values = buf[values:sizes].cast("I")
+        self._sizes = buf[sizes:numeric].cast("H")
+        self._numeric = buf[numeric:data]
+        self._data = buf[data:]
+
+    @classmethod
+    def pack(cls, transactions: Sequence[record.Transaction]) -> "PackedBatch":
+        """
+        Pack transactions into a new shared memory block, which the caller
+        should `unlink` once every worker is done with it
+        :param transactions:
+        """
+        if not HAS_SHARED_MEMORY:
+            raise RuntimeError("Packed batches need multiprocessing.shared_memory")
+
+        starts: List[int] = [0]
+        sizes: List[int] = []
+        numeric = bytearray()
+        values: List[bytes] = []
+
+        for t in transactions:
+            for value, size, is_numeric in _leaves(t):
+                values.append(value)
+                sizes.append(size)
+                numeric.append(is_numeric)
+            starts.append(len(values))
+
+        count, leaves = len(transactions), len(values)
+        offsets = [0]
+        for value in values:
+            offsets.append(offsets[-1] + len(value))
+
+        _, _, _, _, data = _layout(count, leaves)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, data + offsets[-1]))
+
+        try:
+            buf = cast(memoryview, shm.buf)
+            position = 0
+
+            for chunk in (
+                _HEADER.pack(count, leaves),
+                struct.pack("<{}I".format(count + 1), *starts),
+                struct.pack("<{}I".format(leaves + 1), *offsets),
+                struct.pack("<{}H".format(leaves), *sizes),
+                numeric,
+                b"".join(values),
+            ):
+                buf[position : position + len(chunk)] = chunk
+                position += len(chunk)
+        except Exception:
+            shm.close()
+            shm.unlink()
+            raise
+
+        return cls(shm)
+
+    @classmethod
+    def attach(cls, name: str) -> "PackedBatch":
+        return cls(shared_memory.SharedMemory(name=name))
+
+    def row(self, n: int) -> bytes:
+        """
+        Render row `n` as encoded bytes
+        :param n:
+        """
+        if n < 0 or n >= self.count:
+            raise IndexError("Row {} out of range".format(n))
+
+        values, sizes, numeric, data = (
+            self._values,
+            self._sizes,
+            self._numeric,
+            self._data,
+        )
+        output = []
+
+        for leaf in range(self._starts[n], self._starts[n + 1]):
+            value = bytes(data[values[leaf] : values[leaf + 1]])
+            output.append(_format(value, sizes[leaf], bool(numeric[leaf])))
+
+        return b"".join(output)
+
+    def rows(self, first: int = 0, last: int = None) -> Iterator[bytes]:
+        last = self.count if last is None else last
+
+        for n in range(first, last):
+            yield self.row(n)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        # Views onto the buffer must be released before it can be closed
+        for view in (
+            self._starts,
+            self._values,
+            self._sizes,
+            self._numeric,
+            self._data,
+        ):
+            view.release()
+
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
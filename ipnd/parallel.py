@@ -0,0 +1,165 @@
+import mmap
+import multiprocessing
+import os
+from datetime import datetime
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
+from ipnd import record
+from .engines import Engine, Tally, for_worker, get_engine, merge, take
+from .layout import ROW_SIZE
+from .packed import PackedBatch
+from .writer import ENCODING, MAX_ROWS
+
+# Transactions and engine inherited by forked workers, so they are never
+# pickled
+_transactions: Sequence[record.Transaction] = ()
+_engine: Union[str, Engine, None] = None
+
+
+def _ranges(count: int, parts: int) -> List[Tuple[int, int]]:
+    size = max(1, -(-count // parts))
+    return [(start, min(start + size, count)) for start in range(0, count, size)]
+
+
+def _map_rows(path: str, start: int, rows: Iterable[bytes], count: int):
+    """
+    Write encoded rows into their slot of the output file, `start` counting
+    from 0 after the header
+    """
+    with open(path, "r+b") as fp:
+        offset = (start + 1) * ROW_SIZE
+        length = count * ROW_SIZE
+
+        # mmap offsets must be page aligned
+        aligned = offset - offset % mmap.ALLOCATIONGRANULARITY
+
+        with mmap.mmap(fp.fileno(), length + offset - aligned, offset=aligned) as mm:
+            position = offset - aligned
+
+            for row in rows:
+                mm[position : position + ROW_SIZE] = row
+                position += ROW_SIZE
+
+
+def _render_into(
+    path: str,
+    start: int,
+    transactions: Sequence[record.Transaction],
+    engine: Union[str, Engine, None],
+):
+    render = get_engine(engine)
+    rows = (render(t).encode(ENCODING, "replace") for t in transactions)
+    _map_rows(path, start, rows, len(transactions))
+
+
+def _render_inherited(args: Tuple[str, int, int]) -> Optional[Tally]:
+    path, start, end = args
+    engine = for_worker(_engine, start)
+    _render_into(path, start, _transactions[start:end], engine)
+    return take(engine)
+
+
+def _render_sent(
+    args: Tuple[str, int, Sequence[record.Transaction], Union[str, Engine, None]],
+) -> Optional[Tally]:
+    path, start, transactions, engine = args
+    _render_into(path, start, transactions, engine)
+    return take(engine)
+
+
+def _render_packed(args: Tuple[str, str, int, int]):
+    path, name, start, end = args
+
+    with PackedBatch.attach(name) as batch:
+        _map_rows(path, start, batch.rows(start, end), end - start)
+
+
+def render_to_file(
+    transactions: Sequence[record.Transaction],
+    path: str,
+    source: str,
+    seq: int,
+    date: datetime = None,
+    processes: int = None,
+    packed: bool = False,
+    engine: Union[str, Engine] = None,
+) -> str:
+    """
+    Render one IPND file in parallel. Every row has a fixed width, so the file
+    is sized up front and each worker renders its range of rows straight into
+    its slice of a memory map. The header and footer are written last.
+
+    Forked workers inherit `transactions`, or failing that each range is
+    pickled and sent to its worker. With `packed`, transactions are instead
+    packed into shared memory (see `ipnd.packed`) which workers read
+    directly, rendering as the "packed" engine does. Packing is serial and
+    costs about half a full render, so it is off by default; measure before
+    turning it on.
+    :param transactions:
+    :param path:
+    :param source:
+    :param seq: file sequence number
+    :param date: file date, defaults to now
+    :param processes: worker processes, None for one per CPU
+    :param packed: hand transactions to workers through shared memory
+    :param engine: rendering engine or its name, see `ipnd.engines`; unless
+        workers are forked it is sent to them, so must be picklable. An
+        `EquivalenceChecker` gets the counts of checks made in every worker
+    """
+    global _transactions, _engine
+
+    count = len(transactions)
+    if count < 1 or count > MAX_ROWS:
+        raise ValueError("Expected between 1 and {} transactions".format(MAX_ROWS))
+
+    date = date if date else datetime.now()
+    processes = processes if processes else os.cpu_count() or 1
+
+    header = record.Header(source=source, seq=seq, date=date)
+    footer = record.Footer(source=source, seq=seq, count=count, date=date)
+
+    with open(path, "wb") as fp:
+        fp.truncate((count + 2) * ROW_SIZE)
+
+    can_fork = "fork" in multiprocessing.get_all_start_methods()
+
+    # Several ranges per worker evens out uneven rendering costs
+    ranges = _ranges(count, processes * 4)
+
+    if processes == 1:
+        for start, end in ranges:
+            _render_into(path, start, transactions[start:end], engine)
+    elif packed:
+        if engine is not None and engine != "packed":
+            raise ValueError("Packed batches are rendered by the packed engine")
+
+        batch = PackedBatch.pack(transactions)
+        try:
+            with multiprocessing.Pool(processes) as pool:
+                pool.map(_render_packed, [(path, batch.name, s, e) for s, e in ranges])
+        finally:
+            batch.close()
+            batch.unlink()
+    elif can_fork:
+        _transactions, _engine = transactions, engine
+        try:
+            with multiprocessing.get_context("fork").Pool(processes) as pool:
+                for tally in pool.map(
+                    _render_inherited, [(path, s, e) for s, e in ranges]
+                ):
+                    merge(engine, tally)
+        finally:
+            _transactions, _engine = (), None
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            for tally in pool.map(
+                _render_sent,
+                [(path, s, transactions[s:e], engine) for s, e in ranges],
+            ):
+                merge(engine, tally)
+
+    with open(path, "r+b") as fp:
+        fp.write("".join(header.generate()).encode(ENCODING, "replace"))
+        fp.seek((count + 1) * ROW_SIZE)
+        fp.write("".join(footer.generate()).encode(ENCODING, "replace"))
+
+    return path
@@ -0,0 +1,389 @@
+import queue
+import threading
+import time
+from collections import deque
+from functools import partial
+from multiprocessing import Pool
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+from .batch import Stats
+from .gazetteer import Gazetteer
+from .holdings import Holdings
+from .engines import Engine, EquivalenceChecker, get_engine
+from .inventory import build_transaction
+from .memory import MemoryProfiler
+from .writer import FileWriter, render
+
+# Marks the end of the stream on a queue
+_DONE = object()
+
+
+class StageMetrics:
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, items: int, busy: float):
+        with self._lock:
+            self.items += items
+            self.busy += busy
+
+    @property
+    def rate(self) -> float:
+        """
+        Items per second of wall time
+        """
+        return self.items / self.seconds if self.seconds else 0.0
+
+    @property
+    def utilisation(self) -> float:
+        """
+        Fraction of the stage's workers' time spent working
+        """
+        return self.busy / (self.seconds * self.workers) if self.seconds else 0.0
+
+    def __repr__(self):
+        return "<StageMetrics {} {} items {:.0f}/s {:.0%} busy>".format(
+            self.name, self.items, self.rate, self.utilisation
+        )
+
+
+class Stage:
+    """
+    One step of a pipeline. `func` maps an item to the next stage's item, or
+    to None to drop it. Thread stages run `workers` threads; process stages
+    send batches of `chunksize` items to a pool of `workers` processes, so
+    `func` and the items must be picklable.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[Any], Any],
+        workers: int = 1,
+        processes: bool = False,
+        chunksize: int = 500,
+    ):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.processes = processes
+        self.chunksize = chunksize
+
+
+def _apply_batch(func, batch):
+    return [None if item is None else func(item) for item in batch]
+
+
+class Pipeline:
+    """
+    Run stages concurrently, connected by queues of at most `maxsize` items so
+    a slow stage holds back the ones before it. Items reach the sink in the
+    order they were read.
+
+    With a `profiler`, the memory left allocated by each thread stage and the
+    sink is tracked per stage (see `MemoryProfiler.track`), and record
+    instances are counted when the first item reaches the sink, while the
+    queues behind it are filling. Process stages allocate in their workers
+    and aren't tracked.
+    """
+
+    def __init__(
+        self,
+        stages: List[Stage],
+        sink: Callable[[Any], None],
+        maxsize=1000,
+        profiler: MemoryProfiler = None,
+    ):
+        self.stages = stages
+        self.sink = sink
+        self.maxsize = maxsize
+        self.profiler = profiler
+        self.metrics: Dict[str, StageMetrics] = {}
+        self._error: Optional[BaseException] = None
+
+    def _fail(self, e: BaseException):
+        if self._error is None:
+            self._error = e
+
+    def _ingest(self, items: Iterable, output: queue.Queue, metrics: StageMetrics):
+        start = time.monotonic()
+
+        try:
+            for n, item in enumerate(items):
+                if self._error is not None:
+                    break
+                output.put((n, item))
+                metrics.add(1, 0.0)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            output.put(_DONE)
+            metrics.seconds = time.monotonic() - start
+
+    def _track(self, name: str, func: Callable) -> Callable:
+        return self.profiler.track(name, func) if self.profiler else func
+
+    def _apply(self, func: Callable, value, metrics: StageMetrics):
+        # Items dropped by an earlier stage are passed along to keep the order
+        if value is None:
+            return None
+
+        started = time.monotonic()
+        result = func(value)
+        metrics.add(1, time.monotonic() - started)
+        return result
+
+    def _run_threads(self, stage, input, output, metrics):
+        remaining = [stage.workers]
+        lock = threading.Lock()
+        func = self._track(stage.name, stage.func)
+
+        def work():
+            while True:
+                item = input.get()
+
+                if item is _DONE:
+                    # Let the other workers see the end of the stream too
+                    input.put(_DONE)
+                    break
+
+                if self._error is not None:
+                    continue
+
+                n, value = item
+                try:
+                    output.put((n, self._apply(func, value, metrics)))
+                except BaseException as e:
+                    self._fail(e)
+
+            with lock:
+                remaining[0] -= 1
+                if not remaining[0]:
+                    output.put(_DONE)
+
+        return [
+            threading.Thread(target=work, daemon=True) for _ in range(stage.workers)
+        ]
+
+    def _run_processes(self, stage, input, output, metrics):
+        def work():
+            pending: deque = deque()
+            done = False
+
+            def collect():
+                numbers, result, started = pending.popleft()
+                values = result.get()
+                metrics.add(
+                    sum(v is not None for v in values), time.monotonic() - started
+                )
+                for n, value in zip(numbers, values):
+                    output.put((n, value))
+
+            try:
+                with Pool(stage.workers) as pool:
+                    while not done:
+                        batch = []
+                        while len(batch) < stage.chunksize:
+                            item = input.get()
+                            if item is _DONE:
+                                done = True
+                                break
+                            batch.append(item)
+
+                        if batch and self._error is None:
+                            result = pool.apply_async(
+                                _apply_batch, (stage.func, [v for _, v in batch])
+                            )
+                            pending.append(
+                                ([n for n, _ in batch], result, time.monotonic())
+                            )
+
+                        # Keep every worker busy, but no more than that
+                        while len(pending) > stage.workers or (done and pending):
+                            collect()
+            except BaseException as e:
+                self._fail(e)
+                while not done:
+                    done = input.get() is _DONE
+            finally:
+                output.put(_DONE)
+
+        return [threading.Thread(target=work, daemon=True)]
+
+    def run(self, items: Iterable) -> List[StageMetrics]:
+        """
+        Feed `items` through the stages into the sink, returning the metrics
+        of each stage, ingest and the sink
+        :param items:
+        """
+        self._error = None
+        queues: List[queue.Queue] = [
+            queue.Queue(self.maxsize) for _ in range(len(self.stages) + 1)
+        ]
+        start = time.monotonic()
+
+        metrics = [StageMetrics("ingest", 1)]
+        threads = [
+            threading.Thread(
+                target=self._ingest, args=(items, queues[0], metrics[0]), daemon=True
+            )
+        ]
+
+        for stage, input, output in zip(self.stages, queues, queues[1:]):
+            stage_metrics = StageMetrics(stage.name, stage.workers)
+            metrics.append(stage_metrics)
+
+            run = self._run_processes if stage.processes else self._run_threads
+            threads += run(stage, input, output, stage_metrics)
+
+        for thread in threads:
+            thread.start()
+
+        sink = StageMetrics("sink", 1)
+        metrics.append(sink)
+        write = self._track("sink", self.sink)
+
+        # Results can arrive out of order from parallel workers
+        waiting: Dict[int, Any] = {}
+        expected = 0
+        output = queues[-1]
+
+        while True:
+            item = output.get()
+            if item is _DONE:
+                break
+
+            n, value = item
+            waiting[n] = value
+
+            while expected in waiting:
+                value = waiting.pop(expected)
+                expected += 1
+
+                if value is None or self._error is not None:
+                    continue
+
+                try:
+                    started = time.monotonic()
+                    write(value)
+                    sink.add(1, time.monotonic() - started)
+                except BaseException as e:
+                    self._fail(e)
+
+                if expected == 1 and self.profiler is not None:
+                    self.profiler.snapshot("in flight")
+
+        for thread in threads:
+            thread.join()
+
+        seconds = time.monotonic() - start
+        for m in metrics[1:]:
+            m.seconds = seconds
+
+        self.metrics = {m.name: m for m in metrics}
+
+        if self._error is not None:
+            raise self._error
+
+        return metrics
+
+
+def _validate(csp, dp, date, gazetteer, holdings, rejected, item):
+    n, value = item
+
+    try:
+        return build_transaction(
+            value, csp=csp, dp=dp, date=date, gazetteer=gazetteer, holdings=holdings
+        )
+    except Exception as e:
+        rejected.append((n, str(e)))
+        return None
+
+
+def _render_checked(checker: EquivalenceChecker, transaction):
+    # In a worker process, so the parent can merge what was checked
+    return checker(transaction), checker.take()
+
+
+def run_inventory(
+    items: Iterable[Dict[str, str]],
+    writer: FileWriter,
+    csp: str,
+    dp: str,
+    render_workers: int = 1,
+    processes: bool = False,
+    maxsize: int = 1000,
+    gazetteer: Gazetteer = None,
+    holdings: Holdings = None,
+    profiler: MemoryProfiler = None,
+    engine: Union[str, Engine] = None,
+):
+    """
+    Generate IPND files from inventory items with ingest, validate, render
+    and write running as separate stages
+    :param items:
+    :param writer:
+    :param csp: default CSPCode
+    :param dp: default DPCode
+    :param render_workers: render threads, or processes if `processes`
+    :param processes: render in worker processes
+    :param maxsize: items held between stages
+    :param gazetteer: validate localities against this
+    :param holdings: reject numbers we don't hold
+    :param profiler: track memory per stage, count the records in flight
+        (see `Pipeline`), and track memory while closing the writer
+    :param engine: rendering engine or its name, see `ipnd.engines`. With
+        `processes`, an `EquivalenceChecker` gets the counts of checks made in
+        every worker
+    :return: batch stats and the metrics of each stage
+    """
+    rejected: List = []
+    render_one: Callable = partial(render, engine=engine)
+    sink: Callable = writer.write_row
+
+    checker = get_engine(engine)
+    if processes and isinstance(checker, EquivalenceChecker):
+        render_one = partial(_render_checked, checker)
+
+        def sink(value):
+            row, tally = value
+            checker.merge(tally)
+            writer.write_row(row)
+
+    pipeline = Pipeline(
+        [
+            Stage(
+                "validate",
+                partial(_validate, csp, dp, writer.date, gazetteer, holdings, rejected),
+            ),
+            Stage(
+                "render",
+                render_one,
+                workers=render_workers,
+                processes=processes,
+            ),
+        ],
+        sink=sink,
+        maxsize=maxsize,
+        profiler=profiler,
+    )
+    profiler = profiler if profiler is not None else MemoryProfiler(enabled=False)
+
+    start = time.monotonic()
+    metrics = pipeline.run(enumerate(items))
+
+    with profiler.stage("close"):
+        writer.close()
+
+    stats = Stats(
+        rows=pipeline.metrics["sink"].items,
+        rejected=sorted(rejected),
+        files=list(writer.files),
+        seconds=time.monotonic() - start,
+    )
+
+    return stats, metrics
@@ -0,0 +1,84 @@
+import mmap
+from datetime import datetime
+from typing import Iterator, Tuple
+from .layout import ROW_SIZE
+from .writer import ENCODING
+
+
+class IPNDFile:
+    """
+    Random access to the rows of an IPND file through a memory map. Rows may
+    be packed back to back (as `Writer` produces) or newline terminated.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        with open(path, "rb") as fp:
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.mm) < ROW_SIZE * 2:
+            self.close()
+            raise ValueError("{} is too short to be an IPND file".format(path))
+
+        terminator = self.mm[ROW_SIZE : ROW_SIZE + 2]
+        if terminator == b"\r\n":
+            self.stride = ROW_SIZE + 2
+        elif terminator[0:1] == b"\n":
+            self.stride = ROW_SIZE + 1
+        else:
+            self.stride = ROW_SIZE
+
+        # The last record may be missing its terminator
+        self.records = (len(self.mm) + self.stride - ROW_SIZE) // self.stride
+
+        header = self.header
+        self.source = header[9:14].rstrip()
+        self.seq = int(header[14:21])
+        self.date = datetime.strptime(header[21:35], "%Y%m%d%H%M%S")
+
+    @property
+    def header(self) -> str:
+        return self.record(0)
+
+    @property
+    def footer(self) -> str:
+        return self.record(self.records - 1)
+
+    def record(self, n: int) -> str:
+        offset = n * self.stride
+        return self.mm[offset : offset + ROW_SIZE].decode(ENCODING)
+
+    def row(self, n: int) -> str:
+        """
+        Transaction row `n`, counting from 0 after the header
+        :param n:
+        """
+        if n < 0 or n >= len(self):
+            raise IndexError("Row {} out of range".format(n))
+
+        return self.record(n + 1)
+
+    def rows(self) -> Iterator[str]:
+        for n in range(len(self)):
+            yield self.record(n + 1)
+
+    def keys(self) -> Iterator[Tuple[int, bytes]]:
+        """
+        Row number and raw PublicNumber slot of every row, without decoding rows
+        """
+        for n in range(len(self)):
+            offset = (n + 1) * self.stride
+            yield n, self.mm[offset : offset + 20]
+
+    def close(self):
+        self.mm.close()
+
+    def __len__(self):
+        return self.records - 2
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -8,6 +8,34 @@ class ValidationError(Exception):
     pass
 
 
+class FrozenError(Exception):
+    pass
+
+
+class Freezable:
+    """
+    Instances shared between many transactions are frozen so that changing
+    one can't silently change the others. Every change bumps `revision`, so
+    anything rendered from an instance can tell when it is out of date.
+    """
+
+    frozen: bool = False
+    revision: int = 0
+
+    def freeze(self):
+        object.__setattr__(self, "frozen", True)
+        return self
+
+    def __setattr__(self, name, value):
+        if self.frozen:
+            raise FrozenError(
+                "{} is frozen and can't be modified".format(self.__class__.__name__)
+            )
+
+        super().__setattr__(name, value)
+        object.__setattr__(self, "revision", self.revision + 1)
+
+
 class BaseRecord:
     SIZE: int = -1
     value: str
@@ -38,6 +66,14 @@ class BaseRecord:
     def get_records(self):
         return [self]
 
+    def get_revision(self):
+        """
+        Changes whenever the output of `generate` could have changed. Records
+        are only tracked through the objects (entities and addresses) they
+        wrap; set a record's value by adding a new record instead.
+        """
+        return 0
+
 
 class NumericRecord:
     TYPE = "N"
@@ -90,6 +126,15 @@ class ValidEnum:
 class PublicNumber(SingleRecord, AlphaRecord):
     SIZE: int = 20
 
+    # Optional holdings.Holdings used to normalise and check numbers
+    holdings = None
+
+    def __init__(self, value=None):
+        if value and self.holdings is not None:
+            value = self.holdings.check(value)
+
+        super().__init__(value=value)
+
 
 class ServiceStatusCode(SingleRecord, AlphaRecord):
     SIZE: int = 1
@@ -138,6 +183,9 @@ class CustomerContactNum(SingleRecord, AlphaRecord):
 
 
 class CustomerName(MultipleRecord):
+    def get_revision(self):
+        return self.value, self.value.revision
+
     def get_records(self):
         if self.value.is_business():
             # Note this is 5.1, 5.2, and 5.3
@@ -447,7 +495,10 @@ class ServiceLocality(MultipleRecord):
         return [self.state, self.locality, self.postcode]
 
 
-class Address(MultipleRecord):
+class Address(Freezable, MultipleRecord):
+    # Optional gazetteer.Gazetteer used to validate set_locality
+    gazetteer = None
+
     def __init__(self):
         self.building_subunit = BuildingSubUnit()
         self.building_floor = BuildingFloor()
@@ -466,6 +517,11 @@ class Address(MultipleRecord):
         )
 
     def set_locality(self, postcode: str, locality: str, state: str = None):
+        if self.gazetteer is not None:
+            postcode, locality, state = self.gazetteer.normalise(
+                postcode, locality, state
+            )
+
         self.service_locality = ServiceLocality(
             postcode=postcode, locality=locality, state=state
         )
@@ -481,6 +537,23 @@ class Address(MultipleRecord):
             self.service_locality,
         ]
 
+    def get_revision(self):
+        return self.revision
+
+    def generate(self):
+        # Addresses are often shared by many transactions, so keep the output
+        cached = self.__dict__.get("_generated")
+
+        if cached is None or cached[0] != self.revision:
+            cached = (self.revision, super().generate())
+            object.__setattr__(self, "_generated", cached)
+
+        return list(cached[1])
+
+    def content_key(self):
+        records = self.flatten(self.get_records())
+        return (self.__class__,) + tuple((r.__class__, r.value) for r in records)
+
 
 class HouseAddress(Address):
     def set_street_number(self, no: str):
@@ -499,6 +572,12 @@ class BaseAddress(Address):
     def get_records(self):
         return self.address.get_records()
 
+    def get_revision(self):
+        return self.address, self.address.revision
+
+    def generate(self):
+        return self.address.generate()
+
 
 class DirectoryAddress(BaseAddress):
     pass
@@ -524,6 +603,9 @@ class FindingName(MultipleRecord):
     def __init__(self, entity):
         self.entity = entity
 
+    def get_revision(self):
+        return self.entity, self.entity.revision
+
     def get_records(self):
         if self.entity.is_business():
             return [BusinessRawnameRecord(self.entity.rawname), FindingTitle()]
@@ -552,6 +634,9 @@ class CustomerContact(MultipleRecord):
     def __init__(self, entity):
         self.entity = entity
 
+    def get_revision(self):
+        return self.entity, self.entity.revision
+
     def get_records(self):
         return [
             CustomerSurnameRecord(self.entity.surname),
@@ -602,7 +687,7 @@ class PriorPublicNumber(SingleRecord, AlphaRecord):
     SIZE: int = 20
 
 
-class Entity:
+class Entity(Freezable):
     type: str = "NA"
     title: str = ""
     rawname: str = ""
@@ -617,6 +702,18 @@ class Entity:
     def is_business(self):
         return self.type not in ["PERSON", "NA"]
 
+    def content_key(self):
+        return (
+            self.__class__,
+            self.type,
+            self.title,
+            self.rawname,
+            self.firstname,
+            self.surname,
+            self.longname,
+            self.contactnum,
+        )
+
     def set_contactnum(self, num):
         self.contactnum = num[0:20]
 
@@ -789,11 +886,16 @@ class Transaction(MultipleRecord):
 
     def __init__(self):
         self.t = {}
+        self._generated = None
 
     def add_entry(self, record: BaseRecord):
 
         index = self.INDEX[record.__class__]
         self.t[index] = record
+        self._generated = None
+
+    def get_entry(self, record_class):
+        return self.t.get(self.INDEX[record_class])
 
     def get_records(self):
 
@@ -810,3 +912,29 @@ class Transaction(MultipleRecord):
         records = sorted([(v, k) for k, v in self.t.items()], key=lambda x: x[1])
 
         return [r[0] for r in records]
+
+    def _generate(self):
+        """
+        The output is kept until an entry is added or an entity or address it
+        uses is changed
+        """
+        records = self.get_records()
+        revision = [r.get_revision() for r in records]
+
+        if self._generated is None or self._generated[0] != revision:
+            output: List[str] = []
+            for r in records:
+                output += r.generate()
+
+            self._generated = (revision, output, "".join(output))
+
+        return self._generated
+
+    def generate(self):
+        return list(self._generate()[1])
+
+    def render(self) -> str:
+        """
+        The transaction as a single fixed width row
+        """
+        return self._generate()[2]
@@ -0,0 +1,187 @@
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from .reader import IPNDFile
+from .record import ValidationError
+
+# Response files are newline separated records:
+#
+#   HDR, file type (IPNDER or IPNDAK), source (5), sequence of the file being
+#        responded to (7), date (14)
+#   ERR, row number within the submitted file (7, counting from 1),
+#        PublicNumber (20), error code (4), free text message
+#   TRL, number of ERR records (7)
+ERROR = "IPNDER"
+ACKNOWLEDGEMENT = "IPNDAK"
+
+
+class ResponseError(NamedTuple):
+    seq: int
+    row: int
+    public_number: str
+    code: str
+    message: str
+
+
+class Response(NamedTuple):
+    kind: str
+    source: str
+    seq: int
+    date: datetime
+    errors: List[ResponseError]
+
+    def is_error(self) -> bool:
+        return self.kind == ERROR
+
+
+class Rejection(NamedTuple):
+    error: ResponseError
+    row_number: Optional[int]
+    row: Optional[str]
+
+
+def parse_response(lines: Iterable[str]) -> Response:
+    """
+    Parse a registrar error or acknowledgement file
+    :param lines: an open file or other iterable of records
+    """
+    header, errors, count = None, [], None
+
+    for line in lines:
+        line = line.rstrip("\r\n")
+
+        if not line:
+            continue
+
+        kind = line[0:3]
+
+        if kind == "HDR":
+            if line[3:9] not in (ERROR, ACKNOWLEDGEMENT):
+                raise ValidationError("Unknown response type {}".format(line[3:9]))
+            header = line
+        elif header is None:
+            raise ValidationError("Expected HDR record but got {}".format(kind))
+        elif kind == "ERR":
+            errors.append(
+                ResponseError(
+                    seq=int(header[14:21]),
+                    row=int(line[3:10]),
+                    public_number=line[10:30].strip(),
+                    code=line[30:34].strip(),
+                    message=line[34:].strip(),
+                )
+            )
+        elif kind == "TRL":
+            count = int(line[3:10])
+        else:
+            raise ValidationError("Unknown response record {}".format(kind))
+
+    if header is None:
+        raise ValidationError("Missing HDR record")
+    if count is None:
+        raise ValidationError("Missing TRL record")
+    if count != len(errors):
+        raise ValidationError(
+            "Trailer count {} does not match {} errors".format(count, len(errors))
+        )
+
+    return Response(
+        kind=header[3:9],
+        source=header[9:14].strip(),
+        seq=int(header[14:21]),
+        date=datetime.strptime(header[21:35], "%Y%m%d%H%M%S"),
+        errors=errors,
+    )
+
+
+class Reconciler:
+    """
+    Join response errors back to the rows that were submitted. Submitted
+    files are indexed by sequence number up front, but a file's rows are only
+    indexed by PublicNumber the first time an error refers to it.
+    """
+
+    def __init__(self, paths: Iterable[str]):
+        self.paths: Dict[int, str] = {}
+        self._files: Dict[int, IPNDFile] = {}
+        self._index: Dict[Tuple[int, str], List[int]] = {}
+
+        for path in paths:
+            with IPNDFile(path) as f:
+                self.paths[f.seq] = path
+
+    def _get_file(self, seq: int) -> Optional[IPNDFile]:
+        if seq not in self._files:
+            if seq not in self.paths:
+                return None
+
+            f = self._files[seq] = IPNDFile(self.paths[seq])
+
+            for n, key in f.keys():
+                number = key.decode("latin-1").rstrip()
+                self._index.setdefault((seq, number), []).append(n)
+
+        return self._files[seq]
+
+    def match(self, error: ResponseError) -> Rejection:
+        f = self._get_file(error.seq)
+
+        if f is None:
+            return Rejection(error=error, row_number=None, row=None)
+
+        if error.public_number:
+            candidates = self._index.get((error.seq, error.public_number), [])
+        elif 0 < error.row <= len(f):
+            candidates = [error.row - 1]
+        else:
+            candidates = []
+
+        if not candidates:
+            return Rejection(error=error, row_number=None, row=None)
+
+        # A number can appear more than once, prefer the row the error names
+        n = error.row - 1 if error.row - 1 in candidates else candidates[0]
+
+        return Rejection(error=error, row_number=n + 1, row=f.row(n))
+
+    def reconcile(self, response: Response) -> List[Rejection]:
+        return [self.match(error) for error in response.errors]
+
+    def resubmit(
+        self,
+        rejections: Iterable[Rejection],
+        correct: Callable[[str, ResponseError], Optional[str]],
+        writer,
+    ) -> List[Rejection]:
+        """
+        Write corrected rows to `writer`, returning the rejections that could
+        not be matched or that `correct` declined (by returning None)
+        :param rejections:
+        :param correct: takes the submitted row and error, returns the new row
+        :param writer: a `Writer`
+        """
+        skipped = []
+
+        for rejection in rejections:
+            row = None
+            if rejection.row is not None:
+                row = correct(rejection.row, rejection.error)
+
+            if row is None:
+                skipped.append(rejection)
+            else:
+                writer.write_row(row)
+
+        return skipped
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+
+        self._files = {}
+        self._index = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,168 @@
+import queue
+import threading
+from typing import Callable, List, Optional, Tuple, Union
+from ipnd import record
+from .daemon import MicroBatcher
+from .engines import Engine
+from .writer import MAX_ROWS, SequenceAllocator, render
+
+URGENT = "urgent"
+BULK = "bulk"
+
+# Stops the bulk worker
+_STOP = object()
+
+
+def is_port(transaction: record.Transaction) -> bool:
+    """
+    The record layout has no porting flag, so treat transactions that carry a
+    PriorPublicNumber as ports
+    """
+    entry = transaction.get_entry(record.PriorPublicNumber)
+    return entry is not None and bool(entry.value)
+
+
+class Scheduler:
+    """
+    Route transactions into an urgent lane, flushed in small files as soon as
+    possible, and a bulk lane that batches into large files on a background
+    thread so a big refresh never holds up an urgent transaction. Both lanes
+    share a sequence allocator.
+
+    Transactions are rendered by `submit`, so an invalid one raises there
+    whichever lane it is for. A bulk lane flush that fails on the background
+    thread is kept in `errors` with the row that filled it, and passed to
+    `on_error`; the rows waiting in that flush are lost.
+
+    Has the same `submit`, `start` and `stop` as `MicroBatcher`, so it can be
+    given to a `Daemon`.
+    """
+
+    def __init__(
+        self,
+        urgent: MicroBatcher,
+        bulk: MicroBatcher,
+        classify: Callable[[record.Transaction], bool] = is_port,
+        maxsize: int = 10000,
+        on_error: Callable[[str, Exception], None] = None,
+    ):
+        """
+        :param urgent:
+        :param bulk:
+        :param classify: whether a transaction is urgent
+        :param maxsize: rows queued for the bulk lane
+        :param on_error: called with the row and error when a bulk row fails
+        """
+        self.lanes = {URGENT: urgent, BULK: bulk}
+        self.classify = classify
+        self.on_error = on_error
+        self.errors: List[Tuple[str, Exception]] = []
+
+        self._queue: queue.Queue = queue.Queue(maxsize)
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def create(
+        cls,
+        source: str,
+        allocator: SequenceAllocator,
+        directory: str = ".",
+        urgent_age: float = 1.0,
+        urgent_rows: int = 1000,
+        bulk_age: float = 300.0,
+        bulk_rows: int = MAX_ROWS,
+        max_bytes: int = None,
+        on_flush: Callable[[str], None] = None,
+        engine: Union[str, Engine] = None,
+        **kwargs
+    ):
+        urgent = MicroBatcher(
+            source,
+            allocator,
+            directory=directory,
+            max_rows=urgent_rows,
+            max_bytes=max_bytes,
+            max_age=urgent_age,
+            urgent_age=urgent_age,
+            on_flush=on_flush,
+            engine=engine,
+        )
+        bulk = MicroBatcher(
+            source,
+            allocator,
+            directory=directory,
+            max_rows=bulk_rows,
+            max_bytes=max_bytes,
+            max_age=bulk_age,
+            on_flush=on_flush,
+            engine=engine,
+        )
+
+        return cls(urgent, bulk, **kwargs)
+
+    @property
+    def files(self) -> List[str]:
+        return sorted(
+            self.lanes[URGENT].files + self.lanes[BULK].files,
+            key=lambda path: path.rsplit(".", 1)[-1],
+        )
+
+    def submit(self, transaction: record.Transaction, urgent: bool = None):
+        """
+        Queue a transaction, classifying it unless `urgent` is given
+        :param transaction:
+        :param urgent:
+        """
+        if urgent is None:
+            urgent = self.classify(transaction)
+
+        if urgent:
+            self.lanes[URGENT].submit(transaction, urgent=True)
+            return
+
+        bulk = self.lanes[BULK]
+        row = render(bulk.registry.transaction(transaction), bulk.engine)
+
+        if self._thread is None:
+            bulk.submit_row(row)
+        else:
+            self._queue.put(row)
+
+    def _run_bulk(self):
+        bulk = self.lanes[BULK]
+
+        while True:
+            row = self._queue.get()
+
+            if row is _STOP:
+                return
+
+            try:
+                bulk.submit_row(row)
+            except Exception as e:
+                self.errors.append((row, e))
+                if self.on_error is not None:
+                    self.on_error(row, e)
+
+    def start(self, interval: float = 0.1):
+        for lane in self.lanes.values():
+            lane.start(interval)
+
+        self._thread = threading.Thread(target=self._run_bulk, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+        for lane in self.lanes.values():
+            lane.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
@@ -0,0 +1,178 @@
+import heapq
+import os
+import time
+import zlib
+from bisect import bisect_right
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Union
+from .batch import Stats, render_item
+from .engines import Engine
+from .layout import ROW_SIZE
+from .writer import ENCODING, RowWriter, SortedWriter
+
+Partition = Callable[[str], int]
+
+
+def shard_of(number: str, shards: int) -> int:
+    """
+    The shard a number belongs to. crc32 gives every host the same answer,
+    unlike `hash()` which is salted per process.
+    :param number:
+    :param shards:
+    """
+    return zlib.crc32(number.strip().encode(ENCODING, "replace")) % shards
+
+
+def range_partition(boundaries: List[str]) -> Partition:
+    """
+    Partition numbers into ranges instead, shard n holding numbers from
+    `boundaries[n - 1]` up to but not including `boundaries[n]`
+    :param boundaries: sorted first numbers of shards 1 and up
+    """
+    return lambda number: bisect_right(boundaries, number.strip())
+
+
+class SegmentWriter:
+    """
+    Write rows back to back with no header or footer, as a segment to be
+    merged into IPND files later
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._fp = open(path, "w", encoding=ENCODING, errors="replace", newline="")
+
+    def write_row(self, row: str):
+        self._fp.write(row)
+        self.count += 1
+
+    def close(self):
+        self._fp.close()
+
+    def abort(self):
+        """
+        Close and remove an unfinished segment
+        """
+        self._fp.close()
+        os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def check_segment(path: str):
+    """
+    Raise ValueError unless a segment holds a whole number of rows. Segments
+    are copied between hosts, so a truncated one must not be merged.
+    :param path:
+    """
+    size = os.path.getsize(path)
+
+    if size % ROW_SIZE:
+        raise ValueError(
+            "Segment {} is truncated: {} bytes is not a whole number of "
+            "{} byte rows".format(path, size, ROW_SIZE)
+        )
+
+
+def read_segment(path: str) -> Iterator[str]:
+    check_segment(path)
+
+    with open(path, "rb") as fp:
+        for row in SortedWriter._read_run(fp):
+            if len(row) != ROW_SIZE:
+                raise ValueError("Segment {} ends in a short row".format(path))
+            yield row
+
+
+def generate_shard(
+    items: Iterable[Dict[str, str]],
+    shard: int,
+    shards: int,
+    path: str,
+    csp: str,
+    dp: str,
+    date: datetime = None,
+    partition: Partition = None,
+    memory: int = 64 * 1024 * 1024,
+    engine: Union[str, Engine] = None,
+) -> Stats:
+    """
+    Render this host's share of the inventory to a segment sorted by
+    PublicNumber. Every host reads the whole inventory and keeps the items
+    whose number falls in its shard. Pass every host the same `date` so the
+    merged output doesn't depend on which host rendered a row.
+    :param items:
+    :param shard: this host's shard, from 0
+    :param shards: number of hosts
+    :param path: segment to write
+    :param csp: default CSPCode
+    :param dp: default DPCode
+    :param date: transaction date
+    :param partition: maps a number to its shard, hashed by default
+    :param memory: bytes of rows to sort in memory before spilling to disk
+    :param engine: rendering engine or its name, see `ipnd.engines`
+    """
+    if shard < 0 or shard >= shards:
+        raise ValueError("shard must be between 0 and {}".format(shards - 1))
+
+    start = time.monotonic()
+    date = date if date else datetime.now()
+    partition = partition if partition else lambda n: shard_of(n, shards)
+
+    rows, rejected = 0, []
+
+    with SortedWriter(SegmentWriter(path), memory=memory) as writer:
+        for n, item in enumerate(items):
+            if partition(item.get("number") or "") != shard:
+                continue
+
+            row, error = render_item(item, csp, dp, date, engine=engine)
+
+            if row is None:
+                rejected.append((n, str(error)))
+            else:
+                writer.write_row(row)
+                rows += 1
+
+    return Stats(
+        rows=rows, rejected=rejected, files=[path], seconds=time.monotonic() - start
+    )
+
+
+def merge_segments(paths: Iterable[str], writer: RowWriter) -> int:
+    """
+    Stream sorted segments into `writer`, which adds headers and footers,
+    allocates sequence numbers and rolls over files. Returns the rows written.
+    If a segment is truncated or the merge fails, the writer is aborted
+    rather than closed so the output is never finished.
+    :param paths:
+    :param writer:
+    """
+    rows = 0
+
+    try:
+        paths = list(paths)
+        for path in paths:
+            check_segment(path)
+
+        segments = [read_segment(p) for p in paths]
+
+        # Segments are sorted on PublicNumber, the first 20 characters
+        for row in heapq.merge(*segments, key=lambda row: row[0:20]):
+            writer.write_row(row)
+            rows += 1
+    except BaseException:
+        writer.abort()
+        raise
+
+    writer.close()
+
+    return rows
@@ -0,0 +1,119 @@
+from multiprocessing import Pool
+from typing import Dict, Iterable, List, NamedTuple
+from .layout import ROW_SIZE, get_field
+from .reader import IPNDFile
+from .writer import MAX_ROWS
+
+NUMERIC_FIELDS = [
+    get_field(name)
+    for name in (
+        "TransactionDate",
+        "ServiceStatusDate",
+        "ServiceAddress.Postcode",
+        "DirectoryAddress.Postcode",
+    )
+]
+
+STATUS = get_field("ServiceStatusCode")
+
+
+class VerificationError(NamedTuple):
+    path: str
+    record: int
+    message: str
+
+
+def verify(path: str, max_errors: int = 100) -> List[VerificationError]:
+    """
+    Check an IPND file is well formed, returning (up to `max_errors`) problems
+    found. `record` is 0 for the header and counts rows from 1.
+    :param path:
+    :param max_errors:
+    """
+    errors: List[VerificationError] = []
+
+    def error(n, message, *args):
+        errors.append(VerificationError(path, n, message.format(*args)))
+        return len(errors) >= max_errors
+
+    try:
+        f = IPNDFile(path)
+    except ValueError as e:
+        error(0, str(e))
+        return errors
+
+    with f:
+        mm, stride = f.mm, f.stride
+        last = f.records - 1
+        terminator = mm[ROW_SIZE:stride]
+
+        if len(mm) not in (f.records * stride, f.records * stride - len(terminator)):
+            error(last, "File size {} is not a whole number of records", len(mm))
+
+        header = mm[0:ROW_SIZE]
+        if header[0:9] != b"HDRIPNDUP":
+            error(0, "Header does not start with HDRIPNDUP")
+        if not header[14:35].isdigit():
+            error(0, "Header sequence and date must be numeric")
+
+        footer = mm[last * stride : last * stride + ROW_SIZE]
+        if footer[0:3] != b"TRL":
+            error(last, "Footer does not start with TRL")
+        if footer[3:10] != header[14:21]:
+            error(last, "Footer sequence does not match header")
+        if not footer[10:31].isdigit():
+            error(last, "Footer date and count must be numeric")
+        elif int(footer[24:31]) != len(f):
+            error(
+                last, "Footer count {} but file has {} rows", int(footer[24:31]), len(f)
+            )
+
+        if not 0 < len(f) <= MAX_ROWS:
+            error(last, "File has {} rows", len(f))
+
+        for n in range(1, last + 1):
+            offset = n * stride
+
+            if terminator and mm[offset - len(terminator) : offset] != terminator:
+                if error(n, "Inconsistent record terminator"):
+                    break
+
+            if n == last:
+                break
+
+            row = mm[offset : offset + ROW_SIZE]
+
+            if row[0:3] in (b"HDR", b"TRL"):
+                if error(n, "Unexpected header or footer"):
+                    break
+
+            if row[STATUS.offset : STATUS.offset + 1] not in (b"C", b"D"):
+                if error(n, "ServiceStatusCode must be C or D"):
+                    break
+
+            for field in NUMERIC_FIELDS:
+                if not row[field.offset : field.offset + field.size].isdigit():
+                    if error(n, "{} must be numeric", field.name):
+                        break
+
+            if len(errors) >= max_errors:
+                break
+
+    return errors
+
+
+def verify_many(
+    paths: Iterable[str], processes: int = None
+) -> Dict[str, List[VerificationError]]:
+    """
+    Verify many files, in parallel when `processes` is more than 1
+    :param paths:
+    :param processes: worker processes, None for one per CPU
+    """
+    paths = list(paths)
+
+    if processes == 1 or len(paths) < 2:
+        return {path: verify(path) for path in paths}
+
+    with Pool(processes) as pool:
+        return dict(zip(paths, pool.map(verify, paths)))
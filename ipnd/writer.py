@@ -0,0 +1,339 @@
+import heapq
+import os
+import sys
+import tempfile
+import threading
+from datetime import datetime
+from typing import IO, Dict, Iterator, List, Optional, Union
+from ipnd import record
+from .engines import Engine, get_engine
+from .layout import ENCODING, ROW_SIZE
+
+if sys.version_info >= (3, 8):
+    from typing import Protocol
+else:
+    Protocol = object
+
+# Footer refuses to describe more rows than this
+MAX_ROWS = 100000
+
+STATE_DATE = "%Y%m%d%H%M%S%f"
+
+
+class RowWriter(Protocol):
+    """
+    Anything rendered rows can be written to, such as a `Writer`, a
+    `SortedWriter` or a `shard.SegmentWriter`. `close` finishes the output;
+    `abort` stops after a failure without finishing it.
+    """
+
+    def write_row(self, row: str): ...
+
+    def close(self): ...
+
+    def abort(self): ...
+
+
+class FileWriter(RowWriter, Protocol):
+    """
+    A `RowWriter` that writes dated IPND files and can checkpoint its
+    progress, such as a `Writer` or a `fanout.FanOutWriter`
+    """
+
+    date: datetime
+
+    @property
+    def files(self) -> List[str]: ...
+
+    def get_state(self) -> Dict: ...
+
+    def restore(self, state: Dict): ...
+
+
+def render(transaction: record.Transaction, engine: Union[str, Engine] = None) -> str:
+    """
+    Render a transaction to its fixed width row
+    :param transaction:
+    :param engine: rendering engine or its name, see `ipnd.engines`
+    """
+    return get_engine(engine)(transaction)
+
+
+class SequenceAllocator:
+    """
+    Hand out file sequence numbers to any number of writers. When `path` is
+    given the next number is saved there, so a restart carries on from it.
+    """
+
+    def __init__(self, seq: int = 1, path: str = None):
+        self.path = path
+        self.seq = seq
+        self._lock = threading.Lock()
+
+        if path is not None and os.path.exists(path):
+            with open(path) as fp:
+                self.seq = int(fp.read().strip())
+
+    def next(self) -> int:
+        with self._lock:
+            seq = self.seq
+            self.seq += 1
+
+            if self.path is not None:
+                tmp = self.path + ".tmp"
+                with open(tmp, "w") as fp:
+                    fp.write(str(self.seq))
+                os.replace(tmp, self.path)
+
+        return seq
+
+
+class Writer:
+    """
+    Stream rows into sequence numbered IPND files, rolling over to a new file
+    (and sequence number) every `max_rows` rows. `seq` is either the first
+    sequence number or a `SequenceAllocator` shared with other writers.
+    """
+
+    def __init__(
+        self,
+        source: str,
+        seq: Union[int, SequenceAllocator],
+        directory: str = ".",
+        date: datetime = None,
+        max_rows: int = MAX_ROWS,
+        history=None,
+        engine: Union[str, Engine] = None,
+    ):
+        if max_rows < 1 or max_rows > MAX_ROWS:
+            raise ValueError("max_rows must be between 1 and {}".format(MAX_ROWS))
+
+        self.allocator: Optional[SequenceAllocator]
+
+        if isinstance(seq, SequenceAllocator):
+            self.allocator, self.seq = seq, seq.seq
+        else:
+            self.allocator, self.seq = None, seq
+
+        self.source = source
+        self.directory = directory
+        self.date = date if date else datetime.now()
+        self.max_rows = max_rows
+        self.history = history
+        self.engine = engine
+
+        self.files: List[str] = []
+        self.count = 0
+        self._fp: Optional[IO[str]] = None
+
+    def get_file_name(self, seq: int) -> str:
+        return "IPNDUP{}.{:07d}".format(self.source, seq)
+
+    def add_transaction(self, transaction: record.Transaction):
+        self.write_row(render(transaction, self.engine))
+
+    def write_row(self, row: str):
+        fp = self._fp if self._fp is not None else self._open()
+
+        fp.write(row)
+        self.count += 1
+
+        if self.history is not None:
+            self.history.append(row, source=self.source, seq=self.seq, date=self.date)
+
+        if self.count >= self.max_rows:
+            self._close_file()
+
+    def close(self):
+        if self._fp is not None:
+            self._close_file()
+
+        if self.history is not None:
+            self.history.flush()
+
+    def abort(self):
+        """
+        Close the open file without its footer, so a run that failed part way
+        can't leave a file that passes `verify` and gets uploaded. The
+        unfinished file is kept for `restore` to carry on from.
+        """
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+        if self.history is not None:
+            self.history.flush()
+
+    def get_state(self) -> Dict:
+        """
+        Flush the open file to disk and describe how far the writer has got,
+        for `restore` to carry on from
+        """
+        size = None
+
+        if self._fp is not None:
+            self._fp.flush()
+            os.fsync(self._fp.fileno())
+            size = self._fp.tell()
+
+        return {
+            "source": self.source,
+            "seq": self.seq,
+            "date": self.date.strftime(STATE_DATE),
+            "max_rows": self.max_rows,
+            "files": list(self.files),
+            "count": self.count,
+            "size": size,
+        }
+
+    def restore(self, state: Dict):
+        """
+        Carry on from a `get_state`, discarding anything written to the open
+        file since then
+        :param state:
+        """
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+        self.source = state["source"]
+        self.seq = state["seq"]
+        self.date = datetime.strptime(state["date"], STATE_DATE)
+        self.max_rows = state["max_rows"]
+        self.files = list(state["files"])
+        self.count = state["count"]
+
+        if state["size"] is not None:
+            path = self.files[-1]
+
+            with open(path, "r+b") as fp:
+                fp.truncate(state["size"])
+
+            self._fp = open(path, "a", encoding=ENCODING, errors="replace", newline="")
+
+    def _open(self) -> IO[str]:
+        if self.allocator is not None:
+            self.seq = self.allocator.next()
+
+        path = os.path.join(self.directory, self.get_file_name(self.seq))
+
+        self._fp = open(path, "w", encoding=ENCODING, errors="replace", newline="")
+        header = record.Header(source=self.source, seq=self.seq, date=self.date)
+        self._fp.write("".join(header.generate()))
+
+        self.files.append(path)
+        self.count = 0
+
+        return self._fp
+
+    def _close_file(self):
+        footer = record.Footer(
+            source=self.source, seq=self.seq, count=self.count, date=self.date
+        )
+        self._fp.write("".join(footer.generate()))
+        self._fp.close()
+        self._fp = None
+
+        if self.allocator is None:
+            self.seq += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def _sort_key(row: str) -> str:
+    # PublicNumber is the first field of every row
+    return row[0:20]
+
+
+class SortedWriter:
+    """
+    Accept transactions in any order and write them to `writer` sorted by
+    PublicNumber. Rendered rows are held until they use `memory` bytes, then
+    sorted and spilled to a temporary run file; `close()` merges the runs into
+    `writer`. Rows for the same number keep the order they were added in.
+    """
+
+    def __init__(
+        self, writer: RowWriter, memory: int = 64 * 1024 * 1024, directory=None
+    ):
+        self.writer = writer
+        self.memory = memory
+        self.directory = directory
+
+        self._rows: List[str] = []
+        self._runs: List[IO[bytes]] = []
+
+    def add_transaction(self, transaction: record.Transaction):
+        self.write_row(render(transaction))
+
+    def write_row(self, row: str):
+        self._rows.append(row)
+
+        if len(self._rows) * ROW_SIZE >= self.memory:
+            self._spill()
+
+    def _spill(self):
+        self._rows.sort(key=_sort_key)
+
+        run = tempfile.TemporaryFile(dir=self.directory)
+        run.write("".join(self._rows).encode(ENCODING, "replace"))
+        run.seek(0)
+
+        self._runs.append(run)
+        self._rows = []
+
+    @staticmethod
+    def _read_run(run: IO[bytes]) -> Iterator[str]:
+        while True:
+            row = run.read(ROW_SIZE)
+            if not row:
+                return
+            yield row.decode(ENCODING)
+
+    def close(self):
+        if self._runs:
+            if self._rows:
+                self._spill()
+            rows = heapq.merge(*[self._read_run(r) for r in self._runs], key=_sort_key)
+        else:
+            rows = iter(sorted(self._rows, key=_sort_key))
+
+        try:
+            for row in rows:
+                self.writer.write_row(row)
+        except BaseException:
+            self.writer.abort()
+            raise
+        finally:
+            for run in self._runs:
+                run.close()
+
+            self._rows, self._runs = [], []
+
+        self.writer.close()
+
+    def abort(self):
+        """
+        Discard the rows held and abort `writer`
+        """
+        for run in self._runs:
+            run.close()
+
+        self._rows, self._runs = [], []
+        self.writer.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
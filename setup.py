@@ -25,4 +25,5 @@ setup(
     ],
     packages=["ipnd"],
     install_requires=[],
+    entry_points={"console_scripts": ["ipnd = ipnd.cli:main"]},
 )
@@ -1,10 +1,49 @@
+import contextlib
+import gzip
+import io
 import json
+import multiprocessing
+import os
+import pickle
 import pprint
+import socket
+import tempfile
+import threading
+import time
 from datetime import datetime
 from unittest import TestCase
 from ipnd.ipnd import IPND
 from ipnd import record
+from ipnd import layout
+from ipnd import export
+from ipnd import engines
+from ipnd import response as response_module
 from ipnd.utils import flatten
+from ipnd.writer import SequenceAllocator, SortedWriter, Writer, render
+from ipnd.history import HistoryStore
+from ipnd.coalesce import Coalescer, cancel_connect
+from ipnd.flyweight import Registry
+from ipnd.verify import verify, verify_many
+from ipnd.gazetteer import Gazetteer, compile_gazetteer
+from ipnd.inventory import build_transaction, read_inventory
+from ipnd.batch import generate
+from ipnd.checkpoint import Checkpoint
+from ipnd.pipeline import Pipeline, Stage, run_inventory
+from ipnd.daemon import Daemon, MicroBatcher
+from ipnd.scheduler import BULK, URGENT, Scheduler
+from ipnd.diff import diff_files
+from ipnd.archive import ArchiveReader, archive_file
+from ipnd.blocks import BlockFile
+from ipnd import cli
+from ipnd.reader import IPNDFile
+from ipnd.packed import PackedBatch
+from ipnd.parallel import render_to_file
+from ipnd.columns import count_files, group_count, project
+from ipnd.holdings import Holdings, normalise_number
+from ipnd.address import parse_address
+from ipnd.shard import generate_shard, merge_segments, range_partition, shard_of
+from ipnd.fanout import FanOutWriter
+from ipnd.memory import MemoryProfiler
 
 
 class BaseTests(TestCase):
@@ -403,6 +442,56 @@ class IpndBaseTests(BaseTests):
         # 2020-01-01 00:00
         return datetime.utcfromtimestamp(1577836800)
 
+    def get_person(self):
+        person = record.Person()
+        person.set_name("Herp L. Derpinson", "Mr")
+        person.set_contactnum("0402000000")
+
+        return person
+
+    def get_business(self):
+        business = record.Business()
+        business.set_name(
+            "Extremely Long Name Pty Ltd, Trading as Stupidly Long Name Incorporated"
+        )
+        business.set_contactnum("0402000000")
+
+        return business
+
+    def get_address(self):
+        address = record.HouseAddress()
+        address.set_street_number("1")
+        address.set_street_name("FAKE", "ST")
+        address.set_locality("0200", "ANU", "ACT")
+
+        return address
+
+    def get_transaction(self, num, entity=None, status="C"):
+        entity = entity if entity else self.get_person()
+        address = self.get_address()
+
+        t = record.Transaction()
+
+        t.add_entry(record.CSPCode("999"))
+        t.add_entry(record.DPCode("YYYYYY"))
+
+        t.add_entry(record.PublicNumber(num))
+        t.add_entry(record.UsageCode(entity.get_code()))
+        t.add_entry(record.ServiceStatusCode(status))
+        t.add_entry(record.PendingFlag("N"))
+        t.add_entry(record.CancelPendingFlag("N"))
+        t.add_entry(record.CustomerName(entity))
+        t.add_entry(record.FindingName(entity))
+        t.add_entry(record.ServiceAddress(address))
+        t.add_entry(record.DirectoryAddress(address))
+
+        t.add_entry(record.ListCode("UL"))
+        t.add_entry(record.CustomerContact(entity))
+        t.add_entry(record.TransactionDate(self.get_date()))
+        t.add_entry(record.ServiceStatusDate(self.get_date()))
+
+        return t
+
 
 class IpndHeaderFooterTests(IpndBaseTests):
     """
@@ -480,30 +569,6 @@ class IpndTransactionTests(IpndBaseTests):
 
     maxDiff = None
 
-    def get_person(self):
-        person = record.Person()
-        person.set_name("Herp L. Derpinson", "Mr")
-        person.set_contactnum("0402000000")
-
-        return person
-
-    def get_business(self):
-        business = record.Business()
-        business.set_name(
-            "Extremely Long Name Pty Ltd, Trading as Stupidly Long Name Incorporated"
-        )
-        business.set_contactnum("0402000000")
-
-        return business
-
-    def get_address(self):
-        address = record.HouseAddress()
-        address.set_street_number("1")
-        address.set_street_name("FAKE", "ST")
-        address.set_locality("0200", "ANU", "ACT")
-
-        return address
-
     def test_person_transaction(self):
         person = self.get_person()
 
@@ -729,3 +794,1791 @@ class IpndTransactionTests(IpndBaseTests):
         output = i.generate_to_string()
 
         self.assertEqual(len(output), 905 * 4)
+
+
+class IpndFileTests(IpndBaseTests):
+    """
+    Base for tests writing IPND files
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read(self, path):
+        with open(path, encoding="latin-1", newline="") as fp:
+            return fp.read()
+
+    def write_inventory(self, count=5):
+        path = os.path.join(self.directory, "inventory.jsonl")
+
+        with open(path, "w") as fp:
+            for n in range(count):
+                item = {
+                    "number": "07497{:05d}".format(n),
+                    "name": "Herp L. Derpinson",
+                    "title": "Mr",
+                    "contact": "0402000000",
+                    "street_number": "1",
+                    "street_name": "FAKE",
+                    "street_type": "ST",
+                    "postcode": "0200",
+                    "locality": "ANU",
+                    "state": "ACT",
+                }
+                fp.write(json.dumps(item) + "\n")
+
+            fp.write(json.dumps({"number": "0749799999", "entity": "alien"}) + "\n")
+
+        return path
+
+
+class IpndWriterTests(IpndFileTests):
+    """
+    IPND Writer Tests
+    """
+
+    def test_matches_ipnd(self):
+        i = IPND(source="XXXXX", seq=2, date=self.get_date())
+
+        with Writer(
+            source="XXXXX", seq=2, directory=self.directory, date=self.get_date()
+        ) as writer:
+            for num in ("0749700000", "0749700001"):
+                i.add_transaction(self.get_transaction(num))
+                writer.add_transaction(self.get_transaction(num))
+
+        self.assertEqual(
+            writer.files, [os.path.join(self.directory, "IPNDUPXXXXX.0000002")]
+        )
+        self.assertEqual(self.read(writer.files[0]), i.generate_to_string())
+
+    def test_rollover(self):
+        with Writer(
+            source="XXXXX", seq=5, directory=self.directory, max_rows=2
+        ) as writer:
+            for num in range(5):
+                writer.add_transaction(self.get_transaction("07497{:05d}".format(num)))
+
+        self.assertEqual(len(writer.files), 3)
+        self.assertEqual(writer.seq, 8)
+
+        footer = self.read(writer.files[-1])[-905:].strip()
+        self.assertTrue(footer.startswith("TRL0000007"))
+        self.assertTrue(footer.endswith("0000001"))
+
+    def test_failed_run(self):
+        with self.assertRaises(RuntimeError):
+            with Writer(source="XXXXX", seq=1, directory=self.directory) as writer:
+                writer.add_transaction(self.get_transaction("0749700000"))
+                raise RuntimeError("crashed")
+
+        # Left without a footer, so it can't pass for a complete file
+        self.assertEqual(len(self.read(writer.files[0])), 2 * 905)
+        self.assertNotEqual(verify(writer.files[0]), [])
+
+    def test_sorted(self):
+        writer = Writer(source="XXXXX", seq=1, directory=self.directory, max_rows=4)
+        nums = ["07497{:05d}".format(n) for n in (7, 3, 9, 1, 5, 3, 0, 8, 2)]
+
+        # Three rows per run
+        with SortedWriter(writer, memory=905 * 3, directory=self.directory) as s:
+            for num in nums:
+                s.add_transaction(self.get_transaction(num))
+
+        self.assertEqual(len(writer.files), 3)
+
+        rows = []
+        for path in writer.files:
+            with IPNDFile(path) as f:
+                rows += [row[0:20].strip() for row in f.rows()]
+
+        self.assertEqual(rows, sorted(nums))
+
+
+class IpndHistoryTests(IpndFileTests):
+    """
+    IPND History Store Tests
+    """
+
+    def test_lookup(self):
+        path = os.path.join(self.directory, "history")
+
+        with HistoryStore(path, block_size=3) as history:
+            for seq in (1, 2):
+                with Writer(
+                    source="XXXXX",
+                    seq=seq,
+                    directory=self.directory,
+                    date=self.get_date(),
+                    history=history,
+                ) as writer:
+                    for num in range(4):
+                        t = self.get_transaction("07497{:05d}".format(num))
+                        writer.add_transaction(t)
+
+            history.compact()
+            history.append(render(t), source="XXXXX", seq=3)
+
+            entries = history.lookup("0749700003")
+
+            self.assertEqual([e.seq for e in entries], [1, 2, 3])
+            self.assertEqual(entries[0].source, "XXXXX")
+            self.assertEqual(entries[0].date, self.get_date())
+            self.assertEqual(entries[0].row, render(t))
+
+        history = HistoryStore(path)
+
+        entries = history.scan("0749700001", "0749700002")
+
+        self.assertEqual(
+            [(e.public_number, e.seq) for e in entries],
+            [
+                ("0749700001", 1),
+                ("0749700001", 2),
+                ("0749700002", 1),
+                ("0749700002", 2),
+            ],
+        )
+        self.assertEqual(len(history.lookup("0749700003")), 3)
+        self.assertEqual(history.lookup("0749799999"), [])
+
+    def test_compacts_automatically(self):
+        path = os.path.join(self.directory, "history")
+
+        with HistoryStore(path, block_size=2, compact_after=5) as history:
+            for num in (4, 1, 3, 0, 2, 1, 4):
+                row = render(self.get_transaction("07497{:05d}".format(num)))
+                history.append(row, source="XXXXX", seq=num)
+
+            self.assertEqual(len(history._log), 0)
+            self.assertEqual(len(history._manifest["segments"]), 1)
+
+            self.assertEqual([e.seq for e in history.lookup("0749700001")], [1, 1])
+            self.assertEqual(
+                [e.public_number for e in history.scan("0749700002", "0749700004")],
+                ["0749700002", "0749700003", "0749700004", "0749700004"],
+            )
+
+    def test_merges_segments(self):
+        path = os.path.join(self.directory, "history")
+        rows = [render(self.get_transaction("07497{:05d}".format(n))) for n in range(8)]
+
+        with HistoryStore(
+            path, block_size=1, compact_after=2, merge_factor=2
+        ) as history:
+            for n in range(40):
+                history.append(rows[n % 8], source="XXXXX", seq=n)
+
+            # Segments double in size, so each row has been rewritten a few
+            # times at most rather than on every segment
+            sizes = [
+                os.path.getsize(os.path.join(path, s)) // 30
+                for s in history._manifest["segments"]
+            ]
+            self.assertEqual(sorted(sizes, reverse=True), [32, 8])
+
+            names = set(history._manifest["segments"]) | {history._manifest["log"]}
+            self.assertEqual(set(os.listdir(path)), names | {"blocks", "manifest"})
+
+        history = HistoryStore(path)
+        self.assertEqual(
+            [e.seq for e in history.lookup("0749700003")], [3, 11, 19, 27, 35]
+        )
+
+        history.compact()
+        self.assertEqual(len(history._manifest["segments"]), 1)
+        self.assertEqual(len(history.scan("0749700000", "0749700007")), 40)
+        history.close()
+
+
+class IpndLayoutTests(IpndBaseTests):
+    """
+    IPND Row Layout Tests
+    """
+
+    def test_layout(self):
+        self.assertEqual(layout.ROW_SIZE, 905)
+        self.assertEqual(layout.get_field("CSPCode"), ("CSPCode", "X", 847, 3))
+        self.assertEqual(
+            layout.get_field("ServiceAddress.Postcode"),
+            ("ServiceAddress.Postcode", "N", 509, 4),
+        )
+
+    def test_parse_and_set_field(self):
+        row = render(self.get_transaction("0749700000"))
+
+        fields = layout.parse_row(row)
+
+        self.assertEqual(fields["PublicNumber"], "0749700000")
+        self.assertEqual(fields["TransactionDate"], "20200101000000")
+
+        row = layout.set_field(row, "ServiceAddress.Postcode", 200)
+
+        self.assertEqual(len(row), 905)
+        self.assertEqual(
+            layout.parse_row(row, layout.LEAF_FIELDS)["ServiceAddress.Postcode"],
+            "0200",
+        )
+
+
+class IpndResponseTests(IpndFileTests):
+    """
+    IPND Response Reconciliation Tests
+    """
+
+    def get_response(self):
+        return [
+            "HDRIPNDERXXXXX000000220200102000000\n",
+            "ERR0000002{:20}1234Invalid locality\n".format("0749700001"),
+            "ERR0000003{:20}1234Unknown\n".format("0749799999"),
+            "TRL0000002\n",
+        ]
+
+    def test_parse(self):
+        response = response_module.parse_response(self.get_response())
+
+        self.assertTrue(response.is_error())
+        self.assertEqual(response.seq, 2)
+        self.assertEqual(
+            response.errors[0],
+            (2, 2, "0749700001", "1234", "Invalid locality"),
+        )
+
+        with self.assertRaises(record.ValidationError):
+            response_module.parse_response(self.get_response()[0:3])
+
+    def test_reconcile(self):
+        with Writer(source="XXXXX", seq=2, directory=self.directory) as writer:
+            for num in range(3):
+                writer.add_transaction(self.get_transaction("07497{:05d}".format(num)))
+
+        response = response_module.parse_response(self.get_response())
+
+        with response_module.Reconciler(writer.files) as reconciler:
+            rejections = reconciler.reconcile(response)
+
+            self.assertEqual(rejections[0].row_number, 2)
+            self.assertEqual(
+                layout.parse_row(rejections[0].row)["PublicNumber"], "0749700001"
+            )
+            self.assertIsNone(rejections[1].row)
+
+            def correct(row, error):
+                return layout.set_field(row, "ServiceAddress.Locality", "ACTON")
+
+            with Writer(source="XXXXX", seq=3, directory=self.directory) as resubmit:
+                skipped = reconciler.resubmit(rejections, correct, resubmit)
+
+        self.assertEqual(len(skipped), 1)
+
+        with IPNDFile(resubmit.files[0]) as f:
+            self.assertEqual(len(f), 1)
+            self.assertEqual(
+                layout.parse_row(f.row(0), layout.LEAF_FIELDS)[
+                    "ServiceAddress.Locality"
+                ],
+                "ACTON",
+            )
+
+
+class IpndCoalesceTests(IpndBaseTests):
+    """
+    IPND Coalescing Tests
+    """
+
+    def test_last_write_wins(self):
+        coalescer = Coalescer()
+
+        first = self.get_transaction("0749700000")
+        last = self.get_transaction("0749700000", entity=self.get_business())
+        other = self.get_transaction("0749700001")
+
+        for t in (first, other, last):
+            coalescer.add_transaction(t)
+
+        self.assertEqual(len(coalescer), 2)
+        self.assertEqual(coalescer.transactions(), [last, other])
+
+    def test_cancel_connect(self):
+        coalescer = Coalescer(merge=cancel_connect)
+
+        coalescer.add_transaction(self.get_transaction("0749700000", status="C"))
+        coalescer.add_transaction(self.get_transaction("0749700000", status="D"))
+
+        self.assertEqual(coalescer.transactions(), [])
+
+        disconnect = self.get_transaction("0749700001", status="D")
+        coalescer.add_transaction(disconnect)
+        coalescer.add_transaction(self.get_transaction("0749700001", status="C"))
+        coalescer.add_transaction(disconnect)
+
+        self.assertEqual(coalescer.transactions(), [])
+
+
+class IpndFlyweightTests(IpndBaseTests):
+    """
+    IPND Flyweight Registry Tests
+    """
+
+    def test_entities(self):
+        registry = Registry()
+
+        person = registry.entity(self.get_person())
+
+        self.assertIs(registry.entity(self.get_person()), person)
+        self.assertIsNot(registry.entity(self.get_business()), person)
+
+        with self.assertRaises(record.FrozenError):
+            person.set_contactnum("0402000001")
+
+    def test_addresses(self):
+        registry = Registry()
+
+        address = registry.address(self.get_address())
+
+        self.assertIs(registry.address(self.get_address()), address)
+
+        other = self.get_address()
+        other.set_street_number("2")
+        other = registry.address(other)
+
+        self.assertIsNot(other, address)
+        self.assertIs(other.service_locality, address.service_locality)
+
+        with self.assertRaises(record.FrozenError):
+            address.set_street_number("3")
+
+    def test_transaction(self):
+        registry = Registry()
+
+        first = self.get_transaction("0749700000")
+        second = self.get_transaction("0749700001")
+        expected = render(second)
+
+        registry.transaction(first)
+        registry.transaction(second)
+
+        self.assertIs(
+            first.get_entry(record.CustomerName).value,
+            second.get_entry(record.CustomerContact).entity,
+        )
+        self.assertIs(
+            first.get_entry(record.ServiceAddress).address,
+            second.get_entry(record.DirectoryAddress).address,
+        )
+        self.assertEqual(render(second), expected)
+
+
+class IpndVerifyTests(IpndFileTests):
+    """
+    IPND File Verification Tests
+    """
+
+    def write(self, rows=3):
+        with Writer(source="XXXXX", seq=2, directory=self.directory) as writer:
+            for num in range(rows):
+                writer.add_transaction(self.get_transaction("07497{:05d}".format(num)))
+
+        return writer.files[0]
+
+    def test_valid(self):
+        path = self.write()
+
+        self.assertEqual(verify(path), [])
+        self.assertEqual(verify_many([path, path], processes=2), {path: []})
+
+    def test_newline_terminated(self):
+        path = self.write()
+        content = self.read(path)
+
+        with open(path, "w", encoding="latin-1", newline="") as fp:
+            for n in range(0, len(content), 905):
+                fp.write(content[n : n + 905] + "\n")
+
+        self.assertEqual(verify(path), [])
+
+    def test_invalid(self):
+        path = self.write()
+        content = self.read(path)
+
+        # Corrupt the postcode of the second row and the footer count
+        postcode = 905 * 2 + layout.get_field("ServiceAddress.Postcode").offset
+        content = content[0:postcode] + "02X0" + content[postcode + 4 :]
+        content = content[:-881] + "0000004" + content[-874:]
+
+        with open(path, "w", encoding="latin-1", newline="") as fp:
+            fp.write(content)
+
+        errors = verify(path)
+
+        self.assertEqual(
+            [(e.record, e.message) for e in errors],
+            [
+                (4, "Footer count 4 but file has 3 rows"),
+                (2, "ServiceAddress.Postcode must be numeric"),
+            ],
+        )
+
+
+class IpndGazetteerTests(IpndFileTests):
+    """
+    IPND Gazetteer Tests
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        source = os.path.join(self.directory, "localities.csv")
+        with open(source, "w") as fp:
+            fp.write("Postcode,Locality,State\n")
+            fp.write("0200,ANU,ACT\n")
+            fp.write("2620,Queanbeyan,NSW\n")
+            fp.write("2620,Hume,ACT\n")
+            fp.write("2620,Hume,NSW\n")
+            fp.write("3000,Melbourne,VIC\n")
+
+        path = os.path.join(self.directory, "localities.idx")
+        compile_gazetteer(source, path)
+
+        self.gazetteer = Gazetteer(path)
+
+    def tearDown(self):
+        self.gazetteer.close()
+        super().tearDown()
+
+    def test_normalise(self):
+        self.assertEqual(self.gazetteer.normalise(200, " anu "), ("0200", "ANU", "ACT"))
+        self.assertEqual(
+            self.gazetteer.normalise("2620", "Hume", "nsw"), ("2620", "HUME", "NSW")
+        )
+        self.assertEqual(self.gazetteer.localities("2000"), [])
+
+        with self.assertRaises(record.ValidationError):
+            self.gazetteer.normalise("2620", "HUME")
+
+        with self.assertRaises(record.ValidationError):
+            self.gazetteer.normalise("3000", "ANU", "ACT")
+
+    def test_set_locality(self):
+        record.Address.gazetteer = self.gazetteer
+
+        try:
+            address = record.HouseAddress()
+            address.set_locality("200", "anu")
+
+            self.assertEqual(address.service_locality.state.value, "ACT")
+
+            with self.assertRaises(record.ValidationError):
+                address.set_locality("0200", "Melbourne", "VIC")
+        finally:
+            record.Address.gazetteer = None
+
+    def test_validate(self):
+        valid = self.get_transaction("0749700000")
+        invalid = self.get_transaction("0749700001")
+        invalid.get_entry(record.ServiceAddress).address.set_locality(
+            "3000", "ANU", "ACT"
+        )
+
+        errors = self.gazetteer.validate([valid, invalid])
+
+        self.assertEqual([n for n, _ in errors], [1])
+
+    def test_free_text_address(self):
+        def build(address):
+            return build_transaction(
+                {"number": "0749700000", "address": address},
+                csp="123",
+                dp="456",
+                gazetteer=self.gazetteer,
+            )
+
+        with self.assertRaises(record.ValidationError):
+            build("1 Fake St, Nowhere ACT 9999")
+
+        t = build("1 Fake St, anu 0200")
+        locality = t.get_entry(record.ServiceAddress).address.service_locality
+        self.assertEqual(locality.state.value, "ACT")
+        self.assertEqual(
+            t.get_entry(record.ServiceAddress).address.street_address.street_name.value,
+            "FAKE",
+        )
+
+        # The cached parse is left as it was
+        parsed = parse_address("1 Fake St, anu 0200")
+        self.assertTrue(parsed.frozen)
+        self.assertEqual(parsed.service_locality.state.value, "")
+
+    def test_pickle(self):
+        gazetteer = pickle.loads(pickle.dumps(self.gazetteer))
+
+        try:
+            self.assertEqual(gazetteer.localities("0200"), [("ANU", "ACT")])
+        finally:
+            gazetteer.close()
+
+    def test_generate(self):
+        items = list(read_inventory(self.write_inventory(count=3)))
+        items[1]["locality"] = "Melbourne"
+
+        writer = Writer(source="XXXXX", seq=1, directory=self.directory)
+        with writer:
+            stats = generate(
+                items,
+                writer,
+                csp="123",
+                dp="456",
+                processes=2,
+                gazetteer=self.gazetteer,
+            )
+
+        self.assertEqual([n for n, _ in stats.rejected], [1, 3])
+        self.assertEqual(stats.rows, 2)
+
+
+class IpndBatchTests(IpndFileTests):
+    """
+    IPND Batch Generation Tests
+    """
+
+    def test_generate(self):
+        items = list(read_inventory(self.write_inventory()))
+        writer = Writer(
+            source="XXXXX",
+            seq=2,
+            directory=self.directory,
+            date=self.get_date(),
+            max_rows=3,
+        )
+
+        stats = generate(items, writer, csp="999", dp="YYYYYY", processes=2)
+
+        self.assertEqual(stats.rows, 5)
+        self.assertEqual(stats.rejected, [(5, "Invalid entity: alien")])
+        self.assertEqual(len(stats.files), 2)
+
+        with IPNDFile(stats.files[0]) as f:
+            self.assertEqual(
+                f.row(0),
+                render(
+                    build_transaction(items[0], csp="999", dp="YYYYYY", date=f.date)
+                ),
+            )
+            self.assertEqual(
+                layout.parse_row(f.row(0))["CustomerName"],
+                layout.parse_row(render(self.get_transaction("0749700000")))[
+                    "CustomerName"
+                ],
+            )
+
+    def test_command(self):
+        inventory = self.write_inventory()
+        output = os.path.join(self.directory, "out")
+        os.mkdir(output)
+
+        status = cli.main(
+            [
+                "generate",
+                inventory,
+                "--source=XXXXX",
+                "--seq=2",
+                "--csp=999",
+                "--dp=YYYYYY",
+                "--directory={}".format(output),
+                "--date=20200101000000",
+            ]
+        )
+
+        # The invalid inventory item fails the run
+        self.assertEqual(status, 1)
+        self.assertEqual(os.listdir(output), ["IPNDUPXXXXX.0000002"])
+        self.assertEqual(verify(os.path.join(output, "IPNDUPXXXXX.0000002")), [])
+
+    def test_resume(self):
+        items = list(read_inventory(self.write_inventory(count=7)))[0:7]
+        checkpoint = Checkpoint(os.path.join(self.directory, "checkpoint.json"))
+
+        def crash(items, after):
+            for n, item in enumerate(items):
+                if n == after:
+                    raise RuntimeError("crash")
+                yield item
+
+        def get_writer(directory, date):
+            os.makedirs(directory, exist_ok=True)
+            return Writer(
+                source="XXXXX", seq=2, directory=directory, date=date, max_rows=3
+            )
+
+        expected = generate(
+            items,
+            get_writer(os.path.join(self.directory, "expected"), self.get_date()),
+            csp="999",
+            dp="YYYYYY",
+        )
+
+        output = os.path.join(self.directory, "output")
+
+        with self.assertRaises(RuntimeError):
+            generate(
+                crash(items, 5),
+                get_writer(output, self.get_date()),
+                csp="999",
+                dp="YYYYYY",
+                checkpoint=checkpoint,
+                every=2,
+            )
+
+        self.assertEqual(checkpoint.load()["offset"], 4)
+
+        # The restarted run picks up the original date from the checkpoint
+        stats = generate(
+            items,
+            get_writer(output, datetime.now()),
+            csp="999",
+            dp="YYYYYY",
+            checkpoint=checkpoint,
+            every=2,
+        )
+
+        self.assertIsNone(checkpoint.load())
+        self.assertEqual(stats.rows, 7)
+        self.assertEqual(len(stats.files), 3)
+
+        for expected_path, path in zip(expected.files, stats.files):
+            self.assertEqual(self.read(path), self.read(expected_path))
+
+
+class IpndPipelineTests(IpndFileTests):
+    """
+    IPND Staged Pipeline Tests
+    """
+
+    def test_order_and_metrics(self):
+        output = []
+
+        pipeline = Pipeline(
+            [
+                Stage("double", lambda n: n * 2, workers=3),
+                Stage("drop", lambda n: None if n % 3 == 0 else n, workers=2),
+            ],
+            sink=output.append,
+            maxsize=2,
+        )
+
+        metrics = pipeline.run(range(100))
+
+        self.assertEqual(output, [n * 2 for n in range(100) if n * 2 % 3])
+        self.assertEqual(
+            [(m.name, m.items) for m in metrics],
+            [("ingest", 100), ("double", 100), ("drop", 100), ("sink", len(output))],
+        )
+
+    def test_error(self):
+        def fail(n):
+            if n == 50:
+                raise ValueError("bad item")
+            return n
+
+        pipeline = Pipeline([Stage("fail", fail, workers=2)], sink=lambda n: None)
+
+        with self.assertRaises(ValueError):
+            pipeline.run(range(100))
+
+    def test_inventory(self):
+        items = list(read_inventory(self.write_inventory()))
+
+        expected = generate(
+            items,
+            Writer(
+                source="XXXXX", seq=2, directory=self.directory, date=self.get_date()
+            ),
+            csp="999",
+            dp="YYYYYY",
+        )
+
+        output = os.path.join(self.directory, "output")
+        os.mkdir(output)
+
+        stats, metrics = run_inventory(
+            items,
+            Writer(source="XXXXX", seq=2, directory=output, date=self.get_date()),
+            csp="999",
+            dp="YYYYYY",
+            render_workers=2,
+            processes=True,
+        )
+
+        self.assertEqual(stats.rows, 5)
+        self.assertEqual(stats.rejected, [(5, "Invalid entity: alien")])
+        self.assertEqual(self.read(stats.files[0]), self.read(expected.files[0]))
+        self.assertEqual([m.name for m in metrics][1:3], ["validate", "render"])
+
+
+class IpndDaemonTests(IpndFileTests):
+    """
+    IPND Micro-batching Daemon Tests
+    """
+
+    def get_batcher(self, **kwargs):
+        return MicroBatcher(
+            source="XXXXX",
+            allocator=SequenceAllocator(7, path=os.path.join(self.directory, "seq")),
+            directory=self.directory,
+            **kwargs
+        )
+
+    def test_thresholds(self):
+        batcher = self.get_batcher(max_rows=2, max_bytes=905 * 5, max_age=60)
+
+        for num in range(5):
+            batcher.submit(self.get_transaction("07497{:05d}".format(num)))
+
+        # Two full files, the last row waits for more
+        self.assertEqual(len(batcher.files), 2)
+        self.assertEqual(len(batcher), 1)
+
+        batcher.poll()
+        self.assertEqual(len(batcher), 1)
+
+        batcher.submit(self.get_transaction("0749700009"), urgent=True)
+        self.assertEqual(len(batcher.files), 3)
+
+        self.assertEqual(
+            [os.path.basename(p) for p in batcher.files],
+            ["IPNDUPXXXXX.0000007", "IPNDUPXXXXX.0000008", "IPNDUPXXXXX.0000009"],
+        )
+        self.assertEqual(
+            SequenceAllocator(path=os.path.join(self.directory, "seq")).seq, 10
+        )
+
+    def test_urgent(self):
+        batcher = self.get_batcher(max_age=60, urgent_age=0)
+
+        batcher.submit(self.get_transaction("0749700000"))
+        batcher.poll()
+        self.assertEqual(batcher.files, [])
+
+        batcher.submit(self.get_transaction("0749700001"), urgent=True)
+        batcher.poll()
+        self.assertEqual(len(batcher.files), 1)
+
+        with IPNDFile(batcher.files[0]) as f:
+            self.assertEqual(len(f), 2)
+
+    def test_socket(self):
+        batcher = self.get_batcher(max_age=60)
+        daemon = Daemon(
+            batcher, os.path.join(self.directory, "ipnd.sock"), csp="999", dp="YYYYYY"
+        )
+        thread = threading.Thread(target=daemon.serve_forever)
+        thread.start()
+
+        try:
+            with socket.socket(socket.AF_UNIX) as client:
+                client.connect(daemon.address)
+                stream = client.makefile("rwb")
+
+                stream.write(b'{"number": "0749700000", "name": "John Smith"}\n')
+                stream.write(b'{"number": "0749700001", "status": "X"}\n')
+                stream.flush()
+
+                self.assertEqual(stream.readline(), b"OK\n")
+                self.assertTrue(stream.readline().startswith(b"ERROR"))
+        finally:
+            daemon.shutdown()
+            thread.join()
+
+        self.assertEqual(len(batcher.files), 1)
+        self.assertEqual(verify(batcher.files[0]), [])
+
+    def test_spool(self):
+        spool = os.path.join(self.directory, "spool")
+
+        batcher = self.get_batcher(max_age=60, spool=spool)
+        batcher.submit(self.get_transaction("0749700000"))
+        batcher.submit(self.get_transaction("0749700001"))
+        rows = list(batcher._rows)
+
+        # Crash without a flush, part way through writing a third row
+        batcher._spool.close()
+        with open(spool, "ab") as fp:
+            fp.write(b"0749700002")
+
+        recovered = self.get_batcher(max_age=60, spool=spool)
+        self.assertEqual(recovered._rows, rows)
+
+        recovered.poll()
+        self.assertEqual(len(recovered.files), 1)
+        self.assertEqual(os.path.getsize(spool), 0)
+
+        with IPNDFile(recovered.files[0]) as f:
+            self.assertEqual(list(f.rows()), rows)
+
+        recovered.stop()
+
+    def test_registry_cleared(self):
+        batcher = self.get_batcher(max_age=60)
+        batcher.submit(self.get_transaction("0749700000"))
+        registry = batcher.registry
+
+        batcher.flush()
+        self.assertIsNot(batcher.registry, registry)
+
+
+class IpndSchedulerTests(IpndFileTests):
+    """
+    IPND Priority Lane Scheduler Tests
+    """
+
+    def test_lanes(self):
+        scheduler = Scheduler.create(
+            source="XXXXX",
+            allocator=SequenceAllocator(1),
+            directory=self.directory,
+            urgent_age=0,
+            bulk_age=60,
+        )
+
+        with scheduler:
+            for num in range(10):
+                scheduler.submit(self.get_transaction("07497{:05d}".format(num)))
+
+            port = self.get_transaction("0749799999")
+            port.add_entry(record.PriorPublicNumber("0749788888"))
+            scheduler.submit(port)
+
+            # The port is written while bulk rows are still waiting
+            for _ in range(100):
+                if scheduler.lanes[URGENT].files:
+                    break
+                time.sleep(0.01)
+
+            self.assertEqual(len(scheduler.lanes[URGENT].files), 1)
+            self.assertEqual(scheduler.lanes[BULK].files, [])
+
+        bulk = scheduler.lanes[BULK].files
+        self.assertEqual(len(bulk), 1)
+        self.assertEqual(
+            [os.path.basename(p) for p in scheduler.files],
+            ["IPNDUPXXXXX.0000001", "IPNDUPXXXXX.0000002"],
+        )
+
+        with IPNDFile(bulk[0]) as f:
+            self.assertEqual(len(f), 10)
+
+    def test_bulk_errors(self):
+        errors = []
+        scheduler = Scheduler.create(
+            source="XXXXX",
+            allocator=SequenceAllocator(1),
+            directory=os.path.join(self.directory, "missing"),
+            bulk_age=60,
+            max_bytes=905 * 4,
+            on_error=lambda row, e: errors.append(row[0:10]),
+        )
+
+        with scheduler:
+            # Invalid bulk transactions are rejected before they are queued
+            with self.assertRaises(ValueError):
+                scheduler.submit(record.Transaction())
+
+            # Two rows fill a file, which can not be written
+            scheduler.submit(self.get_transaction("0749700000"))
+            scheduler.submit(self.get_transaction("0749700001"))
+
+            for _ in range(100):
+                if errors:
+                    break
+                time.sleep(0.01)
+
+        self.assertEqual(errors, ["0749700001"])
+        self.assertEqual(len(scheduler.errors), 1)
+
+
+class IpndDiffTests(IpndFileTests):
+    """
+    IPND File Diff Tests
+    """
+
+    def write(self, seq, transactions):
+        with Writer(source="XXXXX", seq=seq, directory=self.directory) as writer:
+            for t in transactions:
+                writer.add_transaction(t)
+
+        return writer.files[0]
+
+    def check(self, order):
+        old = [self.get_transaction("07497{:05d}".format(n)) for n in (0, 1, 2, 3)]
+        new = [self.get_transaction("07497{:05d}".format(n)) for n in (0, 1, 3, 4)]
+
+        new[1] = self.get_transaction("0749700001", status="D")
+        new[2].add_entry(record.TransactionDate(datetime.now()))
+
+        old_path = self.write(1, old)
+        new_path = self.write(2, [new[n] for n in order])
+
+        changes = sorted(diff_files(old_path, new_path, ignore=["TransactionDate"]))
+
+        self.assertEqual(
+            [(c.kind, c.public_number) for c in changes],
+            [
+                ("added", "0749700004"),
+                ("changed", "0749700001"),
+                ("removed", "0749700002"),
+            ],
+        )
+        self.assertEqual(changes[1].fields, [("ServiceStatusCode", "C", "D")])
+
+        self.assertEqual(len(list(diff_files(old_path, new_path))), 4)
+
+        # Every key spilled to its own run
+        self.assertEqual(
+            sorted(diff_files(old_path, new_path, ["TransactionDate"], memory=1)),
+            changes,
+        )
+
+    def test_sorted(self):
+        self.check([0, 1, 2, 3])
+
+    def test_unsorted(self):
+        self.check([3, 1, 0, 2])
+
+    def check_files(self, order):
+        get = self.get_transaction
+        old = [
+            self.write(1, [get("0749700000"), get("0749700002")]),
+            self.write(2, [get("0749700001"), get("0749700003")]),
+        ]
+        # 0749700001 is changed in the first new file and back in the second
+        new = [
+            self.write(3, [get("0749700001", status="D"), get("0749700004")]),
+            self.write(4, [get(n) for n in order]),
+        ]
+
+        changes = sorted(diff_files(old, new))
+
+        self.assertEqual(
+            [(c.kind, c.public_number) for c in changes],
+            [("added", "0749700004"), ("removed", "0749700002")],
+        )
+
+        self.assertEqual(sorted(diff_files(old, new, memory=1)), changes)
+
+        self.assertEqual(cli.main(["diff", "--old", old[0], "--new", new[0]]), 1)
+        self.assertEqual(cli.main(["diff", old[0], old[0]]), 0)
+
+    def test_sorted_files(self):
+        self.check_files(["0749700000", "0749700001", "0749700003"])
+
+    def test_unsorted_files(self):
+        self.check_files(["0749700003", "0749700001", "0749700000"])
+
+
+class IpndBlockFileTests(IpndFileTests):
+    """
+    IPND Compressed Block File Tests
+    """
+
+    def test_blocks(self):
+        path = os.path.join(self.directory, "blocks")
+
+        with BlockFile(path, "w", cache_size=1) as blocks:
+            first = blocks.append(b"a" * 1000)
+            second = blocks.append(b"b" * 10)
+
+            self.assertEqual(blocks.read(second), b"b" * 10)
+            self.assertEqual(blocks.read(first), b"a" * 1000)
+
+        with BlockFile(path) as blocks:
+            third = blocks.append(b"c")
+            self.assertEqual(blocks.read(second), b"b" * 10)
+            self.assertEqual(blocks.read(third), b"c")
+
+        with BlockFile(path, "r") as blocks:
+            self.assertEqual(blocks.read(first), b"a" * 1000)
+
+
+class IpndArchiveTests(IpndFileTests):
+    """
+    IPND Compressed Archive Tests
+    """
+
+    def test_archive(self):
+        nums = ["07497{:05d}".format(n) for n in (5, 1, 7, 3, 9, 0, 2)]
+
+        with Writer(source="XXXXX", seq=2, directory=self.directory) as writer:
+            for num in nums:
+                writer.add_transaction(self.get_transaction(num))
+
+        content = self.read(writer.files[0])
+        gzipped = writer.files[0] + ".gz"
+        with gzip.open(gzipped, "wb") as fp:
+            fp.write(content.encode("latin-1"))
+
+        path = os.path.join(self.directory, "archive")
+        archive_file(gzipped, path, block_rows=3)
+
+        with ArchiveReader(path) as archive, IPNDFile(writer.files[0]) as f:
+            self.assertEqual(len(archive), 7)
+            self.assertEqual(len(archive.blocks), 3)
+            self.assertEqual(archive.header, f.header)
+            self.assertEqual(archive.footer, f.footer)
+
+            self.assertEqual(archive.row(4), f.row(4))
+            self.assertEqual(archive.row(6), f.row(6))
+            self.assertEqual(list(archive.iter_rows()), list(f.rows()))
+
+            self.assertEqual(archive.lookup("0749700003"), [f.row(3)])
+            self.assertEqual(archive.lookup("0749700004"), [])
+
+            with self.assertRaises(IndexError):
+                archive.row(7)
+
+
+class IpndMemoTests(IpndBaseTests):
+    """
+    IPND Memoized Rendering Tests
+    """
+
+    def test_cached(self):
+        t = self.get_transaction("0749700000")
+
+        row = t.render()
+
+        self.assertIs(t.render(), row)
+        self.assertEqual(t.generate(), list(record.BaseRecord.generate(t)))
+        self.assertEqual(row, "".join(record.BaseRecord.generate(t)))
+
+    def test_invalidated(self):
+        t = self.get_transaction("0749700000")
+        row = t.render()
+
+        t.get_entry(record.CustomerContact).entity.set_contactnum("0402999999")
+        self.assertIn("0402999999", t.render())
+
+        t.get_entry(record.ServiceAddress).address.set_street_number("99")
+        self.assertEqual(
+            layout.parse_row(t.render(), layout.LEAF_FIELDS)["ServiceAddress.HouseNum"],
+            "99",
+        )
+
+        t.add_entry(record.ListCode("LE"))
+        self.assertEqual(layout.parse_row(t.render())["ListCode"], "LE")
+
+        self.assertNotEqual(t.render(), row)
+        self.assertEqual(t.render(), "".join(record.BaseRecord.generate(t)))
+
+
+class IpndParallelTests(IpndFileTests):
+    """
+    IPND Parallel Rendering Tests
+    """
+
+    def get_ipnd(self, count):
+        ipnd = IPND(source="TEST", seq=1, date=self.get_date())
+        for n in range(count):
+            ipnd.add_transaction(self.get_transaction("07497{:05d}".format(n)))
+        return ipnd
+
+    def test_matches_string(self):
+        ipnd = self.get_ipnd(50)
+
+        for processes in (1, 3):
+            path = os.path.join(self.directory, "IPNDUPTEST.{}".format(processes))
+            ipnd.generate_to_file(path, processes=processes)
+
+            self.assertEqual(self.read(path), ipnd.generate_to_string())
+            self.assertEqual(verify(path), [])
+
+    def test_empty(self):
+        with self.assertRaises(ValueError):
+            self.get_ipnd(0).generate_to_file(os.path.join(self.directory, "x"))
+
+    def test_packed(self):
+        ipnd = self.get_ipnd(20)
+        ipnd.add_transaction(self.get_transaction("0749799999", status="D"))
+
+        with PackedBatch.pack(ipnd.transactions) as batch:
+            try:
+                self.assertEqual(len(batch), 21)
+                for n, t in enumerate(ipnd.transactions):
+                    self.assertEqual(batch.row(n).decode("latin-1"), t.render())
+            finally:
+                batch.unlink()
+
+        path = os.path.join(self.directory, "IPNDUPTEST.0000001")
+        render_to_file(
+            ipnd.transactions,
+            path,
+            "TEST",
+            1,
+            self.get_date(),
+            processes=2,
+            packed=True,
+        )
+        self.assertEqual(self.read(path), ipnd.generate_to_string())
+
+
+class IpndColumnsTests(IpndFileTests):
+    """
+    IPND Column Projection Tests
+    """
+
+    def write_file(self):
+        writer = Writer(source="TEST", seq=1, directory=self.directory)
+        with writer:
+            for n in range(7):
+                t = self.get_transaction("07497{:05d}".format(n))
+                if n % 3 == 0:
+                    t.add_entry(record.ListCode("LE"))
+                writer.add_transaction(t)
+
+        return writer.files[0]
+
+    def test_project(self):
+        with IPNDFile(self.write_file()) as f:
+            columns = project(f, ["PublicNumber", "ListCode"], first=2, last=4)
+
+        self.assertEqual(
+            [bytes(v).rstrip() for v in columns["PublicNumber"]],
+            [b"0749700002", b"0749700003"],
+        )
+        self.assertEqual([bytes(v) for v in columns["ListCode"]], [b"UL", b"LE"])
+
+    def test_group_count(self):
+        path = self.write_file()
+
+        with IPNDFile(path) as f:
+            self.assertEqual(group_count(f, "ListCode"), {"LE": 3, "UL": 4})
+            self.assertEqual(
+                group_count(f, ["ListCode", "ServiceAddress.State"], last=3),
+                {("LE", "ACT"): 1, ("UL", "ACT"): 2},
+            )
+
+        self.assertEqual(
+            count_files([path, path], "ListCode", processes=2, chunk_rows=2),
+            {"LE": 6, "UL": 8},
+        )
+
+
+class IpndHoldingsTests(IpndFileTests):
+    """
+    IPND Number Holdings Tests
+    """
+
+    def setUp(self):
+        super().setUp()
+
+        path = os.path.join(self.directory, "holdings.txt")
+        with open(path, "w") as fp:
+            fp.write("# Allocated blocks\n")
+            fp.write("0749700000-0749700999\n")
+            fp.write("+61 7 4970 1000 - +61 7 4970 1999\n")
+            fp.write("0262000000\n")
+            fp.write("1300000000-1300000099\n")
+
+        self.holdings = Holdings.load(path)
+
+    def tearDown(self):
+        record.PublicNumber.holdings = None
+        super().tearDown()
+
+    def test_normalise(self):
+        self.assertEqual(normalise_number("+61 7 4970 0000"), "0749700000")
+        self.assertEqual(normalise_number("61749700000"), "0749700000")
+        self.assertEqual(normalise_number("+611300000000"), "1300000000")
+        self.assertEqual(normalise_number("(07) 4970-0000"), "0749700000")
+
+        with self.assertRaises(record.ValidationError):
+            normalise_number("07 4970 000A")
+
+    def test_contains(self):
+        # Adjacent blocks are merged
+        self.assertEqual(len(self.holdings), 3)
+
+        self.assertIn("0749700000", self.holdings)
+        self.assertIn("+61749701999", self.holdings)
+        self.assertIn("0262000000", self.holdings)
+        self.assertIn("1300000050", self.holdings)
+        self.assertNotIn("0749702000", self.holdings)
+        self.assertNotIn("0262000001", self.holdings)
+        self.assertNotIn("749700000", self.holdings)
+        self.assertNotIn("not a number", self.holdings)
+
+    def test_transactions(self):
+        record.PublicNumber.holdings = self.holdings
+
+        t = self.get_transaction("+61 7 4970 0001")
+        self.assertEqual(t.get_entry(record.PublicNumber).value, "0749700001")
+
+        with self.assertRaises(record.ValidationError):
+            self.get_transaction("0749799999")
+
+        record.PublicNumber.holdings = None
+        transactions = [self.get_transaction(n) for n in ("0749700001", "0749799999")]
+
+        errors = self.holdings.validate(transactions)
+        self.assertEqual([n for n, _ in errors], [1])
+
+    def test_generate(self):
+        items = list(read_inventory(self.write_inventory(count=3)))
+        items[1]["number"] = "0749799998"
+        items[2]["number"] = "+61 7 4970 0002"
+
+        writer = Writer(source="XXXXX", seq=1, directory=self.directory)
+        with writer:
+            stats = generate(
+                items, writer, csp="123", dp="456", processes=2, holdings=self.holdings
+            )
+
+        self.assertEqual([n for n, _ in stats.rejected], [1, 3])
+
+        with IPNDFile(writer.files[0]) as f:
+            self.assertEqual(
+                [row[0:10] for row in f.rows()], ["0749700000", "0749700002"]
+            )
+
+
+class IpndAddressParserTests(IpndBaseTests):
+    """
+    IPND Free Text Address Tests
+    """
+
+    def fields(self, address):
+        t = self.get_transaction("0749700000")
+        t.add_entry(record.ServiceAddress(address))
+
+        fields = layout.parse_row(t.render(), layout.LEAF_FIELDS)
+        return {
+            k.split(".", 1)[1]: v
+            for k, v in fields.items()
+            if k.startswith("ServiceAddress.") and v
+        }
+
+    def test_house(self):
+        address = parse_address(" 45-47  st kilda rd, Melbourne VIC 3004 ")
+
+        self.assertIsInstance(address, record.HouseAddress)
+        self.assertEqual(
+            self.fields(address),
+            {
+                "HouseNum": "45",
+                "HouseNum_2": "47",
+                "StreetName": "ST KILDA",
+                "StreetType": "RD",
+                "Locality": "MELBOURNE",
+                "State": "VIC",
+                "Postcode": "3004",
+            },
+        )
+
+    def test_building(self):
+        address = parse_address(
+            "Unit 3, Level 2, 45A Smith Street North, Canberra ACT 2600"
+        )
+
+        self.assertIsInstance(address, record.BuildingAddress)
+        fields = self.fields(address)
+        self.assertEqual(fields["BuildingType"], "UNIT")
+        self.assertEqual(fields["BuildingNum"], "3")
+        self.assertEqual(fields["BuildingFloorType"], "L")
+        self.assertEqual(fields["BuildingFloorNr"], "2")
+        self.assertEqual(fields["HouseSuffix"], "A")
+        self.assertEqual(fields["StreetSuffix"], "N")
+
+        self.assertEqual(
+            self.fields(parse_address("3/45 Smith St, Canberra ACT 2600")),
+            self.fields(parse_address("Unit 3, 45 Smith St, Canberra ACT 2600")),
+        )
+
+    def test_floor_only(self):
+        address = parse_address("Level 2, 45 Smith St, Canberra ACT 2600")
+
+        self.assertIsInstance(address, record.BuildingAddress)
+        fields = self.fields(address)
+        self.assertNotIn("BuildingType", fields)
+        self.assertNotIn("BuildingNum", fields)
+        self.assertEqual(fields["BuildingFloorType"], "L")
+        self.assertEqual(fields["BuildingFloorNr"], "2")
+        self.assertEqual(fields["HouseNum"], "45")
+
+    def test_cached(self):
+        a = parse_address("12 Fake St, North Sydney NSW 2060")
+
+        self.assertIs(a, parse_address("12 FAKE ST,NORTH SYDNEY  NSW 2060"))
+        self.assertTrue(a.frozen)
+        self.assertEqual(self.fields(a)["Locality"], "NORTH SYDNEY")
+
+        with self.assertRaises(record.FrozenError):
+            a.set_street_number("13")
+
+        with self.assertRaises(record.ValidationError):
+            parse_address("somewhere over the rainbow")
+
+
+class IpndShardTests(IpndFileTests):
+    """
+    IPND Sharded Generation Tests
+    """
+
+    def test_shard_of(self):
+        self.assertEqual(shard_of("0749700000", 4), shard_of(" 0749700000 ", 4))
+        self.assertEqual(
+            len({shard_of("07497{:05d}".format(n), 4) for n in range(100)}), 4
+        )
+
+        partition = range_partition(["0749700003", "0749700006"])
+        self.assertEqual(
+            [partition("07497{:05d}".format(n)) for n in range(0, 9, 2)],
+            [0, 0, 1, 2, 2],
+        )
+
+    def test_merge(self):
+        path = self.write_inventory(count=20)
+        items = list(read_inventory(path))
+        date = self.get_date()
+
+        # Local processes stand in for hosts
+        segments = [
+            os.path.join(self.directory, "segment.{}".format(n)) for n in range(3)
+        ]
+        with multiprocessing.Pool(3) as pool:
+            results = pool.starmap(
+                generate_shard,
+                [(items, n, 3, segments[n], "999", "YYYYYY", date) for n in range(3)],
+            )
+
+        self.assertEqual(sum(r.rows for r in results), 20)
+        self.assertEqual(sum(len(r.rejected) for r in results), 1)
+
+        sharded = os.path.join(self.directory, "sharded")
+        os.mkdir(sharded)
+        writer = Writer("TEST", 1, directory=sharded, date=date, max_rows=8)
+        self.assertEqual(merge_segments(segments, writer), 20)
+        self.assertEqual(len(writer.files), 3)
+
+        single = os.path.join(self.directory, "single")
+        os.mkdir(single)
+        expected = Writer("TEST", 1, directory=single, date=date, max_rows=8)
+        with SortedWriter(expected) as sorted_writer:
+            for item in items[:-1]:
+                sorted_writer.add_transaction(
+                    build_transaction(item, "999", "YYYYYY", date=date)
+                )
+
+        for a, b in zip(writer.files, expected.files):
+            self.assertEqual(self.read(a), self.read(b))
+
+    def test_truncated(self):
+        items = list(read_inventory(self.write_inventory(count=10)))
+        segment = os.path.join(self.directory, "segment")
+        generate_shard(items, 0, 1, segment, "999", "YYYYYY", self.get_date())
+
+        with open(segment, "r+b") as fp:
+            fp.truncate(os.path.getsize(segment) - 100)
+
+        merged = os.path.join(self.directory, "merged")
+        os.mkdir(merged)
+        writer = Writer("TEST", 1, directory=merged, max_rows=4)
+
+        with self.assertRaises(ValueError):
+            merge_segments([segment], writer)
+        self.assertEqual(writer.files, [])
+
+        with contextlib.redirect_stderr(io.StringIO()) as stderr:
+            status = cli.main(
+                [
+                    "merge",
+                    "--source",
+                    "TEST",
+                    "--seq",
+                    "1",
+                    "--directory",
+                    merged,
+                    segment,
+                ]
+            )
+        self.assertEqual(status, 1)
+        self.assertIn("truncated", stderr.getvalue())
+        self.assertEqual(os.listdir(merged), [])
+
+    def test_failed_merge(self):
+        items = list(read_inventory(self.write_inventory(count=10)))
+        segment = os.path.join(self.directory, "segment")
+        generate_shard(items, 0, 1, segment, "999", "YYYYYY", self.get_date())
+
+        writer = Writer("TEST", 1, directory=self.directory, max_rows=4)
+        rows = []
+
+        def write_row(row):
+            if len(rows) == 6:
+                raise OSError("disk full")
+            rows.append(row)
+            Writer.write_row(writer, row)
+
+        writer.write_row = write_row  # type: ignore
+
+        with self.assertRaises(OSError):
+            merge_segments([segment], writer)
+
+        # The first file was finished, the one in progress was not
+        self.assertEqual(verify(writer.files[0]), [])
+        self.assertNotEqual(verify(writer.files[1]), [])
+
+
+class IpndFanOutTests(IpndFileTests):
+    """
+    IPND Fan Out Writer Tests
+    """
+
+    def test_fan_out(self):
+        items = list(read_inventory(self.write_inventory(count=9)))[:-1]
+        for n, item in enumerate(items):
+            item["csp"] = "111" if n % 3 else "222"
+
+        writer = FanOutWriter(
+            {"111": "AAAAA", "222": "BBBBB"},
+            seq={"BBBBB": 5},
+            directory=self.directory,
+            date=self.get_date(),
+            max_rows=4,
+        )
+        stats = generate(items, writer, csp="999", dp="YYYYYY", processes=2)
+
+        self.assertEqual(stats.rows, 9)
+        self.assertEqual(
+            sorted(os.path.basename(path) for path in stats.files),
+            ["IPNDUPAAAAA.0000001", "IPNDUPAAAAA.0000002", "IPNDUPBBBBB.0000005"],
+        )
+
+        # Each source's files are what a pass over its own items would write
+        for csp, source, seq in (("111", "AAAAA", 1), ("222", "BBBBB", 5)):
+            directory = os.path.join(self.directory, source)
+            os.mkdir(directory)
+
+            expected = Writer(source, seq, directory, self.get_date(), max_rows=4)
+            generate([i for i in items if i["csp"] == csp], expected, "999", "YYYYYY")
+
+            for a, b in zip(writer.writers[source].files, expected.files):
+                self.assertEqual(self.read(a), self.read(b))
+
+    def test_unrouted(self):
+        writer = FanOutWriter({"111": "AAAAA"}, directory=self.directory)
+
+        with self.assertRaises(record.ValidationError):
+            writer.add_transaction(self.get_transaction("0749700000"))
+
+    def test_command(self):
+        inventory = self.write_inventory()
+        args = ["generate", inventory, "--dp=YYYYYY", "-d", self.directory]
+
+        status = cli.main(
+            args + ["--csp=999", "--route=999=AAAAA:3", "--route=888=BBBBB:7"]
+        )
+
+        # The invalid inventory item fails the run
+        self.assertEqual(status, 1)
+        self.assertTrue(
+            os.path.exists(os.path.join(self.directory, "IPNDUPAAAAA.0000003"))
+        )
+
+        # Every source needs a sequence number, and only one
+        self.assertEqual(cli.main(args + ["--csp=999", "--route=999=AAAAA"]), 2)
+        self.assertEqual(
+            cli.main(
+                args + ["--csp=999", "--route=999=AAAAA:3", "--route=888=AAAAA:4"]
+            ),
+            2,
+        )
+
+
+class IpndExportTests(IpndFileTests):
+    """
+    IPND Structured Export Tests
+    """
+
+    def test_tuples(self):
+        transactions = [self.get_transaction("07497{:05d}".format(n)) for n in range(3)]
+
+        rows = list(export.iter_tuples(transactions))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1].PublicNumber, "0749700001")
+        self.assertEqual(rows[1]._asdict(), layout.parse_row(transactions[1].render()))
+
+        fields = export.get_fields(["PublicNumber", "ServiceAddress.State"])
+        rows = list(export.iter_tuples([t.render() for t in transactions], fields))
+        self.assertEqual(rows[0].ServiceAddress_State, "ACT")
+        self.assertIs(type(rows[0]), type(rows[2]))
+
+        columns = export.to_columns(transactions, fields)
+        self.assertEqual(columns["ServiceAddress.State"], ["ACT"] * 3)
+
+    def test_write(self):
+        transactions = [self.get_transaction("07497{:05d}".format(n)) for n in range(3)]
+        fields = export.get_fields(["PublicNumber", "ListCode"])
+
+        path = os.path.join(self.directory, "export.csv")
+        self.assertEqual(export.write_csv(transactions, path, fields), 3)
+        self.assertEqual(
+            self.read(path).splitlines()[0:2],
+            ["PublicNumber,ListCode", "0749700000,UL"],
+        )
+
+        path = os.path.join(self.directory, "export.jsonl")
+        self.assertEqual(export.write_jsonl(transactions, path, fields), 3)
+        self.assertEqual(
+            json.loads(self.read(path).splitlines()[2]),
+            {"PublicNumber": "0749700002", "ListCode": "UL"},
+        )
+
+
+class IpndMemoryTests(IpndFileTests):
+    """
+    IPND Memory Profiling Tests
+    """
+
+    def test_profile(self):
+        with MemoryProfiler(enabled=True) as profiler:
+            ipnd = IPND(source="TEST", seq=1, date=self.get_date())
+
+            with profiler.stage("build"):
+                for n in range(200):
+                    ipnd.add_transaction(self.get_transaction("07497{:05d}".format(n)))
+
+            with profiler.stage("render"):
+                ipnd.generate_to_string()
+
+            classes = profiler.snapshot()
+
+        self.assertEqual(list(profiler.stages), ["build", "render"])
+        self.assertGreater(profiler.stages["build"].peak, 0)
+        self.assertGreaterEqual(profiler.peak, profiler.stages["build"].peak)
+
+        self.assertEqual(classes["Transaction"].instances, 200)
+        self.assertGreater(classes["Transaction"].bytes, 0)
+        self.assertIn("Transaction", profiler.report())
+
+    def test_disabled(self):
+        profiler = MemoryProfiler(enabled=False)
+
+        with profiler, profiler.stage("build"):
+            self.get_transaction("0749700000")
+
+        self.assertEqual(profiler.stages, {})
+        self.assertEqual(profiler.snapshot(), {})
+
+    def test_pipeline(self):
+        items = list(range(50))
+
+        with MemoryProfiler(enabled=True) as profiler:
+            pipeline = Pipeline(
+                [Stage("build", lambda n: [n] * 1000)],
+                sink=lambda value: None,
+                profiler=profiler,
+            )
+            pipeline.run(items)
+
+        self.assertEqual(sorted(profiler.stages), ["build", "sink"])
+        self.assertGreater(profiler.stages["build"].peak, 0)
+        self.assertGreaterEqual(
+            profiler.stages["build"].retained, profiler.stages["build"].peak
+        )
+        self.assertIn("in flight", profiler.snapshots)
+
+    def test_ipnd(self):
+        with MemoryProfiler(enabled=True) as profiler:
+            ipnd = IPND(source="TEST", seq=1, date=self.get_date(), profiler=profiler)
+            for n in range(20):
+                ipnd.add_transaction(self.get_transaction("07497{:05d}".format(n)))
+
+            ipnd.generate_to_string()
+
+        self.assertEqual(profiler.snapshots["built"]["Transaction"].instances, 20)
+        self.assertIn("render", profiler.stages)
+
+    def test_run_inventory(self):
+        items = list(read_inventory(self.write_inventory(count=50)))
+        writer = Writer("XXXXX", 1, self.directory)
+
+        with MemoryProfiler(enabled=True) as profiler:
+            run_inventory(items, writer, "999", "YYYYYY", maxsize=10, profiler=profiler)
+
+        self.assertGreater(profiler.snapshots["in flight"]["Transaction"].instances, 0)
+
+    def test_command(self):
+        inventory = self.write_inventory()
+        stderr = io.StringIO()
+        os.environ["IPND_PROFILE_MEMORY"] = "1"
+
+        try:
+            with contextlib.redirect_stderr(stderr), contextlib.redirect_stdout(
+                io.StringIO()
+            ):
+                cli.main(
+                    [
+                        "generate",
+                        inventory,
+                        "--source=XXXXX",
+                        "--seq=1",
+                        "--csp=999",
+                        "--dp=YYYYYY",
+                        "--directory={}".format(self.directory),
+                    ]
+                )
+        finally:
+            del os.environ["IPND_PROFILE_MEMORY"]
+
+        self.assertIn("Peak traced memory", stderr.getvalue())
+        self.assertIn("render", stderr.getvalue())
+        self.assertIn("Class (building)", stderr.getvalue())
+        self.assertIn("Transaction ", stderr.getvalue())
+
+
+class IpndEngineTests(IpndFileTests):
+    """
+    IPND Rendering Engine Tests
+    """
+
+    def get_ipnd(self, engine):
+        ipnd = IPND(source="TEST", seq=1, date=self.get_date(), engine=engine)
+        for n in range(20):
+            ipnd.add_transaction(self.get_transaction("07497{:05d}".format(n)))
+        return ipnd
+
+    @staticmethod
+    def broken(t):
+        # Renders the wrong ListCode for every fifth number
+        row = t.render()
+        if row[9] == "5" or row[9] == "0":
+            row = layout.set_field(row, "ListCode", "LE")
+        return row
+
+    def test_engines(self):
+        expected = self.get_ipnd("reference").generate_to_string()
+
+        self.assertEqual(self.get_ipnd(None).generate_to_string(), expected)
+        self.assertEqual(self.get_ipnd("memoized").generate_to_string(), expected)
+
+        engines.register_engine("broken", self.broken)
+        try:
+            self.assertNotEqual(self.get_ipnd("broken").generate_to_string(), expected)
+        finally:
+            del engines.ENGINES["broken"]
+
+        with self.assertRaises(KeyError):
+            self.get_ipnd("missing").generate_to_string()
+
+    def test_checker(self):
+        found = []
+        checker = engines.EquivalenceChecker(
+            self.broken, fraction=1.0, on_mismatch=found.append
+        )
+
+        output = self.get_ipnd(checker).generate_to_string()
+
+        self.assertEqual(output, self.get_ipnd(self.broken).generate_to_string())
+        self.assertEqual(
+            (checker.rendered, checker.checked, checker.failed), (20, 20, 4)
+        )
+        self.assertEqual(found, checker.mismatches)
+        self.assertEqual(found[0].public_number, "0749700000")
+        self.assertEqual(found[0].field, "ListCode")
+        self.assertEqual(found[0].offset, layout.get_field("ListCode").offset)
+        self.assertIn("4 mismatched", checker.report())
+
+        checker = engines.EquivalenceChecker("memoized", fraction=0.5, seed=1)
+        self.get_ipnd(checker).generate_to_string()
+        self.assertEqual(checker.failed, 0)
+        self.assertTrue(0 < checker.checked < 20)
+
+    def test_checker_processes(self):
+        found = []
+        checker = engines.EquivalenceChecker(
+            self.broken, fraction=1.0, on_mismatch=found.append
+        )
+
+        copy = pickle.loads(pickle.dumps(checker))
+        self.assertEqual((copy.rendered, copy.on_mismatch), (0, None))
+
+        ipnd = self.get_ipnd(checker)
+        ipnd.generate_to_file(os.path.join(self.directory, "parallel"), processes=2)
+        self.assertEqual(
+            (checker.rendered, checker.checked, checker.failed), (20, 20, 4)
+        )
+        self.assertEqual(sorted(m.public_number for m in found)[0], "0749700000")
+        self.assertEqual(len(found), 4)
+
+        items = list(read_inventory(self.write_inventory(count=10)))
+
+        checker = engines.EquivalenceChecker(self.broken, fraction=1.0)
+        writer = Writer("XXXXX", 1, self.directory)
+        generate(
+            items, writer, "999", "XXXXXX", processes=2, chunksize=3, engine=checker
+        )
+        self.assertEqual(
+            (checker.rendered, checker.checked, checker.failed), (10, 10, 2)
+        )
+
+        checker = engines.EquivalenceChecker(self.broken, fraction=1.0)
+        writer = Writer("YYYYY", 1, self.directory)
+        stats, _ = run_inventory(
+            items, writer, "999", "YYYYYY", 2, processes=True, engine=checker
+        )
+        self.assertEqual(stats.rows, 10)
+        self.assertEqual(
+            (checker.rendered, checker.checked, checker.failed), (10, 10, 2)
+        )
+
+    def test_packed(self):
+        checker = engines.EquivalenceChecker("packed", fraction=1.0)
+        self.get_ipnd(checker).generate_to_string()
+
+        self.assertEqual((checker.checked, checker.failed), (20, 0))
+
+    def test_every_path(self):
+        list_code = layout.get_field("ListCode")
+
+        def list_codes(path):
+            with IPNDFile(path) as f:
+                return [
+                    row[list_code.offset : list_code.offset + list_code.size].strip()
+                    for row in f.rows()
+                ]
+
+        expected = ["LE", "UL", "UL", "UL", "UL"]
+        engines.register_engine("broken", self.broken)
+
+        try:
+            ipnd = self.get_ipnd("broken")
+            self.assertEqual(ipnd.render()[1], self.broken(ipnd.transactions[0]))
+            self.assertEqual(ipnd.generate()[1], ipnd.transactions[0].generate())
+
+            path = os.path.join(self.directory, "parallel")
+            ipnd.generate_to_file(path, processes=1)
+            self.assertEqual(list_codes(path)[0:5], expected)
+
+            writer = Writer("XXXXX", 1, self.directory, engine="broken")
+            with writer:
+                for n in range(5):
+                    writer.add_transaction(
+                        self.get_transaction("07497{:05d}".format(n))
+                    )
+            self.assertEqual(list_codes(writer.files[0]), expected)
+
+            writer = Writer("YYYYY", 1, self.directory)
+            items = list(read_inventory(self.write_inventory()))
+            generate(items, writer, "999", "YYYYYY", processes=2, engine="broken")
+            self.assertEqual(list_codes(writer.files[0]), expected)
+
+            batcher = MicroBatcher(
+                "ZZZZZ", SequenceAllocator(1), self.directory, engine="broken"
+            )
+            batcher.submit(self.get_transaction("0749700000"))
+            self.assertEqual(list_codes(batcher.flush()), ["LE"])
+        finally:
+            del engines.ENGINES["broken"]